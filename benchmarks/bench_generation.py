@@ -0,0 +1,184 @@
+"""
+Benchmarks the Markov generation hot path offline, on synthetic models of several sizes.
+
+Scenarios mirror the bot's commands ($mk, $mk10 and five-way a+b+c+d+e combos) as well as their parts: model loading,
+markovify.combine, generate_sentence with and without a root, and remove_mentions. Results are written as json so that
+they can be compared across releases. Run from the repository root with:
+    python -m benchmarks.bench_generation [--sizes 200 2000 20000] [--output results.json]
+"""
+import argparse
+import contextlib
+import io
+import os
+import platform
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+import markovify
+import numpy as np
+import ujson
+
+from consts import MESSAGES_DIRECTORY
+from benchmarks import synthetic
+from helpers import compiled_model as cm
+from helpers import converter as cv
+from helpers import markov_helpers as mk
+from helpers import model_cache as mc
+from helpers import model_store as ms
+from helpers.utility import remove_mentions
+
+GUILDID = '1'
+NUM_COMBINED_USERS = 5
+ROOT_WORDS = ['the', 'lol', 'markov', 'game']
+
+
+class FakeMember(object):
+    def __init__(self, userid):
+        self.id = userid
+        self.display_name = f'user{userid}'
+
+
+class FakeGuild(object):
+    """Stands in for discord.Guild in remove_mentions."""
+    def __init__(self, userids):
+        self.id = int(GUILDID)
+        self.members = {int(userid): FakeMember(int(userid)) for userid in userids}
+
+    def get_member(self, userid):
+        return self.members.get(userid)
+
+
+def measure(func, iterations, setup=None):
+    """Runs func iterations times and returns timing statistics in milliseconds."""
+    timings = []
+    for _ in range(iterations):
+        if setup:
+            setup()
+        start_time = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start_time) * 1000)
+    timings.sort()
+    return {
+        'iterations': iterations,
+        'mean_ms': statistics.mean(timings),
+        'median_ms': statistics.median(timings),
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'min_ms': timings[0],
+        'max_ms': timings[-1]
+    }
+
+
+def clear_caches():
+    mc.MODEL_CACHE.clear()
+    mc.COMBINED_MODEL_CACHE.clear()
+
+
+def build_models(sizes):
+    """Writes synthetic message files for NUM_COMBINED_USERS users per size and converts them into models."""
+    userids = {}
+    os.makedirs(f'{MESSAGES_DIRECTORY}{GUILDID}/')
+    for size_num, size in enumerate(sizes):
+        userids[size] = [str(100000000000000000 + size_num * 100 + i) for i in range(NUM_COMBINED_USERS)]
+        for i, userid in enumerate(userids[size]):
+            corpus = synthetic.generate_corpus(size, seed=size_num * 100 + i, userids=userids[size])
+            with open(f'{MESSAGES_DIRECTORY}{GUILDID}/{userid}.txt', 'w', encoding='utf-8') as f:
+                f.write(corpus)
+    cv.convert_server(serverid=GUILDID)
+    return userids
+
+
+def run_scenarios(size, userids, iterations):
+    """Runs every scenario for the models of one size."""
+    userid = userids[0]
+    json_path = mc.get_model_path(GUILDID, userid)
+    compiled_path = mc.get_compiled_model_path(GUILDID, userid)
+    json_models = [mc.load_model(mc.get_model_path(GUILDID, curr_userid)) for curr_userid in userids]
+    compiled_model = cm.CompiledText.load(compiled_path)
+    guild = FakeGuild(userids)
+    sentences = [mk.generate_sentence(json_models[0]) or '' for _ in range(20)]
+    mention_msg = ' '.join(f'<@!{curr_userid}> {sentence}' for curr_userid, sentence in zip(userids, sentences))
+
+    scenarios = {
+        'load_json': (lambda: mc.load_model(json_path), None),
+        'load_compiled': (lambda: cm.CompiledText.load(compiled_path), None),
+        'load_packed': (lambda: ms.ModelStore(GUILDID).get_model(userid), None),
+        'generate_model_cold': (lambda: mk.get_model(GUILDID, [userid]), clear_caches),
+        'generate_model_warm': (lambda: mk.get_model(GUILDID, [userid]), None),
+        'combine_5_json': (lambda: markovify.combine(json_models), None),
+        'generate_sentence_json': (lambda: mk.generate_sentence(json_models[0]), None),
+        'generate_sentence_json_root': (lambda: mk.generate_sentence(json_models[0], random.choice(ROOT_WORDS)),
+                                        None),
+        'generate_sentence_compiled': (lambda: mk.generate_sentence(compiled_model), None),
+        'generate_sentence_compiled_root': (lambda: mk.generate_sentence(compiled_model, random.choice(ROOT_WORDS)),
+                                            None),
+        'generate_sentences_10_compiled': (lambda: mk.generate_sentences(compiled_model, 10), None),
+        'generate_sentences_10_compiled_root': (lambda: mk.generate_sentences(compiled_model, 10,
+                                                                              random.choice(ROOT_WORDS)), None),
+        'remove_mentions': (lambda: remove_mentions(mention_msg, guild), None),
+        'mk_cold': (lambda: mk.generate_markov_text(GUILDID, [userid], None, 1), clear_caches),
+        'mk_warm': (lambda: mk.generate_markov_text(GUILDID, [userid], None, 1), None),
+        'mk10_warm': (lambda: mk.generate_markov_text(GUILDID, [userid], None, 10), None),
+        'mk_combo_5_cold': (lambda: mk.generate_markov_text(GUILDID, userids, None, 1), clear_caches),
+        'mk_combo_5_warm': (lambda: mk.generate_markov_text(GUILDID, userids, None, 1), None)
+    }
+
+    results = []
+    for scenario, (func, setup) in scenarios.items():
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()  # warm up
+            stats = measure(func, iterations, setup)
+        stats.update({'scenario': scenario, 'posts_per_user': size})
+        results.append(stats)
+        print(f"{size:>7} posts  {scenario:<32} median {stats['median_ms']:9.3f} ms  p95 {stats['p95_ms']:9.3f} ms")
+    return results
+
+
+def main(args):
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+
+    cwd = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix='markov_bench_')
+    try:
+        os.chdir(work_dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            userids = build_models(args.sizes)
+        clear_caches()
+        results = []
+        for size in args.sizes:
+            results.extend(run_scenarios(size, userids[size], args.iterations))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'sizes': args.sizes,
+            'iterations': args.iterations
+        },
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            ujson.dump(report, f, indent=2)
+        print(f'Results written to {args.output}')
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generation benchmark suite for MarkovBot.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[200, 2000, 20000],
+                        help='number of posts per user of each model size (default: 200 2000 20000)')
+    parser.add_argument('--iterations', type=int, default=50, help='iterations per scenario (default: 50)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    parser.add_argument('--output', type=str, help='file to write the results to as json')
+    main(parser.parse_args())
@@ -0,0 +1,122 @@
+"""
+Benchmarks parse throughput on a synthetic server export.
+
+Compares the old per-user string concatenation (flushing every 100,000 messages) against parser.MessageWriter, and
+times a full parser.parse_server run. Run from the repository root with:
+    python -m benchmarks.bench_parse [--channels N] [--messages N] [--users N]
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import time
+
+import ujson
+
+from consts import MESSAGES_DIRECTORY, SERVER_JSON_DIRECTORY, SERVERS_FILE, POST_SEPARATOR
+from benchmarks import synthetic
+from helpers import parser as ps
+
+SERVERID = '1'
+
+
+def legacy_append_text(messages, serverid):
+    for userid, corpus in messages.items():
+        if corpus:
+            with open(f'{MESSAGES_DIRECTORY}{serverid}/{userid}.txt', 'a+', encoding='utf-8') as f:
+                f.write(corpus)
+
+
+def run_legacy(posts):
+    """The accumulation loop parse_server used before MessageWriter."""
+    messages = {}
+    msg_in_messages = 0
+    for userid, message in posts:
+        if userid not in messages.keys():
+            messages[userid] = ''
+        messages[userid] += f'{message}{POST_SEPARATOR}'
+        msg_in_messages += 1
+        if msg_in_messages >= 100000:
+            legacy_append_text(messages, SERVERID)
+            messages = {}
+            msg_in_messages = 0
+    legacy_append_text(messages, SERVERID)
+
+
+def run_writer(posts):
+    with ps.MessageWriter(SERVERID) as writer:
+        for userid, message in posts:
+            writer.add(userid, message)
+
+
+def time_run(func, *args):
+    """Times func in a clean messages directory, with its output suppressed."""
+    shutil.rmtree(MESSAGES_DIRECTORY, ignore_errors=True)
+    os.makedirs(f'{MESSAGES_DIRECTORY}{SERVERID}/')
+    with contextlib.redirect_stdout(io.StringIO()):
+        start_time = time.perf_counter()
+        func(*args)
+        return time.perf_counter() - start_time
+
+
+def read_outputs():
+    outputs = {}
+    for user_file in os.listdir(f'{MESSAGES_DIRECTORY}{SERVERID}/'):
+        with open(f'{MESSAGES_DIRECTORY}{SERVERID}/{user_file}', 'r', encoding='utf-8-sig') as f:
+            outputs[user_file] = f.read()
+    return outputs
+
+
+def main(args):
+    export = synthetic.generate_export(args.channels, args.messages, args.users, serverid=int(SERVERID))
+    userids = export['meta']['userindex']
+    posts = [(userids[message['u']], message['m'])
+             for channel in export['data'].values() for message in channel.values()]
+    num_posts = len(posts)
+
+    results = {'posts': num_posts, 'users': args.users}
+    cwd = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix='markov_bench_')
+    try:
+        os.chdir(work_dir)
+
+        results['legacy_seconds'] = time_run(run_legacy, posts)
+        legacy_outputs = read_outputs()
+        results['writer_seconds'] = time_run(run_writer, posts)
+        if read_outputs() != legacy_outputs:
+            raise AssertionError('MessageWriter output differs from the legacy output.')
+
+        os.makedirs(SERVER_JSON_DIRECTORY)
+        with open(f'{SERVER_JSON_DIRECTORY}benchmark.json', 'w', encoding='utf-8') as f:
+            ujson.dump(export, f)
+        with open(SERVERS_FILE, 'w', encoding='utf-8') as f:
+            f.write(f'{SERVERID};benchmark\n')
+        results['parse_server_seconds'] = time_run(ps.parse_server, 'benchmark.json')
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for name in ['legacy', 'writer', 'parse_server']:
+        results[f'{name}_posts_per_second'] = num_posts / results[f'{name}_seconds']
+    results['speedup'] = results['legacy_seconds'] / results['writer_seconds']
+
+    print(f"{num_posts} posts by {args.users} users")
+    print(f"legacy concatenation: {results['legacy_seconds']:.2f}s ({results['legacy_posts_per_second']:,.0f} posts/s)")
+    print(f"MessageWriter:        {results['writer_seconds']:.2f}s ({results['writer_posts_per_second']:,.0f} posts/s)")
+    print(f"full parse_server:    {results['parse_server_seconds']:.2f}s "
+          f"({results['parse_server_posts_per_second']:,.0f} posts/s)")
+    print(f"speedup: {results['speedup']:.1f}x")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            ujson.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parse throughput benchmark for MarkovBot.')
+    parser.add_argument('--channels', type=int, default=10, help='number of channels (default: 10)')
+    parser.add_argument('--messages', type=int, default=20000, help='messages per channel (default: 20000)')
+    parser.add_argument('--users', type=int, default=20, help='number of users (default: 20)')
+    parser.add_argument('--output', type=str, help='file to write the results to as json')
+    main(parser.parse_args())
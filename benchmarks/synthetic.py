@@ -0,0 +1,73 @@
+"""Generates synthetic, Discord-like data for the benchmarks."""
+import random
+
+from consts import POST_SEPARATOR
+
+WORDS = ['the', 'a', 'i', 'you', 'is', 'it', 'to', 'and', 'of', 'that', 'lol', 'lmao', 'yeah', 'no', 'what',
+         'why', 'just', 'like', 'dont', 'know', 'think', 'game', 'server', 'bot', 'markov', 'chain', 'post', 'meme',
+         'good', 'bad', 'based', 'cringe', 'today', 'tomorrow', 'never', 'always', 'really', 'pretty', 'much',
+         'anyone', 'here', 'there', 'gonna', 'wanna', 'cat', 'dog', 'food', 'sleep', 'work', 'school', 'music']
+EMOJI = [':)', ':(', ':D', 'xD', ':joy:', ':thinking:', ':pog:', '<:pepega:123456789012345678>']
+LINKS = ['https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'https://cdn.discordapp.com/attachments/1/2/image.png',
+         'https://twitter.com/someone/status/1234567890', 'https://en.wikipedia.org/wiki/Markov_chain']
+
+
+def generate_post(rng, userids=None):
+    """Generates a single Discord-like post."""
+    words = [rng.choice(WORDS) for _ in range(max(1, int(rng.expovariate(1 / 10))))]
+    if rng.random() < 0.1:
+        words.insert(rng.randrange(len(words) + 1), rng.choice(EMOJI))
+    if userids and rng.random() < 0.05:
+        words.insert(0, f'<@!{rng.choice(userids)}>')
+    if rng.random() < 0.03:
+        words.append(rng.choice(LINKS))
+    post = ' '.join(words)
+    if rng.random() < 0.3:
+        post = post.capitalize()
+    if rng.random() < 0.2:
+        post += rng.choice(['.', '!', '?', '...', '!!'])
+    return post
+
+
+def generate_posts(num_posts, seed=0, userids=None):
+    """Generates a list of num_posts posts."""
+    rng = random.Random(seed)
+    return [generate_post(rng, userids) for _ in range(num_posts)]
+
+
+def generate_corpus(num_posts, seed=0, userids=None):
+    """Generates the contents of a user's message file, i.e. posts joined by POST_SEPARATOR."""
+    return POST_SEPARATOR.join(generate_posts(num_posts, seed, userids)) + POST_SEPARATOR
+
+
+def generate_export(num_channels, messages_per_channel, num_users, seed=0, serverid=1, timestamp=1600000000000):
+    """
+    Generates a server json export in the DiscordHistoryTracker format used by parser.parse_server.
+    Message ids increase like Discord snowflakes, and users post following a Zipf-like distribution.
+    """
+    rng = random.Random(seed)
+    userids = [str(100000000000000000 + i) for i in range(num_users)]
+    weights = [1 / (i + 1) for i in range(num_users)]
+    export = {
+        'meta': {
+            'users': {userid: {'name': f'user{i}'} for i, userid in enumerate(userids)},
+            'userindex': userids,
+            'servers': [{'name': 'benchmark', 'id': serverid, 'type': 'SERVER'}],
+            'channels': {}
+        },
+        'data': {}
+    }
+    messageid = 700000000000000000
+    for channel_num in range(num_channels):
+        channelid = str(200000000000000000 + channel_num)
+        export['meta']['channels'][channelid] = {'server': 0, 'name': f'channel{channel_num}'}
+        channel = export['data'][channelid] = {}
+        user_indexes = rng.choices(range(num_users), weights=weights, k=messages_per_channel)
+        for i, user_index in enumerate(user_indexes):
+            messageid += rng.randint(1, 1 << 22)
+            channel[str(messageid)] = {
+                'u': user_index,
+                't': timestamp + (channel_num * messages_per_channel + i) * 1000,
+                'm': generate_post(rng, userids)
+            }
+    return export
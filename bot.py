@@ -6,6 +6,9 @@ from discord.ext import commands
 
 import config
 from consts import DESCRIPTION, DEFAULT_NAME
+from helpers import channel_permissions as cp
+from helpers import generation_pool as gp
+from helpers import metrics
 
 intents = discord.Intents.default()
 intents.members = True
@@ -31,6 +34,9 @@ class MarkovBot(commands.Bot):
         self.token = config.token
         self.default_nick = DEFAULT_NAME
         self.add_command(self.load)
+        self.metrics = None
+        cp.load()
+        self.loop.create_task(self.start_metrics())
 
         for extension in extensions_generator():
             try:
@@ -53,6 +59,21 @@ class MarkovBot(commands.Bot):
         """Runs the bot with the token from the config file."""
         super().run(self.token, reconnect=True)
 
+    async def start_metrics(self):
+        """Starts serving and/or dumping the metrics of the bot."""
+        try:
+            self.metrics = await metrics.start()
+        except OSError as e:
+            print(f'Unable to serve metrics: {e}')
+
+    async def close(self):
+        """Shuts down the generation pool and the metrics along with the bot."""
+        if gp.POOL is not None:
+            gp.POOL.shutdown()
+        if self.metrics is not None:
+            await metrics.stop(*self.metrics)
+        await super().close()
+
     # async def on_member_update(self, before, after):
     #     """Resets bot's nickname anytime it is changed."""
     #     if before.id == self.user.id and before.nick != after.nick:
@@ -1,4 +1,9 @@
+from helpers import admission as adm
 from helpers import channel_permissions as cp
+from helpers import generation_pool as gp
+from helpers import markov_helpers as mk
+from helpers import model_cache as mc
+from helpers import sentence_pool as sp
 from discord.ext import commands
 from discord.ext.commands import has_permissions
 
@@ -8,25 +13,7 @@ DESCRIPTION = "Bot that creates stuff based off of Markov chains."
 
 def has_post_permission(guildid, channelid):
     """Checks whether the bot can post in that channel."""
-    guild_perms = cp.get_guild(guildid)
-    try:
-        for blacklist_channel in guild_perms[cp.BLACKLIST_KEY]:
-            if channelid == blacklist_channel:
-                return False
-    except KeyError:
-        pass
-
-    if cp.WHITELIST_KEY in guild_perms.keys():
-        if guild_perms[cp.WHITELIST_KEY]:
-            try:
-                for whitelist_channel in guild_perms[cp.WHITELIST_KEY]:
-                    if channelid == whitelist_channel:
-                        break
-                else:
-                    return False
-            except KeyError:
-                pass
-    return True
+    return cp.can_post(guildid, channelid)
 
 
 class Admin(commands.Cog):
@@ -102,6 +89,37 @@ class Admin(commands.Cog):
                 out = 'No channels were  '
             await ctx.send(f"{out[:-2]} removed from whitelist!")
 
+    @commands.command()
+    @has_permissions(manage_guild=True)
+    async def cachestats(self, ctx):
+        """Shows the hit/miss counters of the Markov model cache."""
+        out = '```'
+        for cache_name, stats in mc.get_stats().items():
+            out += f"{cache_name}: {stats['entries']} models, " \
+                   f"{stats['bytes'] / 1024 / 1024:.1f}/{stats['max_bytes'] / 1024 / 1024:.1f} MB\n" \
+                   f"hits: {stats['hits']}, misses: {stats['misses']}, evictions: {stats['evictions']}, " \
+                   f"hit ratio: {stats['hit_ratio']:.1%}\n\n"
+        stats = mk.MODEL_FLIGHTS.stats()
+        out += f"model requests: {stats['calls']}, loads: {stats['calls'] - stats['shared']}, " \
+               f"shared with a concurrent load: {stats['shared']}\n\n"
+        stats = sp.POOL.stats()
+        out += f"sentence pools: {stats['sentences']} sentences for {stats['users']} users\n" \
+               f"hits: {stats['hits']}, misses: {stats['misses']}, hit ratio: {stats['hit_ratio']:.1%}"
+        await ctx.send(out.rstrip() + '```')
+
+    @commands.command()
+    @has_permissions(manage_guild=True)
+    async def queuestats(self, ctx):
+        """Shows the admission control and generation queue counters."""
+        stats = adm.ADMISSION.stats()
+        rejected = ', '.join(f'{scope}: {count}' for scope, count in stats['rejected'].items())
+        pool = gp.get_pool()
+        await ctx.send(f"```running: {stats['running']}/{adm.ADMISSION.max_concurrent}, "
+                       f"waiting: {stats['waiting']}, generation queue: {pool.depth}/{pool.max_queue}\n"
+                       f"admitted: {stats['admitted']}, deferred: {stats['deferred']} "
+                       f"(average wait {stats['average_wait']:.2f}s, max {stats['max_wait']:.2f}s)\n"
+                       f"rejected: {rejected}```")
+
 
 def setup(bot):
     """Adds the cog to the bot."""
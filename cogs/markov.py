@@ -6,35 +6,44 @@ from consts import MAX_NUM_NAMES
 from helpers import markov_helpers as mk
 # from helpers import mk_fanfic as mkff
 from helpers import server_toggle as st, channel_permissions as cp, simulation as sim
+from helpers import member_index as mi
+from helpers import sentence_pool as sp
 from helpers.markov_helpers import REFLEXIVE_TAG
 
 
 def has_post_permission(guildid, channelid):
     """Checks whether the bot can post in that channel."""
-    guild_perms = cp.get_guild(guildid)
-    try:
-        for blacklist_channel in guild_perms[cp.BLACKLIST_KEY]:
-            if channelid == blacklist_channel:
-                return False
-    except KeyError:
-        pass
-
-    if cp.WHITELIST_KEY in guild_perms.keys():
-        if guild_perms[cp.WHITELIST_KEY]:
-            try:
-                for whitelist_channel in guild_perms[cp.WHITELIST_KEY]:
-                    if channelid == whitelist_channel:
-                        break
-                else:
-                    return False
-            except KeyError:
-                pass
-    return True
+    return cp.can_post(guildid, channelid)
 
 
 class Markov(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.refill_task = bot.loop.create_task(sp.refill_loop(mk.generate_pool_sentences))
+
+    def cog_unload(self):
+        self.refill_task.cancel()
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        mi.add_member(member)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        mi.remove_member(member)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        mi.update_member(before, after)
+
+    @commands.Cog.listener()
+    async def on_user_update(self, before, after):
+        """Username changes are sent as user updates, so update every guild the user is in."""
+        if before.name != after.name:
+            for guild in self.bot.guilds:
+                member = guild.get_member(after.id)
+                if member is not None:
+                    mi.add_member(member)
 
     @commands.command(aliases=['mk'])
     async def do(self, ctx, person=REFLEXIVE_TAG, root=None):
@@ -86,7 +95,7 @@ class Markov(commands.Cog):
     async def random_link(self, ctx, link=None):
         """Returns a random link."""
         if link is None:
-            await ctx.send(mk.get_rand_link())
+            await ctx.send(mk.get_rand_link() or 'No links found.')
         else:
             if not link.startswith('https://cdn.discordapp.com/attachments/'):
                 await ctx.send("Cannot get context of non-Discord link.")
@@ -1,12 +1,12 @@
 """Implements commands related to running a freemium-style text-based RPG."""
 import asyncio
 import math
-import random
 
 import discord
 from discord.ext import commands
 
 from helpers import deathmatch as dm
+from helpers import member_index as mi
 
 def calc_relationship(name1, name2=''):
     """Calculates the percent relationship between two people."""
@@ -17,31 +17,24 @@ def calc_relationship(name1, name2=''):
     percent = (total + 32) % 101
     return percent
 
-def get_member_from_guild(guild_members, username):
-    """From a str username and a list of all guild members returns the member whose name contains username."""
-    username = username.lower()
-    if username == 'rand':
-        return random.choice(guild_members)
+def get_member_from_guild(guild, username):
+    """From a str username and a guild returns the member whose name contains username."""
+    index = mi.get_index(guild)
+    if username.lower() == 'rand':
+        return guild.get_member(index.random_ids(1)[0])
     else:
-        members = []
-        for member in guild_members:
-            if member.nick is not None:
-                if username == member.nick.replace(' ', '').lower():
-                    return member
-                elif username in member.nick.replace(' ', '').lower():
-                    members.append(member)
-            elif username == member.name.replace(' ', '').lower():
-                return member
-            elif username in member.name.replace(' ', '').lower():
-                members.append(member)
-
-        members_len = len(members)
+        member_ids = index.find_display_exact(username)
+        if member_ids:
+            return guild.get_member(member_ids[0])
+        member_ids = index.find_display_substring(username)
+
+        members_len = len(member_ids)
         if members_len == 0:
-            raise NameError(username)
+            raise NameError(username.lower())
         elif members_len == 1:
-            return members[0]
+            return guild.get_member(member_ids[0])
         else:
-            raise NameError([member.name for member in members])
+            raise NameError([guild.get_member(member_id).name for member_id in member_ids])
 
 def parse_name(guild, username):
     """Gets the username of a user from a string and guild."""
@@ -51,7 +44,7 @@ def parse_name(guild, username):
         except:
             raise NameError(username)
     else:
-        return get_member_from_guild(guild.members, username)
+        return get_member_from_guild(guild, username)
 
 class Other(commands.Cog):
     """Defines Other commands."""
@@ -9,12 +9,17 @@ SERVER_JSON_DIRECTORY = './server_json/'
 
 DEATHMATCH_FILE = 'deathmatch.txt'
 NAMES_FILE = 'names.txt'
+BOTS_FILE = 'bots.json'
 SERVERS_FILE = 'servers.txt'
 LINKS_FILE = 'links.txt'
 USER_MODEL_FILE = 'htz_user_model.json'
 LONKS_FILE = 'lonks.txt'
 CHANNEL_PERMISSIONS_JSON = 'channelperms.json'
 SENTIMENT_ANALYSIS_JSON = 'sentiments.json'
+HIGH_WATER_MARKS_JSON = 'high_water_marks.json'    # Per-server file of each user's last parsed message id per channel.
+DELTA_DIRECTORY = 'delta/'                          # Per-server directory of messages not yet merged into models.
+LINKS_CHECK_INTERVAL = 60                           # Seconds between checks of whether the links file changed.
+NAMES_CHECK_INTERVAL = 60                           # Seconds between checks of whether the names/bots files changed.
 
 # Discord/Bot constants
 DEFAULT_NAME = 'MarkovBot'
@@ -27,3 +32,57 @@ MAX_MARKOV_ATTEMPTS = 10
 MAX_NICKNAME_LENGTH = 30
 MAX_NUM_NAMES = 5
 MAX_SENTIMENT_TEXT_LENGTH = 50000
+
+# Parsing
+PARSE_FLUSH_SIZE = 64 * 1024 * 1024     # Bytes of memory (buffered posts and open files) at which the parser writes.
+PARSE_MAX_OPEN_FILES = 256              # Max number of user message files the parser keeps open between flushes.
+
+# Models
+COMPILED_MODELS = True              # Whether models are also saved/loaded in the compiled (.npz) format.
+NOVELTY_FILTER_MAX_LENGTH = 16      # Longest n-gram stored in a compiled model's novelty filter (markovify's 15 + 1).
+NOVELTY_FILTER_ERROR_RATE = 0.001   # False positive rate of the novelty filter, i.e. of wrongly rejected n-grams.
+
+# Simulator
+POSTER_SEQUENCE_CHAINS = 16         # Number of poster chains sampled together when a simulator queue is refilled.
+POSTER_SEQUENCE_LENGTH = 64         # Number of posters in each sampled chain.
+
+# Caching
+MODEL_CACHE_MAX_BYTES = 512 * 1024 * 1024   # Size budget for the user model cache (bytes of model file or pack index).
+COMBINED_MODEL_CACHE_MAX_BYTES = 256 * 1024 * 1024  # Size budget for the cache of combined (a+b+c) models.
+
+# Generation
+GENERATION_POOL_KIND = 'thread'     # 'thread' or 'process'; the kind of worker pool Markov generation runs in.
+GENERATION_WORKERS = 4              # Number of workers in the generation pool.
+GENERATION_MAX_QUEUE = 32           # Max number of generation requests waiting or running at once.
+GENERATION_MAX_PER_GUILD = 2        # Max number of workers a single guild can occupy at once.
+
+# Admission control (rates are in sentences per second, bursts in sentences)
+ADMISSION_USER_RATE = 0.5           # Rate at which a user can request Markov sentences.
+ADMISSION_USER_BURST = 20           # Number of sentences a user can request at once after being idle.
+ADMISSION_CHANNEL_RATE = 1          # Rate at which a channel can request Markov sentences.
+ADMISSION_CHANNEL_BURST = 30        # Number of sentences a channel can request at once after being idle.
+ADMISSION_GUILD_RATE = 2            # Rate at which a guild can request Markov sentences.
+ADMISSION_GUILD_BURST = 60          # Number of sentences a guild can request at once after being idle.
+ADMISSION_MAX_CONCURRENT = 8        # Max number of Markov commands being handled at once, over every guild.
+ADMISSION_MAX_WAIT = 2              # Seconds a command waits for one of the concurrent slots before being rejected.
+
+# Sentence pools
+SENTENCE_POOL = True                # Whether $mk with one user and no root draws from a pool of pre-generated sentences.
+SENTENCE_POOL_MIN_SIZE = 2          # Number of sentences kept for a user who was requested once.
+SENTENCE_POOL_MAX_SIZE = 20         # Max number of sentences kept for a single user.
+SENTENCE_POOL_MAX_USERS = 256       # Max number of users with a sentence pool; the least recently requested are dropped.
+SENTENCE_POOL_HALF_LIFE = 600       # Seconds after which a user's request count counts for half when sizing pools.
+SENTENCE_POOL_REFILL_INTERVAL = 5   # Seconds between refills of the sentence pools.
+SENTENCE_POOL_REFILL_BUDGET = 0.5   # Seconds of CPU time each refill can spend generating sentences.
+
+# Metrics
+METRICS_HOST = '127.0.0.1'          # Host the metrics endpoint listens on.
+METRICS_PORT = 9108                 # Port of the http://host:port/metrics endpoint, or None to not serve metrics.
+METRICS_FILE = None                 # File the metrics are dumped to every METRICS_DUMP_INTERVAL seconds, or None.
+METRICS_DUMP_INTERVAL = 60          # Seconds between dumps of the metrics to METRICS_FILE.
+EVENT_LOOP_LAG_INTERVAL = 1         # Seconds between measurements of the event loop lag.
+
+# Simulator webhooks
+WEBHOOK_NAME = 'MarkovBot Simulator'    # Name of the webhooks the simulators post through.
+WEBHOOK_POOL_SIZE = 2                   # Number of webhooks kept in each simulator channel.
+WEBHOOK_MAX_RETRIES = 3                 # Number of times a post is retried after a 429 or a deleted webhook.
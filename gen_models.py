@@ -20,12 +20,12 @@ def parse_servers(args):
             if server_json not in server_jsons:
                 print(f'file not found.')
             else:
-                ps.parse_server(server_json)
+                ps.parse_server(server_json, incremental=args.incremental)
             curr_server_num += 1
     else:
         for server_json in server_jsons:
             print(f'Parsing file {curr_server_num}/{len(args.files)}: {server_json}')
-            ps.parse_server(server_json)
+            ps.parse_server(server_json, incremental=args.incremental)
             curr_server_num += 1
 
 
@@ -35,12 +35,13 @@ def convert_servers(args):
         :param args: argparse.Namespace object.
         :return: Nothing.
     """
+    convert = cv.update_server if args.incremental else cv.convert_server
     if args.files:
         for server_json in args.files:
-            cv.convert_server(filename=server_json)
+            convert(filename=server_json, jobs=args.jobs)
     else:
         for serverid in [x[0] for x in os.walk(MODELS_DIRECTORY)]:
-            cv.convert_server(serverid=serverid)
+            convert(serverid=serverid, jobs=args.jobs)
 
 
 if __name__ == '__main__':
@@ -55,6 +56,10 @@ if __name__ == '__main__':
     parser.add_argument('--simmodel', '-s', dest='sim_model', action='store_true',
                         help="creates the simulation user model, which determines which order users post in the simulation.")
     parser.add_argument('--links', '-l', dest='gen_links', action='store_true', help='generates the links file.')
+    parser.add_argument('--incremental', '-i', dest='incremental', action='store_true',
+                        help="only parses messages newer than the last run and merges them into the existing models.")
+    parser.add_argument('--jobs', '-j', dest='jobs', type=int, default=1,
+                        help="number of processes used to convert user messages to models (default: 1)")
     args = parser.parse_args()
 
     if not args.files:
@@ -0,0 +1,177 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from consts import ADMISSION_USER_RATE, ADMISSION_USER_BURST, ADMISSION_CHANNEL_RATE, ADMISSION_CHANNEL_BURST, \
+    ADMISSION_GUILD_RATE, ADMISSION_GUILD_BURST, ADMISSION_MAX_CONCURRENT, ADMISSION_MAX_WAIT
+
+MAX_BUCKETS = 10000     # Number of buckets above which full (idle) buckets are dropped.
+
+
+class RateLimitedError(Exception):
+    """Error raised when a request is over the rate limit of its user, channel or guild."""
+    def __init__(self, scope, retry_after):
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class BusyError(Exception):
+    """Error raised when a request waited ADMISSION_MAX_WAIT seconds without a free generation slot."""
+    def __init__(self, waited):
+        self.waited = waited
+
+
+class TokenBucket(object):
+    """Token bucket that holds up to capacity tokens and refills at rate tokens per second."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now=None):
+        """Adds the tokens gained since the last refill."""
+        if now is None:
+            now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def get_wait_time(self, cost=1):
+        """Gets the number of seconds until the bucket has cost tokens, which is 0 if it has them now."""
+        self.refill()
+        cost = min(cost, self.capacity)
+        if self.tokens >= cost:
+            return 0
+        return (cost - self.tokens) / self.rate
+
+    def try_acquire(self, cost=1):
+        """Takes cost tokens if the bucket has them, and returns whether it did."""
+        if self.get_wait_time(cost):
+            return False
+        self.tokens -= min(cost, self.capacity)
+        return True
+
+    def is_full(self):
+        """Returns whether the bucket has refilled completely."""
+        self.refill()
+        return self.tokens >= self.capacity
+
+
+class Admission(object):
+    """
+    Admission control in front of Markov generation.
+
+    Every request takes tokens (one per sentence) from the buckets of its user, channel and guild, and is rejected
+    without waiting if any of them is empty. Admitted requests then wait up to max_wait seconds for one of the
+    max_concurrent generation slots.
+    """
+
+    LIMITS = {
+        'user': (ADMISSION_USER_RATE, ADMISSION_USER_BURST),
+        'channel': (ADMISSION_CHANNEL_RATE, ADMISSION_CHANNEL_BURST),
+        'guild': (ADMISSION_GUILD_RATE, ADMISSION_GUILD_BURST)
+    }
+
+    def __init__(self, max_concurrent=ADMISSION_MAX_CONCURRENT, max_wait=ADMISSION_MAX_WAIT):
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.deferred = 0
+        self.rejected = {scope: 0 for scope in self.LIMITS}
+        self.rejected['busy'] = 0
+        self.total_wait = 0.0
+        self.max_wait_seen = 0.0
+        self._buckets = {}      # (scope, id) -> TokenBucket
+        self._slot_freed = None
+
+    def take_tokens(self, guildid, channelid, userid, cost=1):
+        """
+        Takes cost tokens from the user's, channel's and guild's buckets, or none of them if any of them is empty.
+        :raises RateLimitedError: with the scope of the empty bucket that will take the longest to refill.
+        """
+        buckets = [(scope, self._get_bucket(scope, scope_id))
+                   for scope, scope_id in (('user', userid), ('channel', channelid), ('guild', guildid))]
+        scope, retry_after = max(((scope, bucket.get_wait_time(cost)) for scope, bucket in buckets),
+                                 key=lambda item: item[1])
+        if retry_after:
+            self.rejected[scope] += 1
+            raise RateLimitedError(scope, retry_after)
+        for _, bucket in buckets:
+            bucket.try_acquire(cost)
+
+    @asynccontextmanager
+    async def admit(self, guildid, channelid, userid, cost=1):
+        """
+        Admits a request for the duration of the context.
+        :raises RateLimitedError: if the user, channel or guild is over its rate limit.
+        :raises BusyError: if no generation slot was freed within max_wait seconds.
+        """
+        self.take_tokens(guildid, channelid, userid, cost)
+        await self._acquire_slot()
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self._get_slot_freed().set()
+
+    def stats(self):
+        """Returns a dict of the admission counters."""
+        return {
+            'running': self.running,
+            'waiting': self.waiting,
+            'admitted': self.admitted,
+            'deferred': self.deferred,
+            'rejected': dict(self.rejected),
+            'average_wait': self.total_wait / self.deferred if self.deferred else 0.0,
+            'max_wait': self.max_wait_seen,
+            'buckets': len(self._buckets)
+        }
+
+    async def _acquire_slot(self):
+        if self.running < self.max_concurrent and not self.waiting:
+            self.running += 1
+            self.admitted += 1
+            return
+
+        self.deferred += 1
+        self.waiting += 1
+        start = time.monotonic()
+        try:
+            while self.running >= self.max_concurrent:
+                remaining = self.max_wait - (time.monotonic() - start)
+                if remaining <= 0:
+                    self.rejected['busy'] += 1
+                    raise BusyError(time.monotonic() - start)
+                slot_freed = self._get_slot_freed()
+                slot_freed.clear()
+                try:
+                    await asyncio.wait_for(slot_freed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            self.running += 1
+            self.admitted += 1
+        finally:
+            self.waiting -= 1
+            waited = time.monotonic() - start
+            self.total_wait += waited
+            self.max_wait_seen = max(self.max_wait_seen, waited)
+
+    def _get_bucket(self, scope, scope_id):
+        bucket = self._buckets.get((scope, scope_id))
+        if bucket is None:
+            if len(self._buckets) >= MAX_BUCKETS:
+                self._buckets = {key: curr for key, curr in self._buckets.items() if not curr.is_full()}
+            bucket = self._buckets[(scope, scope_id)] = TokenBucket(*self.LIMITS[scope])
+        return bucket
+
+    def _get_slot_freed(self):
+        # The event is created lazily so that it belongs to the running event loop.
+        if self._slot_freed is None:
+            self._slot_freed = asyncio.Event()
+        return self._slot_freed
+
+
+ADMISSION = Admission()
@@ -1,3 +1,7 @@
+import copy
+import os
+import threading
+
 import ujson
 
 from consts import CHANNEL_PERMISSIONS_JSON
@@ -6,49 +10,56 @@ WHITELIST_KEY = 'white'            # list containing all channels in a guild in
 BLACKLIST_KEY = 'black'            # list containing all channels in a guild in which the bot cannot run commands.
 SIMULATION_KEY = 'sim'             # int representing the channelid of the channel where the simulation will go.
 
+PERMISSIONS = None                 # In-memory copy of the permissions file, loaded once by load().
+CHANNEL_SETS = {}                  # guildid (str) -> (blacklist set, whitelist set), for O(1) lookups.
+LOCK = threading.RLock()
+
 
 def add_channel(guildid, channelid, key):
     """Adds a channel to the file."""
     guildid = str(guildid)
-    try:
+    with LOCK:
         perms = get_file()
-        guild_perms = perms[str(guildid)]
-    except KeyError:
-        perms[guildid] = {key: [channelid]}
+        guild_perms = perms.setdefault(guildid, {})
+        try:
+            guild_perms[key].append(channelid)
+        except KeyError:
+            guild_perms[key] = [channelid]
         write(perms)
-        return
 
+
+def can_post(guildid, channelid):
+    """Checks whether the bot can post in a channel, using the in-memory white/blacklist sets."""
+    if PERMISSIONS is None:
+        load()
     try:
-        perms[guildid][key].append(channelid)
+        blacklist, whitelist = CHANNEL_SETS[str(guildid)]
     except KeyError:
-        perms[guildid][key] = [channelid]
-
-    write(perms)
+        return True
+    if channelid in blacklist:
+        return False
+    if whitelist and channelid not in whitelist:
+        return False
+    return True
 
 
 def clear_channel(guildid, key):
     """Removes a channel from the file."""
     guildid = str(guildid)
-    try:
+    with LOCK:
         perms = get_file()
-        guild_perms = perms[str(guildid)]
-    except KeyError:
-        raise ValueError
+        if guildid not in perms:
+            raise ValueError
 
-    try:
         perms[guildid].pop(key, None)
         write(perms)
-    except KeyError:
-        raise ValueError
-    except ValueError:
-        raise ValueError
 
 
 def get_channel(guildid, key):
     """Gets the channelid associated with the key."""
     guildid = str(guildid)
     try:
-        channelid = get_file()[str(guildid)][key]
+        channelid = get_guild(guildid)[key]
         if type(channelid) is int:
             return channelid
         else:
@@ -58,55 +69,78 @@ def get_channel(guildid, key):
 
 
 def get_file():
-    """Opens the permissions file, or returns an empty dict if it does not exist."""
-    try:
-        with open(CHANNEL_PERMISSIONS_JSON, 'r') as f:
-            return ujson.load(f)
-    except FileNotFoundError:
-        with open(CHANNEL_PERMISSIONS_JSON, 'w+') as f:
-            ujson.dump({}, f)
-        return {}
+    """Gets a copy of the permissions, which can be modified and saved with write()."""
+    if PERMISSIONS is None:
+        load()
+    with LOCK:
+        return copy.deepcopy(PERMISSIONS)
 
 
 def get_guild(guildid):
-    """Gets the white/blacklist for a guild, or raises a KeyError if it is not found."""
-    try:
-        return get_file()[str(guildid)]
-    except KeyError:
-        return {}
+    """Gets the white/blacklist for a guild, or an empty dict if it is not found. The dict must not be modified."""
+    if PERMISSIONS is None:
+        load()
+    return PERMISSIONS.get(str(guildid), {})
+
+
+def load():
+    """Loads the permissions file into memory, creating it if it does not exist."""
+    global PERMISSIONS
+    with LOCK:
+        try:
+            with open(CHANNEL_PERMISSIONS_JSON, 'r') as f:
+                perms = ujson.load(f)
+        except FileNotFoundError:
+            perms = {}
+            write(perms)
+            return
+        PERMISSIONS = perms
+        index_channels()
+
+
+def index_channels():
+    """Rebuilds the white/blacklist sets of every guild."""
+    global CHANNEL_SETS
+    channel_sets = {}
+    for guildid, guild_perms in PERMISSIONS.items():
+        channel_sets[guildid] = (set(guild_perms.get(BLACKLIST_KEY, [])), set(guild_perms.get(WHITELIST_KEY, [])))
+    CHANNEL_SETS = channel_sets
 
 
 def remove_channel(guildid, channelid, key):
     """Removes a channel from the file."""
     guildid = str(guildid)
-    try:
+    with LOCK:
         perms = get_file()
-        guild_perms = perms[str(guildid)]
-    except KeyError:
-        raise ValueError
-
-    try:
-        perms[guildid][key].remove(channelid)
+        try:
+            perms[guildid][key].remove(channelid)
+        except KeyError:
+            raise ValueError
         write(perms)
-    except KeyError:
-        raise ValueError
-    except ValueError:
-        raise ValueError
 
 
 def set_channel(guildid, channelid, key):
     """Sets the channelid associated with the key."""
     guildid = str(guildid)
-    try:
+    with LOCK:
         perms = get_file()
-        perms[guildid][key] = channelid
-    except KeyError:
-        perms[guildid] = {}
-        perms[guildid][key] = channelid
-    write(perms)
+        try:
+            perms[guildid][key] = channelid
+        except KeyError:
+            perms[guildid] = {}
+            perms[guildid][key] = channelid
+        write(perms)
 
 
 def write(permissions_dict):
-    """Writes the permissions dict to a json file."""
-    with open(CHANNEL_PERMISSIONS_JSON, 'w+') as f:
-        ujson.dump(permissions_dict, f)
+    """
+    Writes the permissions dict to a json file and makes it the in-memory copy.
+    The file is written to a temporary file and renamed, so it is never left half-written.
+    """
+    global PERMISSIONS
+    with LOCK:
+        with open(CHANNEL_PERMISSIONS_JSON + '.tmp', 'w+') as f:
+            ujson.dump(permissions_dict, f)
+        os.replace(CHANNEL_PERMISSIONS_JSON + '.tmp', CHANNEL_PERMISSIONS_JSON)
+        PERMISSIONS = permissions_dict
+        index_channels()
@@ -0,0 +1,417 @@
+import random
+import re
+
+import markovify
+import numpy as np
+from markovify.chain import BEGIN, END
+from markovify.text import ParamError
+
+from helpers import novelty_filter as nf
+
+BEGIN_ID = 0
+END_ID = 1
+COMPILED_MODEL_EXTENSION = '.npz'
+
+DEFAULT_TRIES = 10
+
+
+class CompiledText(object):
+    """
+    Compact, read-only version of a markovify.Text model.
+
+    Words are interned to integer ids (sorted by their utf-8 bytes, after BEGIN and END), states are stored as rows
+    of word ids sorted by a packed int64 key, and each state's transitions are stored as a slice of flat arrays of
+    next word ids and cumulative weights, so that choosing the next word is a binary search.
+    """
+
+    def __init__(self, arrays):
+        self.vocab_data = arrays['vocab_data']                  # uint8, utf-8 bytes of every word
+        self.vocab_offsets = arrays['vocab_offsets']            # int64 (V + 1), word i is data[off[i]:off[i + 1]]
+        self.states = arrays['states']                          # int32 (S, state_size)
+        self.state_keys = arrays['state_keys']                  # int64 (S), sorted packed keys of states
+        self.trans_offsets = arrays['trans_offsets']            # int64 (S + 1)
+        self.trans_words = arrays['trans_words']                # int32 (T)
+        self.trans_cumweights = arrays['trans_cumweights']      # int64 (T), cumulative per state
+        self.state_size = int(self.states.shape[1])
+        self.vocab_size = len(self.vocab_offsets) - 1
+        self.begin_state = self.find_state((BEGIN_ID,) * self.state_size)
+        self._root_index = None
+        novelty_filter = nf.NoveltyFilter.from_arrays(arrays)
+        self.novelty_filters = [novelty_filter] if novelty_filter else []
+
+    @classmethod
+    def from_text(cls, text):
+        """Compiles a markovify.Text model."""
+        return cls.from_chain_dict(text.chain.model, text.state_size)
+
+    @classmethod
+    def from_chain_dict(cls, chain_dict, state_size):
+        """Compiles a markovify chain dict, i.e. {(word, ...): {next_word: count}}."""
+        words = set()
+        for state, transitions in chain_dict.items():
+            words.update(state)
+            words.update(transitions)
+        words.discard(BEGIN)
+        words.discard(END)
+        vocab = [BEGIN, END] + sorted(words, key=lambda word: word.encode('utf-8'))
+        word_ids = {word: i for i, word in enumerate(vocab)}
+
+        vocab_data, vocab_offsets = encode_vocab(vocab)
+
+        states = np.array([[word_ids[word] for word in state] for state in chain_dict.keys()],
+                          dtype=np.int32).reshape(-1, state_size)
+        state_keys = pack_states(states, len(vocab))
+        order = np.argsort(state_keys, kind='stable')
+        ordered_states = list(chain_dict.keys())
+
+        trans_offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        trans_words = []
+        trans_cumweights = []
+        for i, state_index in enumerate(order):
+            transitions = chain_dict[ordered_states[state_index]]
+            trans_words.extend(word_ids[word] for word in transitions.keys())
+            trans_cumweights.extend(np.cumsum(list(transitions.values())).tolist())
+            trans_offsets[i + 1] = len(trans_words)
+
+        return cls({
+            'vocab_data': vocab_data,
+            'vocab_offsets': vocab_offsets,
+            'states': states[order],
+            'state_keys': state_keys[order],
+            'trans_offsets': trans_offsets,
+            'trans_words': np.array(trans_words, dtype=np.int32),
+            'trans_cumweights': np.array(trans_cumweights, dtype=np.int64)
+        })
+
+    @classmethod
+    def load(cls, path):
+        """Loads a compiled model saved with save()."""
+        with np.load(path) as npz_file:
+            return cls({name: npz_file[name] for name in npz_file.files})
+
+    def save(self, path):
+        """Saves the model as an uncompressed .npz file."""
+        with open(path, 'wb') as f:
+            np.savez(f, **self.get_arrays())
+
+    def get_arrays(self):
+        """Gets the dict of arrays that make up the model."""
+        return {
+            'vocab_data': self.vocab_data,
+            'vocab_offsets': self.vocab_offsets,
+            'states': self.states,
+            'state_keys': self.state_keys,
+            'trans_offsets': self.trans_offsets,
+            'trans_words': self.trans_words,
+            'trans_cumweights': self.trans_cumweights,
+            **(self.novelty_filters[0].get_arrays() if len(self.novelty_filters) == 1 else {})
+        }
+
+    def get_word(self, word_id):
+        """Gets the word with the given id."""
+        if word_id == BEGIN_ID:
+            return BEGIN
+        if word_id == END_ID:
+            return END
+        start, end = self.vocab_offsets[word_id], self.vocab_offsets[word_id + 1]
+        return self.vocab_data[start:end].tobytes().decode('utf-8')
+
+    def get_word_id(self, word):
+        """Gets the id of a word using a binary search over the sorted vocabulary, or None if it is not in it."""
+        if word == BEGIN:
+            return BEGIN_ID
+        if word == END:
+            return END_ID
+        encoded = word.encode('utf-8')
+        lo, hi = 2, self.vocab_size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start, end = self.vocab_offsets[mid], self.vocab_offsets[mid + 1]
+            curr = self.vocab_data[start:end].tobytes()
+            if curr < encoded:
+                lo = mid + 1
+            elif curr > encoded:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def find_state(self, state_ids):
+        """Gets the index of a state given as a tuple of word ids, or None if it is not in the model."""
+        key = pack_states(np.array([state_ids], dtype=np.int64), self.vocab_size)[0]
+        index = int(np.searchsorted(self.state_keys, key))
+        if index < len(self.state_keys) and self.state_keys[index] == key:
+            return index
+        return None
+
+    def move(self, state_index, rng=random):
+        """Chooses the id of the word following a state."""
+        start, end = self.trans_offsets[state_index], self.trans_offsets[state_index + 1]
+        cumweights = self.trans_cumweights[start:end]
+        r = rng.random() * cumweights[-1]
+        return int(self.trans_words[start + int(np.searchsorted(cumweights, r, side='right'))])
+
+    def walk(self, init_state=None, rng=random):
+        """Returns the list of word ids of a single run of the chain, starting at init_state (a tuple of ids)."""
+        state = tuple(init_state) if init_state else (BEGIN_ID,) * self.state_size
+        state_index = self.begin_state if init_state is None else self.find_state(state)
+        if state_index is None:
+            raise KeyError(state)
+        return self.walk_from(state_index, rng)
+
+    def walk_from(self, state_index, rng=random):
+        """
+        Same as walk, starting at the state with the given index. Each next state is found by rolling the packed key
+        of the previous one instead of packing it again.
+        """
+        state_keys = self.state_keys
+        modulus = self.vocab_size ** (self.state_size - 1)
+        key = int(state_keys[state_index])
+        out = []
+        while True:
+            word_id = self.move(state_index, rng)
+            if word_id == END_ID:
+                return out
+            out.append(word_id)
+            key = key % modulus * self.vocab_size + word_id
+            state_index = int(np.searchsorted(state_keys, key))
+            if state_index == len(state_keys) or state_keys[state_index] != key:
+                raise KeyError(key)
+
+    def word_split(self, sentence):
+        return re.split(markovify.Text.word_split_pattern, sentence)
+
+    def word_join(self, words):
+        return ' '.join(words)
+
+    def test_sentence_output(self, words, max_overlap_ratio, max_overlap_total):
+        """
+        Same as markovify.Text.test_sentence_output, using the n-gram filters of the original texts instead of the
+        texts. Models compiled without a filter accept every sentence.
+        """
+        return nf.test_sentence_output(self.novelty_filters, words, max_overlap_ratio, max_overlap_total)
+
+    def make_sentence(self, init_state=None, **kwargs):
+        """Same as markovify.Text.make_sentence, where init_state is a tuple of words."""
+        prefix, state_index = self.get_start(init_state)
+        return self._make_sentence_from(prefix, state_index, kwargs)
+
+    def make_sentences(self, init_states=None, **kwargs):
+        """
+        Generates sentences like make_sentence, each starting at a random one of init_states (tuples of words), or at
+        the beginning if it is None. The start states are looked up once for the whole batch.
+        :return: endless generator of sentences, or of None where make_sentence would have returned None.
+        """
+        rng = kwargs.get('rng', random)
+        starts = [self.get_start(init_state) for init_state in ([None] if init_states is None else init_states)]
+        while starts:
+            prefix, state_index = rng.choice(starts)
+            yield self._make_sentence_from(prefix, state_index, kwargs)
+
+    def get_start(self, init_state):
+        """
+        Gets the (words to start sentences with, index of the state to walk from) of an initial state.
+        :raises KeyError: if the state is not in the model.
+        """
+        if init_state is None:
+            return [], self.begin_state
+        init_ids = tuple(self.get_word_id(word) for word in init_state)
+        state_index = None if None in init_ids else self.find_state(init_ids)
+        if state_index is None:
+            raise KeyError(init_state)
+        return [word for word in init_state if word != BEGIN], state_index
+
+    def _make_sentence_from(self, prefix, state_index, kwargs):
+        tries = kwargs.get('tries', DEFAULT_TRIES)
+        max_words = kwargs.get('max_words', None)
+        mor = kwargs.get('max_overlap_ratio', markovify.text.DEFAULT_MAX_OVERLAP_RATIO)
+        mot = kwargs.get('max_overlap_total', markovify.text.DEFAULT_MAX_OVERLAP_TOTAL)
+        test_output = kwargs.get('test_output', True)
+        rng = kwargs.get('rng', random)
+
+        for _ in range(tries):
+            words = prefix + [self.get_word(word_id) for word_id in self.walk_from(state_index, rng)]
+            if max_words is not None and len(words) > max_words:
+                continue
+            if not test_output or self.test_sentence_output(words, mor, mot):
+                return self.word_join(words)
+        return None
+
+    def make_sentence_with_start(self, beginning, strict=True, **kwargs):
+        """Same as markovify.Text.make_sentence_with_start."""
+        split = tuple(self.word_split(beginning))
+        word_count = len(split)
+
+        if word_count == self.state_size:
+            init_states = [split]
+        elif 0 < word_count < self.state_size:
+            if strict:
+                init_states = [(BEGIN,) * (self.state_size - word_count) + split]
+            else:
+                init_states = self.find_states_starting_with(split)
+                random.shuffle(init_states)
+        else:
+            raise ParamError(f'`make_sentence_with_start` for this model requires a string containing 1 to '
+                             f'{self.state_size} words. Yours has {word_count}: {split}')
+
+        for init_state in init_states:
+            output = self.make_sentence(init_state, **kwargs)
+            if output is not None:
+                return output
+        return None
+
+    def find_states_starting_with(self, split):
+        """Gets every state (as a tuple of words) whose words, ignoring BEGIN, start with split."""
+        split_ids = [self.get_word_id(word) for word in split]
+        if None in split_ids or split_ids[0] == BEGIN_ID:
+            return []
+        order, offsets = self.get_root_index()
+        states = self.states[order[offsets[split_ids[0]]:offsets[split_ids[0] + 1]]]
+
+        first = np.argmax(states != BEGIN_ID, axis=1)
+        rows = np.arange(len(states))
+        mask = np.ones(len(states), dtype=bool)
+        for i, word_id in enumerate(split_ids[1:], 1):
+            column = first + i
+            mask &= column < self.state_size
+            mask &= states[rows, np.minimum(column, self.state_size - 1)] == word_id
+        return [tuple(self.get_word(word_id) for word_id in state) for state in states[mask]]
+
+    def get_root_index(self):
+        """
+        Gets the (order, offsets) index of states by their first non-BEGIN word, where order[offsets[w]:offsets[w + 1]]
+        are the indexes of the states starting with word w. It is built on first use and kept with the model.
+        """
+        if self._root_index is None:
+            first_column = np.argmax(self.states != BEGIN_ID, axis=1)
+            first = self.states[np.arange(len(self.states)), first_column]
+            order = np.argsort(first, kind='stable').astype(np.int32)
+            offsets = np.zeros(self.vocab_size + 1, dtype=np.int64)
+            np.cumsum(np.bincount(first, minlength=self.vocab_size), out=offsets[1:])
+            self._root_index = (order, offsets)
+        return self._root_index
+
+    def get_root_index_nbytes(self):
+        """Gets the number of bytes the index of get_root_index takes up, whether or not it was built yet."""
+        return len(self.states) * np.dtype(np.int32).itemsize + (self.vocab_size + 1) * np.dtype(np.int64).itemsize
+
+    def to_chain_dict(self):
+        """Gets the model as a markovify chain dict."""
+        words = [self.get_word(word_id) for word_id in range(self.vocab_size)]
+        chain_dict = {}
+        for i, state in enumerate(self.states):
+            start, end = self.trans_offsets[i], self.trans_offsets[i + 1]
+            counts = np.diff(self.trans_cumweights[start:end], prepend=0)
+            chain_dict[tuple(words[word_id] for word_id in state)] = {
+                words[word_id]: int(count) for word_id, count in zip(self.trans_words[start:end], counts)
+            }
+        return chain_dict
+
+
+def pack_states(states, vocab_size):
+    """Packs rows of word ids into sortable int64 keys."""
+    state_size = states.shape[1]
+    if vocab_size ** state_size >= 2 ** 63:
+        raise ValueError(f'Vocabulary of {vocab_size} words is too large for a state size of {state_size}.')
+    keys = np.zeros(len(states), dtype=np.int64)
+    for column in range(state_size):
+        keys = keys * vocab_size + states[:, column]
+    return keys
+
+
+def compile_model(text):
+    """Compiles a markovify.Text model, with the novelty filter of its original text if it kept it."""
+    compiled = CompiledText.from_text(text)
+    if text.retain_original:
+        compiled.novelty_filters = [nf.NoveltyFilter.build(text.parsed_sentences)]
+    return compiled
+
+
+def encode_vocab(vocab):
+    """Gets the (vocab_data, vocab_offsets) arrays of a list of words."""
+    encoded_vocab = [word.encode('utf-8') for word in vocab]
+    vocab_offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+    np.cumsum([len(word) for word in encoded_vocab], out=vocab_offsets[1:])
+    vocab_data = np.frombuffer(b''.join(encoded_vocab), dtype=np.uint8)
+    return vocab_data, vocab_offsets
+
+
+def get_transition_counts(model):
+    """Gets the (state index, count) of every transition of a compiled model."""
+    lengths = np.diff(model.trans_offsets)
+    state_indexes = np.repeat(np.arange(len(lengths)), lengths)
+    previous = np.concatenate([[0], model.trans_cumweights[:-1]])
+    previous[model.trans_offsets[:-1][lengths > 0]] = 0
+    return state_indexes, model.trans_cumweights - previous
+
+
+def combine(models):
+    """
+    Combines markovify.Text and CompiledText models, like markovify.combine.
+    Compiled models are merged with numpy: every transition is remapped to a shared vocabulary, and the counts of
+    identical (state, next word) transitions are summed after a sort.
+    """
+    if all(isinstance(model, markovify.Text) for model in models):
+        return markovify.combine(models)
+
+    # Plain models are compiled with the novelty filter of their original text, so that their share of the combined
+    # model still gets the overlap check (markovify does not check models that did not keep their text either).
+    models = [model if isinstance(model, CompiledText) else compile_model(model) for model in models]
+    state_sizes = set(model.state_size for model in models)
+    if len(state_sizes) != 1:
+        raise ValueError("All `models` must have the same state size.")
+    state_size = state_sizes.pop()
+
+    model_vocabs = [[model.get_word(word_id) for word_id in range(model.vocab_size)] for model in models]
+    words = set()
+    for model_vocab in model_vocabs:
+        words.update(model_vocab[2:])
+    vocab = [BEGIN, END] + sorted(words, key=lambda word: word.encode('utf-8'))
+    word_ids = {word: i for i, word in enumerate(vocab)}
+    vocab_size = len(vocab)
+
+    keys = []
+    next_words = []
+    counts = []
+    for model, model_vocab in zip(models, model_vocabs):
+        remap = np.array([word_ids[word] for word in model_vocab], dtype=np.int64)
+        state_indexes, model_counts = get_transition_counts(model)
+        keys.append(pack_states(remap[model.states], vocab_size)[state_indexes])
+        next_words.append(remap[model.trans_words])
+        counts.append(model_counts)
+    keys = np.concatenate(keys)
+    next_words = np.concatenate(next_words)
+    counts = np.concatenate(counts)
+
+    # Sum the counts of identical (state, next word) transitions.
+    order = np.lexsort((next_words, keys))
+    keys, next_words, counts = keys[order], next_words[order], counts[order]
+    is_new = np.ones(len(keys), dtype=bool)
+    is_new[1:] = (keys[1:] != keys[:-1]) | (next_words[1:] != next_words[:-1])
+    starts = np.flatnonzero(is_new)
+    keys, next_words, counts = keys[starts], next_words[starts], np.add.reduceat(counts, starts)
+
+    # Rebuild the states and the cumulative weights of each state's transitions.
+    state_starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+    state_keys = keys[state_starts]
+    states = np.zeros((len(state_keys), state_size), dtype=np.int32)
+    remaining = state_keys.copy()
+    for column in reversed(range(state_size)):
+        states[:, column] = remaining % vocab_size
+        remaining //= vocab_size
+    total_cumweights = np.cumsum(counts)
+    before_state = np.concatenate([[0], total_cumweights[state_starts[1:] - 1]])
+    lengths = np.diff(np.concatenate([state_starts, [len(keys)]]))
+
+    vocab_data, vocab_offsets = encode_vocab(vocab)
+    combined = CompiledText({
+        'vocab_data': vocab_data,
+        'vocab_offsets': vocab_offsets,
+        'states': states,
+        'state_keys': state_keys,
+        'trans_offsets': np.concatenate([state_starts, [len(keys)]]).astype(np.int64),
+        'trans_words': next_words.astype(np.int32),
+        'trans_cumweights': total_cumweights - np.repeat(before_state, lengths)
+    })
+    combined.novelty_filters = [novelty_filter for model in models for novelty_filter in model.novelty_filters]
+    return combined
@@ -1,9 +1,13 @@
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import markovify
 
-from consts import MESSAGES_DIRECTORY, MODELS_DIRECTORY, POST_SEPARATOR
+from consts import MESSAGES_DIRECTORY, MODELS_DIRECTORY, POST_SEPARATOR, COMPILED_MODELS, DELTA_DIRECTORY
+from helpers import compiled_model as cm
+from helpers import model_catalog as mcat
+from helpers import model_store as ms
 from helpers.utility import get_serverid
 
 
@@ -12,9 +16,143 @@ class Post(markovify.Text):
         return re.split(rf"\s*{POST_SEPARATOR}\s*", text)
 
 
-def convert_server(filename=None, serverid=None):
+def convert_user(serverid, userid):
+    """
+    Converts a user's messages into a Markov model, saved as json (and compiled) files.
+    :return: None if the user was converted (or had no messages), otherwise a str describing the error.
+    """
+    server_messages_dir = f'{MESSAGES_DIRECTORY}{serverid}/'
+    server_model_dir = f'{MODELS_DIRECTORY}{serverid}/'
+    with open(f'{server_messages_dir}{userid}.txt', 'r', encoding='utf-8-sig') as message_fp:
+        data = message_fp.read()
+    if data.isspace():
+        return None
+    try:
+        model = Post(data)
+    except KeyError as e:
+        return f"error with user's json: {e}"
+    with open(f'{server_model_dir}{userid}.json', 'w+', encoding='utf-8-sig') as model_fp:
+        model_fp.write(model.to_json())
+    if COMPILED_MODELS:
+        cm.compile_model(model).save(f'{server_model_dir}{userid}{cm.COMPILED_MODEL_EXTENSION}')
+    # The model now includes every message, so any unmerged delta is stale.
+    remove_delta(serverid, userid)
+    return None
+
+
+def remove_delta(serverid, userid):
+    """Removes a user's delta messages file if it exists."""
+    try:
+        os.remove(f'{MESSAGES_DIRECTORY}{serverid}/{DELTA_DIRECTORY}{userid}.txt')
+    except FileNotFoundError:
+        pass
+
+
+def update_user(serverid, userid):
+    """
+    Merges a user's delta messages into their existing model by adding the chain counts of a model of only the
+    delta, which gives the same chain as rebuilding the model from all of their messages.
+    :return: None if the user was updated, otherwise a str describing the error.
+    """
+    delta_path = f'{MESSAGES_DIRECTORY}{serverid}/{DELTA_DIRECTORY}{userid}.txt'
+    model_path = f'{MODELS_DIRECTORY}{serverid}/{userid}.json'
+    if not os.path.isfile(model_path):
+        # No model to merge into, so build it from all of the user's messages.
+        error = convert_user(serverid, userid)
+    else:
+        with open(delta_path, 'r', encoding='utf-8-sig') as delta_fp:
+            data = delta_fp.read()
+        if data.isspace():
+            error = None
+        else:
+            try:
+                delta_model = Post(data)
+            except (KeyError, ValueError) as e:
+                return f"error with user's delta: {e}"
+            with open(model_path, 'r', encoding='utf-8-sig') as model_fp:
+                model = Post.from_json(model_fp.read())
+            model = markovify.combine([model, delta_model])
+            with open(model_path, 'w+', encoding='utf-8-sig') as model_fp:
+                model_fp.write(model.to_json())
+            if COMPILED_MODELS:
+                cm.compile_model(model).save(f'{MODELS_DIRECTORY}{serverid}/{userid}{cm.COMPILED_MODEL_EXTENSION}')
+            error = None
+    if not error:
+        remove_delta(serverid, userid)
+    return error
+
+
+def update_server(filename=None, serverid=None, jobs=1):
+    """
+    Merges the delta messages written by an incremental parser.parse_server into the models of the users who posted.
+    Users without delta messages are not touched.
+    :return: dict of userid to error for every user that could not be updated.
+    """
     if not filename and not serverid:
-        return
+        return {}
+    if not serverid:
+        serverid = get_serverid(filename)
+        if not serverid:
+            raise NameError("Server not found.")
+
+    server_delta_dir = f'{MESSAGES_DIRECTORY}{serverid}/{DELTA_DIRECTORY}'
+    if not os.path.isdir(server_delta_dir):
+        print(f'serverid {serverid} has no new messages.')
+        return {}
+    os.makedirs(f'{MODELS_DIRECTORY}{serverid}/', exist_ok=True)
+    userids = [x[:-4] for x in os.listdir(server_delta_dir) if x.endswith('.txt')]
+    print(f"Updating {len(userids)} users in server {serverid}")
+
+    errors = run_user_jobs(update_user, serverid, userids, jobs)
+    if COMPILED_MODELS and len(errors) < len(userids):
+        ms.pack_guild(serverid)
+    mcat.invalidate(serverid)
+    return errors
+
+
+def run_user_jobs(func, serverid, userids, jobs):
+    """
+    Runs func(serverid, userid) for every userid, in a pool of jobs processes if jobs > 1.
+    :return: dict of userid to error for every user for which func returned or raised an error.
+    """
+    num_users = len(userids)
+    errors = {}
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(func, serverid, userid): userid for userid in userids}
+            for user_num, future in enumerate(as_completed(futures), 1):
+                userid = futures[future]
+                print(f' * Finished user {userid} ({user_num}/{num_users})')
+                try:
+                    error = future.result()
+                except Exception as e:
+                    error = repr(e)
+                if error:
+                    errors[userid] = error
+    else:
+        for user_num, userid in enumerate(userids, 1):
+            print(f' * Processing user {userid} ({user_num}/{num_users})')
+            try:
+                error = func(serverid, userid)
+            except Exception as e:
+                error = repr(e)
+            if error:
+                errors[userid] = error
+
+    for userid, error in errors.items():
+        print(f'Unable to process user {userid}: {error}')
+    print(f'Processed {num_users - len(errors)}/{num_users} users.')
+    return errors
+
+
+def convert_server(filename=None, serverid=None, jobs=1):
+    """
+    Converts the messages of every user in a server into Markov models.
+    :param jobs: number of processes to convert users in. The models are the same regardless of jobs.
+    :return: dict of userid to error for every user that could not be converted.
+    """
+    if not filename and not serverid:
+        return {}
     if not serverid:
         serverid = get_serverid(filename)
         if not serverid:
@@ -24,26 +162,17 @@ def convert_server(filename=None, serverid=None):
     server_model_dir = f'{MODELS_DIRECTORY}{serverid}/'
     if not os.path.isdir(server_messages_dir):
         print(f'serverid {serverid} not found in messages.')
-        return
+        return {}
     print("Converting server " + serverid)
 
     if not os.path.exists(MODELS_DIRECTORY):
         os.mkdir(MODELS_DIRECTORY)
     if not os.path.exists(server_model_dir):
         os.mkdir(server_model_dir)
-    for user_file in os.listdir(server_messages_dir):
-        if not user_file.endswith('.txt'):
-            continue
-        userid = user_file[:-4]
-        print(f' * Convering user {userid}')
-        with open(f'{server_messages_dir}{userid}.txt', 'r', encoding='utf-8-sig') as message_fp:
-            data = message_fp.read()
-            if not data.isspace():
-                try:
-                    model = Post(data)
-                    with open(f'{server_model_dir}{userid}.json', 'w+', encoding='utf-8-sig') as model_fp:
-                        model_fp.write(model.to_json())
-                except KeyError as e:
-                    print(e)
-                    print("error with user's json")
-                    continue
+    userids = [x[:-4] for x in os.listdir(server_messages_dir) if x.endswith('.txt')]
+    errors = run_user_jobs(convert_user, serverid, userids, jobs)
+
+    if COMPILED_MODELS:
+        ms.pack_guild(serverid)
+    mcat.invalidate(serverid)
+    return errors
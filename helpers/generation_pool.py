@@ -0,0 +1,72 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from consts import GENERATION_POOL_KIND, GENERATION_WORKERS, GENERATION_MAX_QUEUE, GENERATION_MAX_PER_GUILD
+
+
+class QueueFullError(Exception):
+    """Error raised when too many generation requests are waiting."""
+    def __init__(self, depth):
+        self.depth = depth
+
+
+class GenerationPool(object):
+    """Runs Markov generation in a worker pool so it does not block the event loop."""
+
+    def __init__(self, kind=GENERATION_POOL_KIND, workers=GENERATION_WORKERS,
+                 max_queue=GENERATION_MAX_QUEUE, max_per_guild=GENERATION_MAX_PER_GUILD):
+        if kind == 'process':
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        elif kind == 'thread':
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='markov')
+        else:
+            raise ValueError(f'Unknown generation pool kind: {kind}')
+        self.kind = kind
+        self.max_queue = max_queue
+        self.max_per_guild = max_per_guild
+        self.depth = 0
+        self._guild_semaphores = {}
+
+    async def run(self, guildid, func, *args):
+        """
+        Runs func(*args) in the pool and returns its result.
+        Each guild can only occupy max_per_guild workers, so one busy guild cannot starve the others.
+        :raises QueueFullError: if max_queue requests are already waiting or running.
+        """
+        if self.depth >= self.max_queue:
+            raise QueueFullError(self.depth)
+        self.depth += 1
+        try:
+            async with self._get_semaphore(guildid):
+                loop = asyncio.get_event_loop()
+                return await loop.run_in_executor(self.executor, functools.partial(func, *args))
+        finally:
+            self.depth -= 1
+
+    def shutdown(self):
+        """Shuts down the worker pool."""
+        self.executor.shutdown(wait=False)
+
+    def _get_semaphore(self, guildid):
+        semaphore = self._guild_semaphores.get(guildid)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_per_guild)
+            self._guild_semaphores[guildid] = semaphore
+        return semaphore
+
+
+POOL = None
+
+
+def get_pool():
+    """Gets the process-wide generation pool, creating it on first use."""
+    global POOL
+    if POOL is None:
+        POOL = GenerationPool()
+    return POOL
+
+
+async def run(guildid, func, *args):
+    """Runs func(*args) in the process-wide generation pool."""
+    return await get_pool().run(guildid, func, *args)
@@ -0,0 +1,59 @@
+import os
+import random
+import threading
+import time
+
+from consts import LINKS_FILE, LINKS_CHECK_INTERVAL
+
+ATTACHMENT_HOST = 'discordapp'
+
+
+class LinkStore(object):
+    """
+    In-memory copy of the links file, with the indexes of its Discord attachment links.
+    The file is reloaded when its mtime changes, which is checked at most every check_interval seconds.
+    """
+
+    def __init__(self, path=LINKS_FILE, check_interval=LINKS_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self.links = []
+        self.attachment_indexes = []    # indexes in links of the links to Discord attachments
+        self.mtime_ns = None
+        self.checked = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Reloads the links if the file changed since they were loaded."""
+        now = time.monotonic()
+        if self.checked is not None and now - self.checked < self.check_interval:
+            return
+        with self._lock:
+            self.checked = now
+            try:
+                mtime_ns = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                self.links, self.attachment_indexes, self.mtime_ns = [], [], None
+                return
+            if mtime_ns == self.mtime_ns:
+                return
+            with open(self.path, 'r', encoding='utf-8-sig') as f:
+                links = [link for link in f.read().splitlines() if link]
+            self.attachment_indexes = [i for i, link in enumerate(links) if ATTACHMENT_HOST in link]
+            self.links = links
+            self.mtime_ns = mtime_ns
+
+    def get_random(self):
+        """Gets a random link, or None if there are none."""
+        self.refresh()
+        links = self.links
+        return random.choice(links) if links else None
+
+    def get_random_attachment(self):
+        """Gets a random link to a Discord attachment, or None if there are none."""
+        self.refresh()
+        links, attachment_indexes = self.links, self.attachment_indexes
+        return links[random.choice(attachment_indexes)] if attachment_indexes else None
+
+
+LINKS = LinkStore()
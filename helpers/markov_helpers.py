@@ -1,15 +1,29 @@
+import itertools
+import math
 import random
 import requests
+import time
 from threading import Thread
 
-import markovify
 import numpy as np
 import ujson
 
 from config import sentiment_token
 import consts
-from consts import MODELS_DIRECTORY, NAMES_FILE, USER_MODEL_FILE, LINKS_FILE, \
+from consts import NAMES_FILE, USER_MODEL_FILE, \
     MAX_NICKNAME_LENGTH, MAX_NUM_NAMES, MAX_MARKOV_ATTEMPTS
+from helpers import admission as adm
+from helpers import compiled_model as cm
+from helpers import generation_pool as gp
+from helpers import link_store as ls
+from helpers import member_index as mi
+from helpers import metrics
+from helpers import model_cache as mc
+from helpers import model_catalog as mcat
+from helpers import poster_sequence as pseq
+from helpers import root_index as rx
+from helpers import sentence_pool as sp
+from helpers import single_flight as sf
 from helpers import server_toggle as st
 from helpers.utility import remove_mentions
 
@@ -22,17 +36,11 @@ REFLEXIVE_TAG = 'me'
 BEGIN_TAG = 'BEGIN_LINE'
 END_TAG = 'END_LINE'
 
-try:
-    with open(USER_MODEL_FILE, 'r', encoding='utf-8-sig') as f:
-        USER_MODEL = markovify.Text.from_json(f.read())
-except FileNotFoundError:
-    USER_MODEL = None
+USER_SEQUENCE = pseq.load(USER_MODEL_FILE)
 
-try:
-    with open(LINKS_FILE, 'r', encoding='utf-8-sig') as f:
-        LINKS = f.read().splitlines()
-except FileNotFoundError:
-    LINKS = None
+RATE_LIMIT_SCOPES = {'user': 'by you', 'channel': 'in this channel', 'guild': 'in this server'}
+
+MODEL_FLIGHTS = sf.SingleFlight()
 
 
 class TooManyInputsError(Exception):
@@ -64,21 +72,58 @@ class MarkovThread(Thread):
         self.num = num
 
     async def run(self):
-        self.person_ids = await get_person_ids(self.ctx, self.name_str)
+        ctx = self.ctx
+        command = ctx.command.name if ctx.command else 'markov'
+        with metrics.COMMAND_SECONDS.time(command):
+            try:
+                async with adm.ADMISSION.admit(ctx.guild.id, ctx.channel.id, ctx.author.id, self.num):
+                    outcome = await self.generate()
+            except adm.RateLimitedError as e:
+                outcome = 'rate_limited'
+                metrics.REJECTIONS.inc(e.scope)
+                await ctx.send(f'Too many Markov chains have been requested {RATE_LIMIT_SCOPES[e.scope]}. '
+                               f'Please try again in {math.ceil(e.retry_after)} seconds.')
+            except adm.BusyError:
+                outcome = 'busy'
+                metrics.REJECTIONS.inc('busy')
+                await ctx.send('Too many Markov chains are being generated right now. Please try again later.')
+        metrics.COMMANDS.inc(outcome)
+
+    async def generate(self):
+        """Generates and sends the Markov sentences, and returns the outcome of the command for the metrics."""
+        with metrics.stage('parse_names'):
+            self.person_ids = await get_person_ids(self.ctx, self.name_str)
         if not self.person_ids:
-            return
-
-        msg, nick = generate_markov(self.ctx, self.person_ids, self.root, self.num)
+            return 'invalid_names'
+
+        nick = generate_nick(self.ctx, self.person_ids)
+        out = None
+        if consts.SENTENCE_POOL and self.root is None and self.num == 1 and len(self.person_ids) == 1:
+            with metrics.stage('sentence_pool'):
+                sentence = sp.POOL.take(self.ctx.guild.id, self.person_ids[0])
+            if sentence is not None:
+                out = sentence + '\n'
+        if out is None:
+            try:
+                out = await gp.run(self.ctx.guild.id, generate_markov_text,
+                                   self.ctx.guild.id, self.person_ids, self.root, self.num)
+            except gp.QueueFullError:
+                await self.ctx.send('Too many Markov chains are being generated right now. Please try again later.')
+                return 'queue_full'
+        msg, nick = format_markov(out, nick)
 
         bot_self = self.ctx.guild.me
 
-        msg = remove_mentions(msg, self.ctx.guild)
+        with metrics.stage('remove_mentions'):
+            msg = remove_mentions(msg, self.ctx.guild)
 
         # await bot_self.edit(nick=nick)
-        if self.num > 1:
-            await self.ctx.send(f'**{nick}**:\n{msg}')
-        else:
-            await self.ctx.send(f'**{nick}**: {msg}')
+        with metrics.stage('send'):
+            if self.num > 1:
+                await self.ctx.send(f'**{nick}**:\n{msg}')
+            else:
+                await self.ctx.send(f'**{nick}**: {msg}')
+        return 'ok'
 
 
 async def get_person_ids(ctx, name_str):
@@ -99,23 +144,58 @@ async def get_person_ids(ctx, name_str):
 
 
 def get_rand_link():
-    """Gets a random link from LINKS."""
-    return random.choice(LINKS)
+    """Gets a random link from the links file, or None if there are no links."""
+    return ls.LINKS.get_random()
 
 
 def generate_markov(ctx, person_ids, root, num=1):
     """Generates a Markov sentence and nickname based off a list of Members and a given root."""
     nick = generate_nick(ctx, person_ids)
+    out = generate_markov_text(ctx.guild.id, person_ids, root, num)
+    return format_markov(out, nick)
+
 
-    model = generate_model(ctx, person_ids)
+def generate_markov_text(guildid, person_ids, root, num=1):
+    """
+    Generates num Markov sentences from the models of a list of userids.
+    This only takes picklable arguments so that it can run in the generation pool.
+    :return: the sentences, '' if none could be generated, or None if there were no models.
+    """
+    model = get_model(guildid, person_ids)
     if not model:
-        return "Unable to retrieve models for " + nick + ".", DEFAULT_NAME
+        return None
 
-    out = ""
-    for _ in range(num):
-        sentence = generate_sentence(model, root)
-        if sentence:
-            out += sentence + '\n'
+    with metrics.stage('generation'):
+        sentences = generate_sentences(model, num, root)
+    for _, seconds in sentences:
+        metrics.SENTENCE_SECONDS.observe(seconds)
+    return ''.join(sentence + '\n' for sentence, _ in sentences)
+
+
+def generate_pool_sentences(guildid, userid, count, budget):
+    """
+    Generates up to count sentences from a user's model for their sentence pool, stopping after budget seconds of CPU.
+    :return: (the key of the model, the sentences, the CPU seconds used), with a key of None if there is no model.
+    """
+    start = time.thread_time()
+    entry = mc.get_model_entry(guildid, userid) if mcat.has_model(guildid, userid) else None
+    if entry is None:
+        return None, [], time.thread_time() - start
+    model_key, model = entry
+
+    sentences = []
+    while len(sentences) < count and time.thread_time() - start < budget:
+        sentence = generate_sentence(model)
+        if sentence is None:
+            break
+        sentences.append(sentence)
+    return model_key, sentences, time.thread_time() - start
+
+
+def format_markov(out, nick):
+    """Gets the message and nickname to post from the output of generate_markov_text."""
+    if out is None:
+        return "Unable to retrieve models for " + nick + ".", DEFAULT_NAME
     if out:
         return out, nick
     else:
@@ -128,14 +208,48 @@ def generate_sentence(model, root=None):
         if root is None:
             output = model.make_sentence(tries=MAX_MARKOV_ATTEMPTS)
         else:
-            output = model.make_sentence_with_start(
-                root, tries=MAX_MARKOV_ATTEMPTS, strict=False)
+            output = rx.make_sentence_with_start(
+                model, root, tries=MAX_MARKOV_ATTEMPTS, strict=False)
         if output is not None:
             return output
     else:
         return None
 
 
+def generate_sentences(model, num, root=None, rng=random):
+    """
+    Generates up to num distinct sentences from a model in one pass, trying at most MAX_MARKOV_ATTEMPTS times per
+    sentence. Rooted sentences all start from the list of start states, which is looked up once.
+    Compiled models also resolve the start states in the chain once for the whole batch, and draw from rng.
+    markovify.Text has no such batch API and ignores rng (drawing from the random module), so each of its sentences
+    costs a separate make_sentence call.
+    :return: list of (sentence, seconds it took to generate) pairs.
+    """
+    init_states = None if root is None else rx.get_init_states(model, root, strict=False)
+    if init_states == []:
+        return []
+
+    if isinstance(model, cm.CompiledText):
+        attempts = model.make_sentences(init_states, tries=MAX_MARKOV_ATTEMPTS, rng=rng)
+    else:
+        attempts = (model.make_sentence(None if init_states is None else random.choice(init_states),
+                                        tries=MAX_MARKOV_ATTEMPTS) for _ in itertools.count())
+
+    sentences = []
+    seen = set()
+    start = time.perf_counter()
+    for sentence in itertools.islice(attempts, num * MAX_MARKOV_ATTEMPTS):
+        if sentence is None or sentence in seen:
+            continue
+        now = time.perf_counter()
+        sentences.append((sentence, now - start))
+        seen.add(sentence)
+        if len(sentences) == num:
+            break
+        start = now
+    return sentences
+
+
 def generate_nick(ctx, person_ids):
     """Generates a nickname based off a list of Members."""
     nickname = ""
@@ -156,12 +270,6 @@ def generate_nick(ctx, person_ids):
     return nickname
 
 
-def fill_simulator_queue():
-    """Generates a list of userids to post in the htz simulator."""
-    users = USER_MODEL.make_sentence().split(' ')
-    return users
-
-
 def get_wait_time(avg, stddev):
     """Gets the wait time between messages in the htz simulator."""
     wait_time = np.random.normal(avg, stddev)
@@ -172,24 +280,58 @@ def get_wait_time(avg, stddev):
 
 def generate_model(ctx, userids, user_servers=None):
     """Generates a Markov model from a list of Member objects."""
-    models = []
+    return get_model(ctx.guild.id, userids)
+
+
+def get_model(guildid, userids):
+    """
+    Gets the (combined) Markov model of a list of userids in a guild.
+    Concurrent requests for the same users share a single load/combine.
+    """
+    key = (str(guildid), tuple(sorted(str(userid) for userid in userids)))
+    return MODEL_FLIGHTS.do(key, load_model, guildid, userids)
+
+
+def load_model(guildid, userids):
+    """Loads and combines the Markov models of a list of userids in a guild."""
+    entries = []
     for userid in userids:
         # if not user_servers:
         #     user_servers = st.get_user_servers(userid)
         #     if not user_servers:
         #         continue
         # for server in user_servers:
-        try:
-            with open(f'{MODELS_DIRECTORY}{ctx.guild.id}/{userid}.json', 'r', encoding='utf-8-sig') as json_file:
-                models.append(markovify.Text.from_json(json_file.read()))
-        except FileNotFoundError:
-            print(f'File not found for userid: {userid}, server: {ctx.guild.id}')
-            pass
-    if models:
-        return markovify.combine(models)
+        with metrics.stage('model_load'):
+            entry = mc.get_model_entry(guildid, userid) if mcat.has_model(guildid, userid) else None
+        if entry is None:
+            print(f'File not found for userid: {userid}, server: {guildid}')
+            continue
+        entries.append(entry)
+    if len(entries) == 1:
+        return entries[0][1]
+    if entries:
+        with metrics.stage('combine'):
+            return mc.get_combined_model(entries)
     return None
 
 
+def update_metrics():
+    """Copies the counters of the model caches, sentence pools and admission queues into the metrics gauges."""
+    for cache_name, stats in mc.get_stats().items():
+        metrics.CACHE_HIT_RATIO.set(stats['hit_ratio'], cache_name)
+        metrics.CACHE_ENTRIES.set(stats['entries'], cache_name)
+        metrics.CACHE_BYTES.set(stats['bytes'], cache_name)
+    metrics.CACHE_HIT_RATIO.set(sp.POOL.stats()['hit_ratio'], 'sentence_pool')
+
+    admission_stats = adm.ADMISSION.stats()
+    metrics.QUEUE_DEPTH.set(admission_stats['running'], 'admission_running')
+    metrics.QUEUE_DEPTH.set(admission_stats['waiting'], 'admission_waiting')
+    metrics.QUEUE_DEPTH.set(gp.POOL.depth if gp.POOL is not None else 0, 'generation')
+
+
+metrics.COLLECTORS.append(update_metrics)
+
+
 def parse_names(ctx, person):
     """Retrieves a string of names and converts them into a list of userids."""
     namelist = person.lower().split('+')
@@ -198,47 +340,51 @@ def parse_names(ctx, person):
         raise TooManyInputsError(num_names)
     input_ids = []
 
+    index = mi.get_index(ctx.guild)
     for name in namelist:
         # Handle built-in tags.
         if name == RANDOM_TAG:
-            input_ids.append(random.choice([member.id for member in ctx.guild.members]))
+            input_ids.extend(get_random_model_ids(ctx.guild, index, 1))
         elif name == INCLUSIVE_TAG:
-            input_ids.extend(random.sample([member.id for member in ctx.guild.members], 5))
+            input_ids.extend(get_random_model_ids(ctx.guild, index, 5))
         elif name == REFLEXIVE_TAG:
             input_ids.append(ctx.author.id)
 
-        # Otherwise, search for name in list of guild members.
+        # Otherwise, search for name in the index of guild members.
         else:
-            current_ids = []
-            for member in ctx.guild.members:
-                if member.nick and member.nick.lower() == name.lower():
-                    input_ids.append(member.id)
-                    break
-                elif member.nick and name.lower() in member.nick.lower():
-                    current_ids.append(member.id)
-                elif member.name.lower() == name.lower():
-                    input_ids.append(member.id)
-                    break
-                elif name.lower() in member.name.lower():
-                    current_ids.append(member.id)
-            # If exact match not found,
+            exact_ids = index.find_exact(name)
+            if exact_ids:
+                input_ids.append(exact_ids[0])
+                continue
+            current_ids = index.find_substring(name)
+            if current_ids == []:
+                raise NameNotFoundError(name)
+            elif len(current_ids) == 1:
+                input_ids.append(current_ids[0])
             else:
-                if current_ids == []:
-                    raise NameNotFoundError(name)
-                elif len(current_ids) == 1:
-                    input_ids.append(current_ids[0])
-                else:
-                    raise AmbiguousInputError(
-                        name,
-                        [ctx.guild.get_member(userid).name for userid in current_ids]
-                    )
-        
+                raise AmbiguousInputError(
+                    name,
+                    [ctx.guild.get_member(userid).name for userid in current_ids]
+                )
+
     return input_ids
 
+
+def get_random_model_ids(guild, index, k):
+    """Gets k random ids of guild members who have a model, or of any members if nobody has a model."""
+    member_ids = mcat.get_catalog(guild.id).get_random_member_ids(k, index.names.__contains__)
+    if not member_ids:
+        return index.random_ids(k)
+    return member_ids
+
+
 def print_names(ctx, search=None):
     messages = []
     curr_message = ""
+    catalog = mcat.get_catalog(ctx.guild.id)
     for member in ctx.guild.members:
+        if member.id not in catalog:
+            continue
         member_name = member.nick if member.nick is not None else member.name
         if search and search.lower() not in member_name.lower():
                 continue
@@ -0,0 +1,160 @@
+import random
+
+NGRAM_SIZE = 3
+
+
+def compact(name):
+    """Lowercases a name and removes its spaces."""
+    return name.replace(' ', '').lower()
+
+
+def get_ngrams(text):
+    """Gets the set of NGRAM_SIZE-character substrings of text."""
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+class MemberIndex(object):
+    """
+    Index of a guild's member names.
+
+    Exact lookups on nicks and names are dict lookups. Substring lookups intersect the sets of members containing each
+    trigram of the search (over lowercased names without spaces), then check the remaining candidates directly.
+    """
+
+    def __init__(self, members=()):
+        self.names = {}             # memberid -> (lowercase nick or None, lowercase name)
+        self.exact_nicks = {}       # lowercase nick -> set of memberids
+        self.exact_names = {}       # lowercase name -> set of memberids
+        self.exact_display = {}     # compact nick (or name if they have no nick) -> set of memberids
+        self.ngrams = {}            # trigram of a compact nick or name -> set of memberids
+        self.member_ids = []        # list of memberids, for random choices
+        self._positions = {}        # memberid -> index in member_ids
+        self.chunked = True         # whether it was built from the guild's full member list
+        for member in members:
+            self.add(member)
+
+    def __len__(self):
+        return len(self.member_ids)
+
+    def add(self, member):
+        """Adds a member to the index, replacing them if they are already in it."""
+        if member.id in self.names:
+            self.remove(member.id)
+        nick = member.nick.lower() if member.nick else None
+        name = member.name.lower()
+        self.names[member.id] = (nick, name)
+        if nick:
+            self.exact_nicks.setdefault(nick, set()).add(member.id)
+        self.exact_names.setdefault(name, set()).add(member.id)
+        self.exact_display.setdefault(compact(nick or name), set()).add(member.id)
+        for ngram in self._get_member_ngrams(nick, name):
+            self.ngrams.setdefault(ngram, set()).add(member.id)
+        self._positions[member.id] = len(self.member_ids)
+        self.member_ids.append(member.id)
+
+    def remove(self, memberid):
+        """Removes a member from the index."""
+        try:
+            nick, name = self.names.pop(memberid)
+        except KeyError:
+            return
+        if nick:
+            discard(self.exact_nicks, nick, memberid)
+        discard(self.exact_names, name, memberid)
+        discard(self.exact_display, compact(nick or name), memberid)
+        for ngram in self._get_member_ngrams(nick, name):
+            discard(self.ngrams, ngram, memberid)
+
+        # Swap the member with the last one so that removing them from member_ids is O(1).
+        position = self._positions.pop(memberid)
+        last_id = self.member_ids.pop()
+        if last_id != memberid:
+            self.member_ids[position] = last_id
+            self._positions[last_id] = position
+
+    def find_exact(self, name):
+        """Gets the ids of members whose nick, or otherwise name, is name (case insensitive)."""
+        name = name.lower()
+        return sorted(self.exact_nicks.get(name) or self.exact_names.get(name) or ())
+
+    def find_substring(self, name):
+        """Gets the ids of members whose nick or name contains name (case insensitive)."""
+        name = name.lower()
+        return sorted(memberid for memberid in self._get_candidates(compact(name))
+                      if any(curr and name in curr for curr in self.names[memberid]))
+
+    def find_display_exact(self, name):
+        """Gets the ids of members whose nick, or name if they have no nick, is name (ignoring case and spaces)."""
+        return sorted(self.exact_display.get(compact(name), ()))
+
+    def find_display_substring(self, name):
+        """Gets the ids of members whose nick, or name if they have no nick, contains name (ignoring case/spaces)."""
+        name = compact(name)
+        out = []
+        for memberid in self._get_candidates(name):
+            nick, member_name = self.names[memberid]
+            if name in compact(nick or member_name):
+                out.append(memberid)
+        return sorted(out)
+
+    def random_ids(self, k=1):
+        """Gets k distinct random member ids."""
+        return random.sample(self.member_ids, min(k, len(self.member_ids)))
+
+    def _get_candidates(self, name):
+        """Gets the ids of members who might contain name, which must be compact."""
+        if len(name) < NGRAM_SIZE:
+            return list(self.names)
+        posting_sets = sorted((self.ngrams.get(ngram, set()) for ngram in get_ngrams(name)), key=len)
+        return set.intersection(*posting_sets)
+
+    @staticmethod
+    def _get_member_ngrams(nick, name):
+        ngrams = get_ngrams(compact(name))
+        if nick:
+            ngrams |= get_ngrams(compact(nick))
+        return ngrams
+
+
+def discard(index, key, memberid):
+    """Removes memberid from index[key], removing the key if it is left empty."""
+    memberids = index.get(key)
+    if memberids is not None:
+        memberids.discard(memberid)
+        if not memberids:
+            del index[key]
+
+
+INDEXES = {}
+
+
+def get_index(guild):
+    """
+    Gets the member index of a guild, building it the first time, and again once the guild's members are all loaded
+    if it was built before. After that, the member listeners keep it up to date.
+    """
+    index = INDEXES.get(guild.id)
+    if index is None or (not index.chunked and guild.chunked):
+        index = INDEXES[guild.id] = MemberIndex(guild.members)
+        index.chunked = guild.chunked
+    return index
+
+
+def add_member(member):
+    """Adds a member who joined (or changed their name) to their guild's index, if it was built."""
+    index = INDEXES.get(member.guild.id)
+    if index is not None:
+        index.add(member)
+
+
+def remove_member(member):
+    """Removes a member who left from their guild's index, if it was built."""
+    index = INDEXES.get(member.guild.id)
+    if index is not None:
+        index.remove(member.id)
+
+
+def update_member(before, after):
+    """Updates the index when a member's nick or name changes."""
+    if before.nick != after.nick or before.name != after.name:
+        add_member(after)
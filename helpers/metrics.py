@@ -0,0 +1,187 @@
+import asyncio
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+from consts import METRICS_HOST, METRICS_PORT, METRICS_FILE, METRICS_DUMP_INTERVAL, EVENT_LOOP_LAG_INTERVAL
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metric(object):
+    """Base class of metrics, which hold one value per tuple of label values."""
+
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def render(self):
+        """Renders the metric in the Prometheus text format."""
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.extend(self._render_value(label_values, value))
+        return '\n'.join(lines)
+
+    def _render_value(self, label_values, value):
+        return [f'{self.name}{format_labels(self.labels, label_values)} {value}']
+
+
+class Counter(Metric):
+    """Value that only goes up."""
+
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that can go up and down."""
+
+    kind = 'gauge'
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram(Metric):
+    """Distribution of observed values, counted in cumulative buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                # Bucket counts (the last one is +Inf), then the sum of the values.
+                counts = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        """Observes the number of seconds the context takes."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def _render_value(self, label_values, counts):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            bucket_labels = format_labels(self.labels + ('le',), label_values + (bound,))
+            lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+        labels = format_labels(self.labels, label_values)
+        lines.append(f'{self.name}_sum{labels} {counts[-1]}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+def format_labels(labels, label_values):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{label}="{value}"' for label, value in zip(labels, label_values)) + '}'
+
+
+STAGE_SECONDS = Histogram('markov_stage_seconds', 'Seconds taken by each stage of a Markov command.', ['stage'])
+COMMAND_SECONDS = Histogram('markov_command_seconds', 'Seconds taken by Markov commands from start to reply.',
+                            ['command'])
+SENTENCE_SECONDS = Histogram('markov_sentence_seconds', 'Seconds taken to generate each sentence of a Markov command.')
+COMMANDS = Counter('markov_commands_total', 'Markov commands by outcome.', ['outcome'])
+EVENT_LOOP_LAG = Histogram('markov_event_loop_lag_seconds', 'How late the event loop ran a scheduled wake-up.')
+CACHE_HIT_RATIO = Gauge('markov_cache_hit_ratio', 'Hit ratio of the model caches and sentence pools.', ['cache'])
+CACHE_ENTRIES = Gauge('markov_cache_entries', 'Number of entries in the model caches.', ['cache'])
+CACHE_BYTES = Gauge('markov_cache_bytes', 'Size budget used by the model caches.', ['cache'])
+QUEUE_DEPTH = Gauge('markov_queue_depth', 'Number of Markov commands running or waiting.', ['queue'])
+REJECTIONS = Counter('markov_admission_rejections_total', 'Markov commands rejected by admission control.', ['scope'])
+
+METRICS = [STAGE_SECONDS, COMMAND_SECONDS, SENTENCE_SECONDS, COMMANDS, EVENT_LOOP_LAG, CACHE_HIT_RATIO, CACHE_ENTRIES,
+           CACHE_BYTES, QUEUE_DEPTH, REJECTIONS]
+COLLECTORS = []     # functions called before rendering, to copy other modules' counters into gauges
+
+
+def stage(name):
+    """Context manager that times a stage of a Markov command."""
+    return STAGE_SECONDS.time(name)
+
+
+def render():
+    """Renders every metric in the Prometheus text format."""
+    for collect in COLLECTORS:
+        collect()
+    return '\n'.join(metric.render() for metric in METRICS) + '\n'
+
+
+def dump(path=METRICS_FILE):
+    """Writes every metric to a file, which is replaced atomically."""
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(render())
+    os.replace(path + '.tmp', path)
+
+
+async def measure_event_loop_lag(interval=EVENT_LOOP_LAG_INTERVAL):
+    """Measures how late the event loop wakes up from a sleep of interval seconds, until cancelled."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, time.perf_counter() - start - interval))
+
+
+async def dump_periodically(path=METRICS_FILE, interval=METRICS_DUMP_INTERVAL):
+    """Dumps the metrics to a file every interval seconds, until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            dump(path)
+        except OSError as e:
+            print(f'Unable to write metrics to {path}: {e}')
+
+
+async def start(host=METRICS_HOST, port=METRICS_PORT, path=METRICS_FILE):
+    """
+    Starts measuring event loop lag, and serving the metrics on http://host:port/metrics and/or dumping them to path.
+    :return: list of the background tasks and the aiohttp runner (or None), to be passed to stop().
+    """
+    tasks = [asyncio.ensure_future(measure_event_loop_lag())]
+    if path:
+        tasks.append(asyncio.ensure_future(dump_periodically(path)))
+
+    runner = None
+    if port:
+        async def handle_metrics(request):
+            return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+
+        app = web.Application()
+        app.router.add_get('/metrics', handle_metrics)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        print(f'Serving metrics on http://{host}:{port}/metrics')
+    return tasks, runner
+
+
+async def stop(tasks, runner):
+    """Stops what start() started."""
+    for task in tasks:
+        task.cancel()
+    if runner is not None:
+        await runner.cleanup()
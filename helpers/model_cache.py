@@ -0,0 +1,272 @@
+import os
+import threading
+from collections import OrderedDict
+
+import markovify
+
+from consts import COMPILED_MODELS, MODELS_DIRECTORY, MODEL_CACHE_MAX_BYTES, COMBINED_MODEL_CACHE_MAX_BYTES
+from helpers import compiled_model as cm
+from helpers import model_store as ms
+
+
+class LRUCache(object):
+    """Thread-safe LRU cache with a byte-size budget and hit/miss counters."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.curr_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()   # key -> (value, size)
+        self._lock = threading.RLock()
+
+    def lookup(self, key):
+        """Returns the value stored under key, or None (counting a miss) if it is not cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        """Adds a value to the cache, evicting the least recently used values until it fits in the budget."""
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.remove(key)
+            self._entries[key] = (value, size)
+            self.curr_bytes += size
+            while self.curr_bytes > self.max_bytes:
+                self.remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def remove(self, key):
+        """Removes a key from the cache if it is present."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.curr_bytes -= entry[1]
+                self._on_remove(key)
+
+    def clear(self):
+        """Removes every value from the cache."""
+        with self._lock:
+            for key in list(self._entries):
+                self.remove(key)
+
+    def stats(self):
+        """Returns a dict of the cache's counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.curr_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
+
+    def _on_remove(self, key):
+        """Called (with the lock held) whenever a key leaves the cache."""
+        pass
+
+
+class ModelCache(LRUCache):
+    """LRU cache of deserialized user models keyed by (guildid, userid, model file mtime)."""
+
+    def __init__(self, max_bytes=MODEL_CACHE_MAX_BYTES):
+        super().__init__(max_bytes)
+        self._current_keys = {}     # (guildid, userid) -> key of the newest cached version
+        self.stale_callbacks = []   # called with (guildid, userid) when a user's model file changes
+
+    def get_entry(self, guildid, userid):
+        """Returns the (key, model) pair for a user, loading the model on a miss, or None if there is no model."""
+        store = ms.get_store(guildid) if COMPILED_MODELS else None
+        if store is not None and store.has_model(userid):
+            key = (str(guildid), str(userid), store.mtime_ns)
+            model = self.lookup(key)
+            if model is None:
+                model = store.get_model(userid)
+                # Packed models are views into a shared memory map, so only the index built from them on first use
+                # counts against the budget.
+                self.put(key, model, model.get_root_index_nbytes())
+            return key, model
+
+        model_file = find_model_file(guildid, userid)
+        if model_file is None:
+            return None
+        path, stat = model_file
+        key = (str(guildid), str(userid), stat.st_mtime_ns)
+
+        model = self.lookup(key)
+        if model is not None:
+            return key, model
+
+        try:
+            model = load_model(path)
+        except FileNotFoundError:
+            return None
+        self.put(key, model, stat.st_size)
+        return key, model
+
+    def get(self, guildid, userid):
+        """Returns the model for a user, or None if there is no model file."""
+        entry = self.get_entry(guildid, userid)
+        return entry[1] if entry else None
+
+    def get_size(self, key):
+        """Gets the size of the model stored under key."""
+        store = ms.get_store(key[0]) if COMPILED_MODELS else None
+        if store is not None and store.has_model(key[1]):
+            return store.get_nbytes(key[1])
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry[1]
+        model_file = find_model_file(*key[:2])
+        return model_file[1].st_size if model_file else 0
+
+    def put(self, key, value, size):
+        with self._lock:
+            old_key = self._current_keys.get(key[:2])
+            if old_key is not None and old_key != key:
+                # The user's model file changed, so drop the older version.
+                self.remove(old_key)
+                for callback in self.stale_callbacks:
+                    callback(*key[:2])
+            super().put(key, value, size)
+            if key in self._entries:
+                self._current_keys[key[:2]] = key
+
+    def remove_store(self, store):
+        """Removes the models of a replaced model store, so that its pack can be unmapped."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == store.guildid and key[2] == store.mtime_ns]:
+                self.remove(key)
+                for callback in self.stale_callbacks:
+                    callback(*key[:2])
+
+    def _on_remove(self, key):
+        if self._current_keys.get(key[:2]) == key:
+            del self._current_keys[key[:2]]
+
+
+class CombinedModelCache(LRUCache):
+    """LRU cache of combined models keyed by the sorted tuple of their member model keys."""
+
+    def __init__(self, max_bytes=COMBINED_MODEL_CACHE_MAX_BYTES):
+        super().__init__(max_bytes)
+        self._members = {}  # (guildid, userid) -> set of combined keys containing that user
+
+    def get(self, entries):
+        """Returns the combination of a list of (key, model) pairs, combining them on a miss."""
+        entries = sorted(entries, key=lambda entry: entry[0])
+        key = tuple(entry[0] for entry in entries)
+
+        model = self.lookup(key)
+        if model is not None:
+            return model
+
+        model = cm.combine([entry[1] for entry in entries])
+        size = sum(MODEL_CACHE.get_size(member_key) for member_key in key)
+        self.put(key, model, size)
+        return model
+
+    def put(self, key, value, size):
+        with self._lock:
+            super().put(key, value, size)
+            if key in self._entries:
+                for member_key in key:
+                    self._members.setdefault(member_key[:2], set()).add(key)
+
+    def invalidate(self, guildid, userid):
+        """Removes every combined model containing a user."""
+        with self._lock:
+            for key in list(self._members.get((str(guildid), str(userid)), ())):
+                self.remove(key)
+
+    def _on_remove(self, key):
+        for member_key in key:
+            combined_keys = self._members.get(member_key[:2])
+            if combined_keys is not None:
+                combined_keys.discard(key)
+                if not combined_keys:
+                    del self._members[member_key[:2]]
+
+
+MODEL_CACHE = ModelCache()
+COMBINED_MODEL_CACHE = CombinedModelCache()
+MODEL_CACHE.stale_callbacks.append(COMBINED_MODEL_CACHE.invalidate)
+ms.REPLACED_CALLBACKS.append(MODEL_CACHE.remove_store)
+
+
+def get_model_path(guildid, userid):
+    """Gets the path of a user's model file."""
+    return f'{MODELS_DIRECTORY}{guildid}/{userid}.json'
+
+
+def get_compiled_model_path(guildid, userid):
+    """Gets the path of a user's compiled model file."""
+    return f'{MODELS_DIRECTORY}{guildid}/{userid}{cm.COMPILED_MODEL_EXTENSION}'
+
+
+def find_model_file(guildid, userid):
+    """Gets the (path, os.stat_result) of a user's compiled model, or JSON model, or None if neither exist."""
+    paths = [get_model_path(guildid, userid)]
+    if COMPILED_MODELS:
+        paths.insert(0, get_compiled_model_path(guildid, userid))
+    for path in paths:
+        try:
+            return path, os.stat(path)
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def load_model(path):
+    """Opens and deserializes a model file."""
+    if path.endswith(cm.COMPILED_MODEL_EXTENSION):
+        return cm.CompiledText.load(path)
+    with open(path, 'r', encoding='utf-8-sig') as json_file:
+        return markovify.Text.from_json(json_file.read())
+
+
+def get_model(guildid, userid):
+    """Gets a user's model from the process-wide cache, or None if it does not exist."""
+    return MODEL_CACHE.get(guildid, userid)
+
+
+def get_model_entry(guildid, userid):
+    """Gets a user's (key, model) pair from the process-wide cache, or None if it does not exist."""
+    return MODEL_CACHE.get_entry(guildid, userid)
+
+
+def get_combined_model(entries):
+    """Gets the combined model of a list of (key, model) pairs from the process-wide cache."""
+    return COMBINED_MODEL_CACHE.get(entries)
+
+
+def get_stats():
+    """Gets the hit/miss counters of the process-wide caches."""
+    return {
+        'models': MODEL_CACHE.stats(),
+        'combined': COMBINED_MODEL_CACHE.stats()
+    }
+
+
+def get_model_key(guildid, userid):
+    """Gets the cache key of a user's current model without loading it, or None if they have no model."""
+    store = ms.get_store(guildid) if COMPILED_MODELS else None
+    if store is not None and store.has_model(userid):
+        return str(guildid), str(userid), store.mtime_ns
+    model_file = find_model_file(guildid, userid)
+    if model_file is None:
+        return None
+    return str(guildid), str(userid), model_file[1].st_mtime_ns
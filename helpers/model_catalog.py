@@ -0,0 +1,92 @@
+import os
+import random
+import threading
+
+from consts import MODELS_DIRECTORY
+from helpers import compiled_model as cm
+from helpers import model_store as ms
+
+MODEL_EXTENSIONS = ('.json', cm.COMPILED_MODEL_EXTENSION)
+RANDOM_ATTEMPTS = 10    # Number of random draws per id before get_random_member_ids falls back to a full scan.
+
+
+class ModelCatalog(object):
+    """The set of userids that have a model in a guild, built from a scan of the guild's model directory."""
+
+    def __init__(self, guildid):
+        self.guildid = str(guildid)
+        self.directory = f'{MODELS_DIRECTORY}{guildid}/'
+        self.mtime_ns = None
+        self.userids = frozenset()
+        self.member_ids = []
+
+    def refresh(self):
+        """Rescans the model directory if it changed since the last scan."""
+        try:
+            mtime_ns = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = None
+        if mtime_ns == self.mtime_ns and self.mtime_ns is not None:
+            return
+        userids = set()
+        if mtime_ns is not None:
+            for filename in os.listdir(self.directory):
+                for extension in MODEL_EXTENSIONS:
+                    if filename.endswith(extension):
+                        userids.add(filename[:-len(extension)])
+            store = ms.get_store(self.guildid)
+            if store is not None:
+                userids.update(store.index.keys())
+        self.userids = frozenset(userids)
+        self.member_ids = [int(userid) for userid in userids if userid.isdigit()]
+        self.mtime_ns = mtime_ns
+
+    def get_random_member_ids(self, k, is_member):
+        """
+        Gets up to k distinct random ids of the catalog for which is_member(id) is true.
+        Ids are drawn at random until enough of them pass, so the catalog is only scanned as a whole if few of them do.
+        """
+        member_ids = self.member_ids
+        chosen = []
+        for _ in range(RANDOM_ATTEMPTS * k):
+            if len(chosen) >= k or not member_ids:
+                break
+            memberid = member_ids[random.randrange(len(member_ids))]
+            if memberid not in chosen and is_member(memberid):
+                chosen.append(memberid)
+        else:
+            candidates = [memberid for memberid in member_ids if memberid not in chosen and is_member(memberid)]
+            chosen.extend(random.sample(candidates, min(k - len(chosen), len(candidates))))
+        return chosen
+
+    def __contains__(self, userid):
+        return str(userid) in self.userids
+
+    def __len__(self):
+        return len(self.userids)
+
+
+CATALOGS = {}
+CATALOGS_LOCK = threading.Lock()
+
+
+def get_catalog(guildid):
+    """Gets the up-to-date model catalog of a guild."""
+    guildid = str(guildid)
+    with CATALOGS_LOCK:
+        catalog = CATALOGS.get(guildid)
+        if catalog is None:
+            catalog = CATALOGS[guildid] = ModelCatalog(guildid)
+        catalog.refresh()
+        return catalog
+
+
+def invalidate(guildid):
+    """Forces the next get_catalog call for a guild to rescan its model directory."""
+    with CATALOGS_LOCK:
+        CATALOGS.pop(str(guildid), None)
+
+
+def has_model(guildid, userid):
+    """Returns whether a user has a model in a guild."""
+    return userid in get_catalog(guildid)
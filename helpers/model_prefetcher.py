@@ -0,0 +1,54 @@
+import asyncio
+from collections import OrderedDict
+
+from helpers import model_cache as mc
+
+
+class ModelPrefetcher(object):
+    """
+    Loads the models of upcoming posters in the background, so that they are ready when it is their turn to post.
+    Prefetched models are kept (at most max_models of them) until they are taken with get().
+    """
+
+    def __init__(self, guildid, max_models, executor=None):
+        self.guildid = guildid
+        self.max_models = max_models
+        self.executor = executor
+        self.hits = 0
+        self.misses = 0
+        self._futures = OrderedDict()   # userid -> Future of their model
+
+    def prefetch(self, userids):
+        """
+        Starts loading the models of userids (in order) that are not loaded or loading yet.
+        Models that were prefetched for users who are no longer upcoming are dropped.
+        """
+        for userid in [userid for userid in self._futures if userid not in userids]:
+            self._futures.pop(userid).cancel()
+
+        loop = asyncio.get_event_loop()
+        for userid in userids:
+            if len(self._futures) >= self.max_models:
+                break
+            if userid not in self._futures:
+                self._futures[userid] = loop.run_in_executor(self.executor, mc.get_model, self.guildid, userid)
+
+    async def get(self, userid):
+        """Gets a user's model, waiting for its prefetch if it was started, and evicts it from the prefetcher."""
+        future = self._futures.pop(userid, None)
+        if future is None:
+            self.misses += 1
+            future = asyncio.get_event_loop().run_in_executor(self.executor, mc.get_model, self.guildid, userid)
+        else:
+            self.hits += 1
+        try:
+            return await future
+        except Exception as e:
+            print(f'Unable to load model for userid {userid}: {e}')
+            return None
+
+    def clear(self):
+        """Drops every prefetched model."""
+        for future in self._futures.values():
+            future.cancel()
+        self._futures.clear()
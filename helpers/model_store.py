@@ -0,0 +1,136 @@
+import mmap
+import os
+import struct
+import threading
+
+import numpy as np
+import ujson
+
+from consts import MODELS_DIRECTORY
+from helpers import compiled_model as cm
+
+PACK_FILENAME = 'models.pack'
+PACK_MAGIC = b'MKPACK01'
+FOOTER = struct.Struct('<Q8s')     # offset of the JSON index, magic
+ALIGNMENT = 64
+
+
+class ModelStore(object):
+    """
+    Read-only view of a guild's packed compiled models.
+
+    A pack is the aligned arrays of every model, followed by a JSON index of {userid: {name: [offset, dtype, shape]}}
+    and a footer with the offset of the index.
+
+    The pack file is memory-mapped, and every model is built from numpy views into the map, so every process using
+    the store shares the same pages through the OS page cache instead of holding its own copy of each model.
+    """
+
+    def __init__(self, guildid):
+        self.guildid = str(guildid)
+        with open(get_pack_path(guildid), 'rb') as f:
+            self.mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        index_offset, magic = FOOTER.unpack_from(self._map, len(self._map) - FOOTER.size)
+        if magic != PACK_MAGIC:
+            raise ValueError(f'{get_pack_path(guildid)} is not a model pack.')
+        self.index = ujson.loads(self._map[index_offset:len(self._map) - FOOTER.size].decode('utf-8'))
+
+    def has_model(self, userid):
+        """Returns whether the store contains a model for a user."""
+        return str(userid) in self.index
+
+    def get_nbytes(self, userid):
+        """Gets the number of bytes a user's model takes up in the pack."""
+        return sum(np.dtype(dtype).itemsize * int(np.prod(shape))
+                   for _, dtype, shape in self.index[str(userid)].values())
+
+    def get_model(self, userid):
+        """Gets a user's model as a CompiledText backed by the memory map, or None if it is not in the store."""
+        try:
+            entry = self.index[str(userid)]
+        except KeyError:
+            return None
+        arrays = {}
+        for name, (offset, dtype, shape) in entry.items():
+            count = int(np.prod(shape))
+            arrays[name] = np.frombuffer(self._map, dtype=np.dtype(dtype), count=count, offset=offset).reshape(shape)
+        return cm.CompiledText(arrays)
+
+    def close(self):
+        """
+        Unmaps the pack. If models built from it are still in use, it is instead unmapped once the last of them is
+        garbage collected.
+        """
+        try:
+            self._map.close()
+        except BufferError:
+            pass
+
+
+STORES = {}
+STORES_LOCK = threading.Lock()
+REPLACED_CALLBACKS = []     # called with the old store when a guild's pack is rewritten, before it is closed
+
+
+def get_pack_path(guildid):
+    return f'{MODELS_DIRECTORY}{guildid}/{PACK_FILENAME}'
+
+
+def get_store(guildid):
+    """
+    Gets the model store of a guild, reopening it if the pack was rewritten, or None if it has no pack.
+    The old store is closed once the REPLACED_CALLBACKS have dropped the models built from it.
+    """
+    guildid = str(guildid)
+    try:
+        mtime_ns = os.stat(get_pack_path(guildid)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    with STORES_LOCK:
+        store = old_store = STORES.get(guildid)
+        if store is None or store.mtime_ns != mtime_ns:
+            try:
+                store = ModelStore(guildid)
+            except (FileNotFoundError, ValueError):
+                return None
+            STORES[guildid] = store
+        else:
+            old_store = None
+
+    if old_store is not None:
+        for callback in REPLACED_CALLBACKS:
+            callback(old_store)
+        old_store.close()
+    return store
+
+
+def pack_guild(guildid):
+    """
+    Packs every compiled model of a guild into a single file.
+    The pack is written to a temporary file and renamed, so processes that have the old pack mapped are unaffected.
+    """
+    server_model_dir = f'{MODELS_DIRECTORY}{guildid}/'
+    userids = sorted(x[:-len(cm.COMPILED_MODEL_EXTENSION)] for x in os.listdir(server_model_dir)
+                     if x.endswith(cm.COMPILED_MODEL_EXTENSION))
+
+    pack_path = get_pack_path(guildid)
+    index = {}
+    with open(pack_path + '.tmp', 'wb') as pack_fp:
+        offset = 0
+        for userid in userids:
+            with np.load(f'{server_model_dir}{userid}{cm.COMPILED_MODEL_EXTENSION}') as npz_file:
+                index[userid] = {}
+                for name in npz_file.files:
+                    array = np.ascontiguousarray(npz_file[name])
+                    padding = -offset % ALIGNMENT
+                    pack_fp.write(b'\0' * padding)
+                    offset += padding
+                    index[userid][name] = [offset, array.dtype.str, list(array.shape)]
+                    pack_fp.write(array.tobytes())
+                    offset += array.nbytes
+        pack_fp.write(ujson.dumps(index).encode('utf-8'))
+        pack_fp.write(FOOTER.pack(offset, PACK_MAGIC))
+    os.replace(pack_path + '.tmp', pack_path)
+    print(f'Packed {len(userids)} models for server {guildid}.')
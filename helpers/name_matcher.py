@@ -0,0 +1,169 @@
+import os
+import threading
+import time
+from collections import deque
+
+import ujson
+
+from consts import NAMES_FILE, BOTS_FILE, NAMES_CHECK_INTERVAL
+
+
+class NameMatcher(object):
+    """
+    Aho-Corasick automaton over the names of many users, which finds every user named in a message in one pass over
+    the message, however many names there are. Matching is case-sensitive, like `name in msg`.
+    """
+
+    def __init__(self):
+        self.goto = [{}]        # state -> {character: next state}
+        self.fail = [0]         # state -> state of the longest proper suffix that is also a prefix of a name
+        self.outputs = [()]     # state -> userids of the names that end at this state or at its failure states
+        self._userids = [[]]    # state -> userids of the names that end at this state
+
+    @classmethod
+    def from_names(cls, names):
+        """
+        Builds the matcher of a dict of userid -> list of names.
+        """
+        matcher = cls()
+        for userid, user_names in names.items():
+            for name in user_names:
+                matcher.add(userid, name)
+        matcher.build()
+        return matcher
+
+    def add(self, userid, name):
+        """Adds a name to the trie. build() must be called before the name can be found."""
+        if not name:
+            return
+        state = 0
+        for char in name:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = self.goto[state][char] = len(self.goto)
+                self.goto.append({})
+                self._userids.append([])
+            state = next_state
+        if userid not in self._userids[state]:
+            self._userids[state].append(userid)
+
+    def build(self):
+        """(Re)builds the failure links and outputs of every state, which takes one pass over the trie."""
+        fail = [0] * len(self.goto)
+        outputs = [tuple(userids) for userids in self._userids]
+        # Breadth-first, so the failure state of every state is built before the states below it.
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                fail_state = fail[state]
+                while fail_state and char not in self.goto[fail_state]:
+                    fail_state = fail[fail_state]
+                fail[next_state] = self.goto[fail_state].get(char, 0)
+                outputs[next_state] += tuple(userid for userid in outputs[fail[next_state]]
+                                             if userid not in outputs[next_state])
+                queue.append(next_state)
+        self.fail = fail
+        self.outputs = outputs
+
+    def find(self, text):
+        """
+        Finds the users named in a text.
+        :return: list of the userids, in the order their names first end in the text.
+        """
+        found = {}
+        state = 0
+        for char in text:
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for userid in self.outputs[state]:
+                found.setdefault(userid, None)
+        return list(found)
+
+    def __len__(self):
+        """Number of states of the automaton."""
+        return len(self.goto)
+
+
+class NameDirectory(object):
+    """
+    Shared name matcher over the names file (lines of userid;name) and the names of the bots in the bots file.
+
+    Both files are checked for changes at most every check_interval seconds. The names file is only ever appended to,
+    so only its new lines are added to the automaton; any other change rebuilds it from scratch.
+    """
+
+    def __init__(self, names_path=NAMES_FILE, bots_path=BOTS_FILE, check_interval=NAMES_CHECK_INTERVAL):
+        self.names_path = names_path
+        self.bots_path = bots_path
+        self.check_interval = check_interval
+        self.matcher = NameMatcher()
+        self.names_offset = 0           # number of bytes of the names file in the matcher
+        self.names_mtime_ns = None
+        self.bots_mtime_ns = None
+        self.checked = None
+        self._lock = threading.Lock()
+
+    def find(self, text):
+        """Finds the userids of the users named in a text, in the order their names first end in it."""
+        self.refresh()
+        with self._lock:
+            return self.matcher.find(text)
+
+    def refresh(self):
+        """Updates the matcher if the names or bots file changed since they were read."""
+        now = time.monotonic()
+        if self.checked is not None and now - self.checked < self.check_interval:
+            return
+        with self._lock:
+            self.checked = now
+            names_stat = get_stat(self.names_path)
+            bots_stat = get_stat(self.bots_path)
+            names_mtime_ns = names_stat.st_mtime_ns if names_stat else None
+            bots_mtime_ns = bots_stat.st_mtime_ns if bots_stat else None
+            if names_mtime_ns == self.names_mtime_ns and bots_mtime_ns == self.bots_mtime_ns:
+                return
+
+            if bots_mtime_ns != self.bots_mtime_ns or names_stat is None or names_stat.st_size < self.names_offset:
+                self.matcher = NameMatcher()
+                self.names_offset = 0
+                self._add_bots()
+            self._add_names()
+            self.matcher.build()
+            self.names_mtime_ns, self.bots_mtime_ns = names_mtime_ns, bots_mtime_ns
+
+    def _add_names(self):
+        try:
+            with open(self.names_path, 'rb') as f:
+                f.seek(self.names_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # Only read up to the last full line, in case the file is being written.
+        data = data[:data.rfind(b'\n') + 1]
+        self.names_offset += len(data)
+        for line in data.decode('utf-8-sig').splitlines():
+            userid, _, name = line.partition(';')
+            if name:
+                self.matcher.add(userid.lstrip('\ufeff'), name)
+
+    def _add_bots(self):
+        try:
+            with open(self.bots_path, 'r', encoding='utf-8-sig') as f:
+                bots = ujson.load(f)
+        except FileNotFoundError:
+            return
+        for userid in bots.keys():
+            for name in bots[userid]['names']:
+                self.matcher.add(userid, name)
+
+
+def get_stat(path):
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+
+NAMES = NameDirectory()
@@ -0,0 +1,144 @@
+import hashlib
+import math
+
+import numpy as np
+
+from consts import NOVELTY_FILTER_MAX_LENGTH, NOVELTY_FILTER_ERROR_RATE
+
+MASK = 2 ** 64 - 1
+PRIME = 0x100000001b3                   # multiplier of the n-gram hash
+PRIME_INVERSE = 0xce965057aff6957b      # PRIME ** -1 mod 2 ** 64 (pow(PRIME, -1, 2 ** 64) needs Python 3.8)
+MIX_1 = 0xbf58476d1ce4e5b9              # splitmix64 finalizer constants
+MIX_2 = 0x94d049bb133111eb
+
+assert PRIME * PRIME_INVERSE & MASK == 1
+
+
+class NoveltyFilter(object):
+    """
+    Bloom filter of the word n-grams of a corpus, of lengths 1 to max_length.
+
+    It answers markovify's novelty check (whether a generated sentence repeats a long run of words of the original
+    text) in O(sentence length) without keeping the text. The n-gram of words w_0 ... w_(L-1) is hashed as
+    sum(hash(w_i) * PRIME ** i) mod 2 ** 64, so that the hashes of every window of a sentence can be rolled.
+    False positives only reject a few more sentences than markovify would.
+    """
+
+    def __init__(self, bits, num_hashes, max_length):
+        self.bits = bits                    # uint8, little-endian bit array
+        self.num_bits = len(bits) * 8
+        self.num_hashes = num_hashes
+        self.max_length = max_length
+
+    @classmethod
+    def build(cls, sentences, max_length=NOVELTY_FILTER_MAX_LENGTH, error_rate=NOVELTY_FILTER_ERROR_RATE):
+        """Builds the filter of a list of sentences (lists of words), read as one run of words like rejoined_text."""
+        word_ids = {}
+        stream = np.array([word_ids.setdefault(word, len(word_ids)) for sentence in sentences for word in sentence],
+                          dtype=np.int64)
+        word_hashes = np.array([hash_word(word) for word in word_ids], dtype=np.uint64)[stream]
+
+        ngram_hashes = []
+        hashes = np.zeros(len(stream), dtype=np.uint64)
+        power = 1
+        for length in range(1, min(max_length, len(stream)) + 1):
+            hashes = hashes[:len(stream) - length + 1] + word_hashes[length - 1:] * np.uint64(power)
+            ngram_hashes.append(hashes)
+            power = (power * PRIME) & MASK
+        ngram_hashes = np.sort(np.concatenate(ngram_hashes)) if ngram_hashes else np.zeros(0, dtype=np.uint64)
+        num_items = max(int(np.count_nonzero(ngram_hashes[1:] != ngram_hashes[:-1])) + 1, 1)
+
+        num_bits = max(64, int(math.ceil(-num_items * math.log(error_rate) / math.log(2) ** 2 / 8)) * 8)
+        num_hashes = max(1, int(round(num_bits / num_items * math.log(2))))
+        flags = np.zeros(num_bits, dtype=bool)
+        for positions in iter_positions(mix(ngram_hashes), num_hashes, num_bits):
+            flags[positions] = True
+        # Little-endian bit order, reversing each byte's bits by hand (packbits has no bitorder before numpy 1.17).
+        return cls(np.packbits(flags.reshape(-1, 8)[:, ::-1]), num_hashes, max_length)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Gets the filter stored in a compiled model's arrays, or None if it has none."""
+        if 'ngram_bits' not in arrays:
+            return None
+        num_hashes, max_length = (int(x) for x in arrays['ngram_params'])
+        return cls(arrays['ngram_bits'], num_hashes, max_length)
+
+    def get_arrays(self):
+        """Gets the arrays that store the filter in a compiled model."""
+        return {
+            'ngram_bits': self.bits,
+            'ngram_params': np.array([self.num_hashes, self.max_length], dtype=np.int64)
+        }
+
+    def contains_any(self, words, length):
+        """Returns whether any window of length words (at most max_length) of words is probably in the corpus."""
+        word_hashes = [hash_word(word) for word in words]
+        power = pow(PRIME, length - 1, 2 ** 64)
+        ngram_hash = 0
+        for i in range(length):
+            ngram_hash = (ngram_hash + word_hashes[i] * pow(PRIME, i, 2 ** 64)) & MASK
+        for i in range(len(words) - length + 1):
+            if i > 0:
+                ngram_hash = ((ngram_hash - word_hashes[i - 1]) * PRIME_INVERSE
+                              + word_hashes[i + length - 1] * power) & MASK
+            if self.contains_hash(ngram_hash):
+                return True
+        return False
+
+    def contains_hash(self, ngram_hash):
+        """Returns whether an n-gram hash was probably added to the filter."""
+        mixed = mix_int(ngram_hash)
+        low, high = mixed & 0xffffffff, (mixed >> 32) | 1
+        for i in range(self.num_hashes):
+            position = ((low + i * high) & MASK) % self.num_bits
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def test_sentence_output(self, words, max_overlap_ratio, max_overlap_total):
+        """
+        Same as markovify.Text.test_sentence_output, but on whole words: rejects sentences containing a run of
+        min(max_overlap_ratio * len(words), max_overlap_total) + 1 words of the corpus. Runs longer than max_length
+        are checked as runs of max_length words.
+        """
+        overlap_max = min(max_overlap_total, int(round(max_overlap_ratio * len(words))))
+        length = min(overlap_max + 1, len(words), self.max_length)
+        return length == 0 or not self.contains_any(words, length)
+
+
+def hash_word(word):
+    """Gets the 64-bit hash of a word, which is the same in every process."""
+    return int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def mix(hashes):
+    """Scrambles an array of uint64 hashes with the splitmix64 finalizer."""
+    hashes = hashes ^ (hashes >> np.uint64(30))
+    hashes = hashes * np.uint64(MIX_1)
+    hashes = hashes ^ (hashes >> np.uint64(27))
+    hashes = hashes * np.uint64(MIX_2)
+    return hashes ^ (hashes >> np.uint64(31))
+
+
+def mix_int(ngram_hash):
+    """Same as mix, for a single int."""
+    ngram_hash ^= ngram_hash >> 30
+    ngram_hash = (ngram_hash * MIX_1) & MASK
+    ngram_hash ^= ngram_hash >> 27
+    ngram_hash = (ngram_hash * MIX_2) & MASK
+    return ngram_hash ^ (ngram_hash >> 31)
+
+
+def iter_positions(mixed_hashes, num_hashes, num_bits):
+    """Yields the array of bit positions of every hash function for an array of mixed hashes."""
+    low = mixed_hashes & np.uint64(0xffffffff)
+    high = (mixed_hashes >> np.uint64(32)) | np.uint64(1)
+    for i in range(num_hashes):
+        yield (low + np.uint64(i) * high) % np.uint64(num_bits)
+
+
+def test_sentence_output(filters, words, max_overlap_ratio, max_overlap_total):
+    """Returns whether a sentence passes the novelty check of every filter."""
+    return all(novelty_filter.test_sentence_output(words, max_overlap_ratio, max_overlap_total)
+               for novelty_filter in filters)
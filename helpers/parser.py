@@ -1,40 +1,127 @@
+import io
 import os
+import sys
 import ujson
+from collections import OrderedDict
 from datetime import datetime
 
-import markovify
-
-from consts import SERVER_JSON_DIRECTORY, MESSAGES_DIRECTORY, NAMES_FILE, LINKS_FILE, POST_SEPARATOR
+from consts import MESSAGES_DIRECTORY, NAMES_FILE, LINKS_FILE, POST_SEPARATOR, HIGH_WATER_MARKS_JSON, \
+    DELTA_DIRECTORY, PARSE_FLUSH_SIZE, PARSE_MAX_OPEN_FILES
+from helpers import poster_sequence as pseq
+from helpers import server_reader as sr
 from helpers.utility import get_serverid
 
-
-def append_text(messages, serverid):
-    print('writing users...')
-    start_time = datetime.now()
-    for userid, corpus in messages.items():
-        if corpus:
-            with open(f'{MESSAGES_DIRECTORY}{serverid}/{userid}.txt', 'a+', encoding='utf-8') as f:
-                f.write(corpus)
-    print(f"Wrote in {datetime.now() - start_time}")
+FILE_BUFFER_SIZE = 2 * io.DEFAULT_BUFFER_SIZE   # Bytes buffered by an open text file (its text and byte buffers).
+
+
+class MessageWriter(object):
+    """
+    Accumulates each user's posts in a list and appends them to their message files.
+    Posts are written once the buffered posts and the buffers of the open files take flush_size bytes of memory, and
+    the file handles are kept open between flushes.
+    """
+
+    def __init__(self, serverid, incremental=False, flush_size=PARSE_FLUSH_SIZE, max_open_files=PARSE_MAX_OPEN_FILES):
+        self.directories = [f'{MESSAGES_DIRECTORY}{serverid}/']
+        if incremental:
+            self.directories.append(f'{MESSAGES_DIRECTORY}{serverid}/{DELTA_DIRECTORY}')
+        self.flush_size = flush_size
+        self.max_open_files = max_open_files
+        self.buffers = {}
+        self.buffered_size = 0
+        self._files = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add(self, userid, message):
+        """Buffers a post by a user, writing every buffer to disk if the flush size is reached."""
+        try:
+            buffer = self.buffers[userid]
+        except KeyError:
+            buffer = self.buffers[userid] = []
+        buffer.append(message)
+        buffer.append(POST_SEPARATOR)
+        # Memory of the post, and of its two slots in the list (the separator is shared).
+        self.buffered_size += sys.getsizeof(message) + 16
+        if self.buffered_size + len(self._files) * FILE_BUFFER_SIZE >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """Appends every buffered post to its user's files."""
+        print('writing users...')
+        start_time = datetime.now()
+        for userid, buffer in self.buffers.items():
+            corpus = ''.join(buffer)
+            for directory in self.directories:
+                self._get_file(f'{directory}{userid}.txt').write(corpus)
+        self.buffers = {}
+        self.buffered_size = 0
+        print(f"Wrote in {datetime.now() - start_time}")
+
+    def close(self):
+        """Flushes the buffers and closes every open file."""
+        self.flush()
+        while self._files:
+            self._files.popitem(last=False)[1].close()
+
+    def _get_file(self, path):
+        f = self._files.get(path)
+        if f is not None:
+            self._files.move_to_end(path)
+            return f
+        if len(self._files) >= self.max_open_files:
+            self._files.popitem(last=False)[1].close()
+        f = self._files[path] = open(path, 'a', encoding='utf-8')
+        return f
+
+
+LEGACY_CHANNEL_KEY = '*'    # channel key of the marks of files written before marks were kept per channel
+
+
+def read_high_water_marks(serverid):
+    """
+    Gets the dict of channelid to dict of userid to the id of the last message of theirs in the channel that was parsed.
+    Files from before marks were kept per channel (userid to message id) are read as the marks of LEGACY_CHANNEL_KEY.
+    """
+    try:
+        with open(f'{MESSAGES_DIRECTORY}{serverid}/{HIGH_WATER_MARKS_JSON}', 'r', encoding='utf-8') as f:
+            high_water_marks = ujson.load(f)
+    except FileNotFoundError:
+        return {}
+    if any(not isinstance(marks, dict) for marks in high_water_marks.values()):
+        return {LEGACY_CHANNEL_KEY: high_water_marks}
+    return high_water_marks
+
+
+def get_high_water_mark(high_water_marks, channelid, userid):
+    """Gets the id of the last parsed message of a user in a channel, or 0 if none of them was parsed."""
+    mark = high_water_marks.get(channelid, {}).get(userid)
+    if mark is None:
+        mark = high_water_marks.get(LEGACY_CHANNEL_KEY, {}).get(userid, 0)
+    return int(mark)
+
+
+def write_high_water_marks(serverid, high_water_marks):
+    with open(f'{MESSAGES_DIRECTORY}{serverid}/{HIGH_WATER_MARKS_JSON}', 'w+', encoding='utf-8') as f:
+        ujson.dump(high_water_marks, f)
 
 
 def links_to_file(filename):
     print(f'Making links file from {filename}...')
-    with open(f'{SERVER_JSON_DIRECTORY}{filename}', "r", encoding="utf-8-sig") as f:
-        server_json = ujson.load(f)
-
-        out = set()
-        for channel in server_json['data']:
-            for message in server_json['data'][channel]:
-                curr_message = server_json['data'][channel][message]
-                if "a" in curr_message.keys():
-                    for link in curr_message["a"]:
-                        if "url" in link.keys():
-                            out.add(f"{link['url']}")
-                if "e" in curr_message.keys():
-                    for embed in curr_message["e"]:
-                        if "url" in embed.keys():
-                            out.add(f"{embed['url']}")
+    out = set()
+    for _, _, curr_message in sr.iter_messages(filename):
+        if "a" in curr_message.keys():
+            for link in curr_message["a"]:
+                if "url" in link.keys():
+                    out.add(f"{link['url']}")
+        if "e" in curr_message.keys():
+            for embed in curr_message["e"]:
+                if "url" in embed.keys():
+                    out.add(f"{embed['url']}")
 
     out = [x for x in out if x.startswith("http")]
     print(f'Retrieved {len(out)} links!')
@@ -46,50 +133,44 @@ def links_to_file(filename):
 
 # 7776000 = 90 days in seconds
 def gen_simmodel(filename, lookback=7776000):
-    with open(f'{SERVER_JSON_DIRECTORY}{filename}', 'r', encoding='utf-8-sig') as f:
-        server_json = ujson.load(f)
+    server_meta = sr.read_meta(filename)
 
     server_name = filename[:-5]
-    userids = list(server_json['meta']['userindex'])
+    userids = list(server_meta['userindex'])
 
-    msgs = []
-    out = ''
+    sequences = []
     channel_num = 1
-    num_channels = len(server_json['data'].keys())
-    for channel in server_json['data'].keys():
+    num_channels = len(server_meta.get('channels', {}))
+    min_timestamp = (datetime.now().timestamp() - lookback) * 1000
+    for channel, channel_messages in sr.iter_channels(filename):
         print(f"Parsing channel {channel_num}/{num_channels}...")
-        for message in server_json['data'][channel].keys():
-            secs_posted_ago = datetime.now().timestamp() - int(server_json['data'][channel][message]['t']) / 1000
-            if secs_posted_ago > lookback:
-                continue
-            out += userids[int(server_json['data'][channel][message]['u'])] + ' '
-            if len(out) > 1000:
-                msgs.append(out)
-                out = ''
-        msgs.append(out)
-        out = ''
+        sequences.append([userids[int(message['u'])] for message in channel_messages.values()
+                          if int(message['t']) >= min_timestamp])
         channel_num += 1
-    sim_model = markovify.NewlineText('\n'.join(msgs), retain_original=False)
-    with open(f'{server_name}_sim_model.json', 'w+') as f:
-        f.write(sim_model.to_json())
-    print(f'{server_name}_sim_model.json successfully written!')
+    sim_model = pseq.PosterSequence.from_sequences(sequences)
+    sim_model.save(f'{server_name}_sim_model.npz')
+    print(f'{server_name}_sim_model.npz successfully written!')
 
 
-def init_message_files(serverid, userids):
+def init_message_files(serverid, userids, incremental=False):
     if not os.path.isdir(MESSAGES_DIRECTORY):
         os.mkdir(MESSAGES_DIRECTORY)
     if not os.path.isdir(f"{MESSAGES_DIRECTORY}{serverid}/"):
         os.mkdir(f'{MESSAGES_DIRECTORY}{serverid}/')
+    if incremental:
+        # Keep the existing messages and only make sure the delta directory exists.
+        os.makedirs(f'{MESSAGES_DIRECTORY}{serverid}/{DELTA_DIRECTORY}', exist_ok=True)
+        return
 
     for user_id in userids:
         with open(f'{MESSAGES_DIRECTORY}{serverid}/{user_id}.txt', 'w+', encoding='utf-8-sig') as f:
             f.write('')
 
 
-def update_names(server_json):
+def update_names(server_meta):
     out = ""
-    for userid in server_json['meta']['users']:
-        out += f"{userid};{server_json['meta']['users'][userid]['name'].replace(';', ':')}\n"
+    for userid in server_meta['users']:
+        out += f"{userid};{server_meta['users'][userid]['name'].replace(';', ':')}\n"
     new_names = out.split('\n')
     with open(NAMES_FILE, 'a+', encoding='utf-8-sig') as f:
         old_names = f.read().splitlines()
@@ -99,59 +180,61 @@ def update_names(server_json):
                 f.write(name + '\n')
 
 
-def parse_server(filename):
-    with open(f'{SERVER_JSON_DIRECTORY}{filename}', 'r', encoding='utf-8-sig') as f:
-        server_json = ujson.load(f)
+def parse_server(filename, incremental=False):
+    """
+    Splits the messages of a server json file into a file per user.
+    :param incremental: if True, only messages newer than each user's high-water mark in their channel are parsed,
+    and they are appended to both the user's file and their delta file (which converter.update_server merges into
+    their model).
+    """
+    server_meta = sr.read_meta(filename)
 
     serverid = get_serverid(filename)
     if not serverid:
         raise NameError("Server not found.")
 
     # Initialize the files for each user.
-    userids = list(server_json['meta']['userindex'])
-    init_message_files(serverid, userids)
+    userids = list(server_meta['userindex'])
+    init_message_files(serverid, userids, incremental)
+    high_water_marks = read_high_water_marks(serverid) if incremental else {}
+    new_high_water_marks = {channelid: dict(marks) for channelid, marks in high_water_marks.items()}
 
-    update_names(server_json)
+    update_names(server_meta)
 
-    channel_ids = list(server_json['data'].keys())
-    num_channels = len(channel_ids)
+    num_channels = len(server_meta.get('channels', {}))
 
     curr_channel_num = 1
 
     begin_time = datetime.now()
 
-    messages = {}
-    msg_in_messages = 0
-
-    for channelid in channel_ids:
-        print(f"Parsing channel {curr_channel_num}/{num_channels}...")
-        message_ids = server_json["data"][channelid].keys()
-
-        curr_message_no = 1
-        num_messages = len(message_ids)
-        for messageid in message_ids:
-            if curr_message_no % 10000 == 0:
-                print(f"Message {curr_message_no}/{num_messages}")
-            try:
-                message = server_json["data"][channelid][messageid]['m']
-                user_index = server_json["data"][channelid][messageid]['u']
-                userid = userids[int(user_index)]
-                if userid not in messages.keys():
-                    messages[userid] = ''
-                messages[userid] += f'{message}{POST_SEPARATOR}'
-                msg_in_messages += 1
-                if msg_in_messages >= 100000:
-                    append_text(messages, serverid)
-                    messages = {}
-                    msg_in_messages = 0
-            except KeyError:
-                print(f'keyerror: {messageid}')
-                pass
-            curr_message_no += 1
-        curr_channel_num += 1
-
-    print(f'Parse time: {datetime.now() - begin_time}')
-    append_text(messages, serverid)
+    with MessageWriter(serverid, incremental) as writer:
+        for channelid, channel_messages in sr.iter_channels(filename):
+            print(f"Parsing channel {curr_channel_num}/{num_channels}...")
+            channel_marks = new_high_water_marks.setdefault(channelid, {})
+
+            curr_message_no = 1
+            num_messages = len(channel_messages)
+            for messageid, channel_message in channel_messages.items():
+                if curr_message_no % 10000 == 0:
+                    print(f"Message {curr_message_no}/{num_messages}")
+                try:
+                    message = channel_message['m']
+                    user_index = channel_message['u']
+                    userid = userids[int(user_index)]
+                    if int(messageid) <= get_high_water_mark(high_water_marks, channelid, userid):
+                        curr_message_no += 1
+                        continue
+                    if int(messageid) > int(channel_marks.get(userid, 0)):
+                        channel_marks[userid] = messageid
+                    writer.add(userid, message)
+                except KeyError:
+                    print(f'keyerror: {messageid}')
+                    pass
+                curr_message_no += 1
+            curr_channel_num += 1
+
+        print(f'Parse time: {datetime.now() - begin_time}')
+    write_high_water_marks(serverid, new_high_water_marks)
 
 
 def count_replies(filename):
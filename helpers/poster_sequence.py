@@ -0,0 +1,205 @@
+import os
+from collections import deque
+from itertools import islice
+
+import markovify
+import numpy as np
+
+import config
+from consts import POSTER_SEQUENCE_CHAINS, POSTER_SEQUENCE_LENGTH
+from helpers.utility import get_sim_model_name
+
+
+class PosterSequence(object):
+    """
+    First-order Markov chain of which user posts after which, stored as a CSR matrix of transition counts.
+
+    Row i of the matrix holds the users who posted right after user i (indices[indptr[i]:indptr[i + 1]]) and how many
+    times they did (counts, same slice). Chains start from a user drawn by their number of posts, and restart the same
+    way from users who were never followed by anyone.
+    """
+
+    def __init__(self, userids, indptr, indices, counts, post_counts):
+        self.userids = np.asarray(userids, dtype=str)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.post_counts = np.asarray(post_counts, dtype=np.int64)
+        # Cumulative counts, over the whole matrix and over the posts, which are binary searched when sampling.
+        self._cumulative = np.cumsum(self.counts, dtype=np.float64)
+        row_bounds = np.concatenate(([0.0], self._cumulative))[self.indptr]
+        self._row_offsets = row_bounds[:-1]
+        self._row_totals = np.diff(row_bounds)
+        self._cumulative_posts = np.cumsum(self.post_counts, dtype=np.float64)
+
+    @classmethod
+    def from_sequences(cls, sequences):
+        """Builds the chain of lists of userids, in the order they posted (e.g. one list per channel)."""
+        userid_indexes = {}
+        sources = []
+        targets = []
+        post_counts = []
+        for sequence in sequences:
+            sequence = [userid_indexes.setdefault(userid, len(userid_indexes)) for userid in sequence if userid]
+            sources.extend(sequence[:-1])
+            targets.extend(sequence[1:])
+            post_counts.extend(sequence)
+        num_users = len(userid_indexes)
+        post_counts = np.bincount(np.array(post_counts, dtype=np.int64), minlength=num_users)
+        return cls.from_pairs(list(userid_indexes), np.array(sources, dtype=np.int64),
+                              np.array(targets, dtype=np.int64), np.ones(len(sources), dtype=np.int64), post_counts)
+
+    @classmethod
+    def from_markov(cls, model):
+        """
+        Builds the chain of a markovify user model (as made by older versions of gen_simmodel), by summing the counts of
+        its states that end with the same user.
+        """
+        userid_indexes = {}
+        sources = []
+        targets = []
+        counts = []
+        post_counts = {}
+        for state, followers in model.chain.model.items():
+            for userid, count in followers.items():
+                if not userid or userid == markovify.chain.END:
+                    continue
+                target = userid_indexes.setdefault(userid, len(userid_indexes))
+                post_counts[target] = post_counts.get(target, 0) + count
+                if state[-1] and state[-1] != markovify.chain.BEGIN:
+                    sources.append(userid_indexes.setdefault(state[-1], len(userid_indexes)))
+                    targets.append(target)
+                    counts.append(count)
+        post_counts = np.array([post_counts.get(i, 0) for i in range(len(userid_indexes))], dtype=np.int64)
+        return cls.from_pairs(list(userid_indexes), np.array(sources, dtype=np.int64),
+                              np.array(targets, dtype=np.int64), np.array(counts, dtype=np.int64), post_counts)
+
+    @classmethod
+    def from_pairs(cls, userids, sources, targets, counts, post_counts):
+        """Builds the chain of parallel arrays of (source, target, count) transitions, which may repeat."""
+        num_users = len(userids)
+        if len(sources):
+            pairs, inverse = np.unique(sources * num_users + targets, return_inverse=True)
+            pair_counts = np.bincount(inverse.ravel(), weights=counts).astype(np.int64)
+        else:
+            pairs = pair_counts = np.zeros(0, dtype=np.int64)
+        # np.unique sorts the pairs, so they are already in row order.
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(pairs // max(num_users, 1), minlength=num_users))))
+        return cls(userids, indptr, pairs % max(num_users, 1), pair_counts, post_counts)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a chain saved with save()."""
+        with np.load(path) as arrays:
+            return cls(arrays['userids'], arrays['indptr'], arrays['indices'], arrays['counts'],
+                       arrays['post_counts'])
+
+    def save(self, path):
+        np.savez(path, userids=self.userids, indptr=self.indptr, indices=self.indices, counts=self.counts,
+                 post_counts=self.post_counts)
+
+    def restrict(self, userids):
+        """
+        Gets the chain of only the given users, e.g. without the ignored users and the users who left the guild.
+        Transitions to the other users are dropped.
+        """
+        keep = np.isin(self.userids, np.asarray(list(userids), dtype=str))
+        new_indexes = np.cumsum(keep) - 1
+        sources = np.repeat(np.arange(len(self.userids)), np.diff(self.indptr))
+        kept = keep[sources] & keep[self.indices]
+        post_counts = self.post_counts[keep]
+        return PosterSequence.from_pairs(self.userids[keep], new_indexes[sources[kept]],
+                                         new_indexes[self.indices[kept]], self.counts[kept], post_counts)
+
+    def sample(self, num_chains=POSTER_SEQUENCE_CHAINS, length=POSTER_SEQUENCE_LENGTH, rng=np.random):
+        """
+        Samples num_chains independent chains of length posters, all chains being advanced together.
+        :return: list of the userids of the chains, one chain after the other.
+        """
+        if not len(self.userids) or not self._cumulative_posts[-1]:
+            return []
+        out = np.empty((length, num_chains), dtype=np.int64)
+        states = self._sample_posters(num_chains, rng)
+        for i in range(length):
+            out[i] = states
+            totals = self._row_totals[states]
+            targets = self._row_offsets[states] + rng.random_sample(num_chains) * totals
+            positions = np.minimum(np.searchsorted(self._cumulative, targets, side='right'),
+                                   self.indptr[states + 1] - 1)
+            states = np.where(totals > 0, self.indices[np.maximum(positions, 0)], -1)
+            dead_ends = states < 0
+            if dead_ends.any():
+                states[dead_ends] = self._sample_posters(int(dead_ends.sum()), rng)
+        return self.userids[out.T.ravel()].tolist()
+
+    def __len__(self):
+        """Number of users in the chain."""
+        return len(self.userids)
+
+    def _sample_posters(self, num, rng):
+        """Samples users by their number of posts."""
+        targets = rng.random_sample(num) * self._cumulative_posts[-1]
+        return np.minimum(np.searchsorted(self._cumulative_posts, targets, side='right'), len(self.userids) - 1)
+
+
+class PosterQueue(object):
+    """Queue of the next users to post in a simulation, refilled with a batch of samples of a chain when empty."""
+
+    def __init__(self, sequence, num_chains=POSTER_SEQUENCE_CHAINS, length=POSTER_SEQUENCE_LENGTH):
+        self.sequence = sequence
+        self.num_chains = num_chains
+        self.length = length
+        self.queue = deque()
+
+    def pop(self):
+        """Gets the next user to post, or None if the chain has no users."""
+        if not self.queue:
+            self.fill()
+        return self.queue.popleft() if self.queue else None
+
+    def peek(self, num):
+        """Gets the next num users to post, without removing them from the queue."""
+        if len(self.queue) < num:
+            self.fill()
+        return list(islice(self.queue, num))
+
+    def insert(self, index, userid):
+        """Inserts a user into the queue, e.g. a user who was named in a post."""
+        self.queue.insert(index, userid)
+
+    def fill(self):
+        self.queue.extend(self.sequence.sample(self.num_chains, self.length))
+
+    def __len__(self):
+        return len(self.queue)
+
+
+def restrict_to_guild(sequence, guild):
+    """Gets the chain of only the members of a guild who are not ignored, so that they need not be checked per post."""
+    return sequence.restrict(str(member.id) for member in guild.members if member.id not in config.IGNORE_USERS)
+
+
+def get_sim_sequence(serverid=None):
+    """
+    Gets the poster sequence of a server, from its <name>_sim_model.npz file, or else from its older markovify
+    <name>_sim_model.json file.
+    :return: the server's PosterSequence, or None if it has neither file.
+    """
+    return load(get_sim_model_name(serverid))
+
+
+def load(path):
+    """
+    Loads the poster sequence saved as <path without extension>.npz, or else the markovify user model saved as
+    <path without extension>.json.
+    """
+    name = os.path.splitext(path)[0]
+    try:
+        return PosterSequence.load(f'{name}.npz')
+    except FileNotFoundError:
+        pass
+    try:
+        with open(f'{name}.json', 'r', encoding='utf-8-sig') as f:
+            return PosterSequence.from_markov(markovify.Text.from_json(f.read()))
+    except FileNotFoundError:
+        return None
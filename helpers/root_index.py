@@ -0,0 +1,71 @@
+import random
+import threading
+import weakref
+
+from markovify.chain import BEGIN
+from markovify.text import ParamError
+
+from helpers import compiled_model as cm
+
+ROOT_INDEXES = weakref.WeakKeyDictionary()  # markovify.Text -> {first non-BEGIN word: [states]}
+ROOT_INDEXES_LOCK = threading.Lock()
+
+
+def get_root_index(model):
+    """
+    Gets the index of a markovify.Text model's states by their first non-BEGIN word.
+    It is built on first use and kept until the model is garbage collected.
+    """
+    with ROOT_INDEXES_LOCK:
+        index = ROOT_INDEXES.get(model)
+    if index is None:
+        index = {}
+        for state in model.chain.model:
+            for word in state:
+                if word != BEGIN:
+                    index.setdefault(word, []).append(state)
+                    break
+        with ROOT_INDEXES_LOCK:
+            ROOT_INDEXES[model] = index
+    return index
+
+
+def find_states_starting_with(model, split):
+    """Gets every state of a model whose words, ignoring BEGIN, start with the tuple of words split."""
+    if isinstance(model, cm.CompiledText):
+        return model.find_states_starting_with(split)
+    return [state for state in get_root_index(model).get(split[0], ())
+            if tuple(word for word in state if word != BEGIN)[:len(split)] == split]
+
+
+def get_init_states(model, beginning, strict=True):
+    """
+    Gets the states make_sentence_with_start(beginning, strict) would start sentences from, in a random order.
+    :raises ParamError: if beginning is not 1 to model.state_size words.
+    """
+    split = tuple(model.word_split(beginning))
+    word_count = len(split)
+
+    if word_count == model.state_size:
+        return [split]
+    elif 0 < word_count < model.state_size:
+        if strict:
+            return [(BEGIN,) * (model.state_size - word_count) + split]
+        init_states = find_states_starting_with(model, split)
+        random.shuffle(init_states)
+        return init_states
+    else:
+        raise ParamError(f'`make_sentence_with_start` for this model requires a string containing 1 to '
+                         f'{model.state_size} words. Yours has {word_count}: {split}')
+
+
+def make_sentence_with_start(model, beginning, strict=True, **kwargs):
+    """Same as model.make_sentence_with_start, but non-strict starts are looked up in the model's root index."""
+    if isinstance(model, cm.CompiledText):
+        return model.make_sentence_with_start(beginning, strict, **kwargs)
+
+    for init_state in get_init_states(model, beginning, strict):
+        output = model.make_sentence(init_state, **kwargs)
+        if output is not None:
+            return output
+    return None
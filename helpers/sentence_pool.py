@@ -0,0 +1,143 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+from consts import SENTENCE_POOL_MIN_SIZE, SENTENCE_POOL_MAX_SIZE, SENTENCE_POOL_MAX_USERS, \
+    SENTENCE_POOL_HALF_LIFE, SENTENCE_POOL_REFILL_INTERVAL, SENTENCE_POOL_REFILL_BUDGET
+from helpers import generation_pool as gp
+from helpers import model_cache as mc
+
+
+class UserPool(object):
+    """Pre-generated sentences of one user's model, with a decaying count of how often the user is requested."""
+
+    def __init__(self):
+        self.model_key = None
+        self.sentences = deque()
+        self.rate = 0.0
+        self.last_request = time.monotonic()
+
+    def add_request(self):
+        """Counts a request, decaying the older ones by SENTENCE_POOL_HALF_LIFE."""
+        now = time.monotonic()
+        self.rate = self.get_rate(now) + 1
+        self.last_request = now
+
+    def get_rate(self, now=None):
+        """Gets the decayed number of requests for the user."""
+        if now is None:
+            now = time.monotonic()
+        return self.rate * 0.5 ** ((now - self.last_request) / SENTENCE_POOL_HALF_LIFE)
+
+    def get_target_size(self):
+        """Gets the number of sentences to keep for the user, which grows with how often they are requested."""
+        return min(SENTENCE_POOL_MAX_SIZE, SENTENCE_POOL_MIN_SIZE + int(math.ceil(self.get_rate())) - 1)
+
+    def set_model_key(self, model_key):
+        """Drops the sentences if they were generated from an older version of the model."""
+        if model_key != self.model_key:
+            self.sentences.clear()
+            self.model_key = model_key
+
+
+class SentencePool(object):
+    """
+    Per-user pools of pre-generated Markov sentences.
+
+    A $mk with one user and no root takes a sentence from the user's pool in O(1). The pools are refilled in the
+    background while the generation pool is idle, with the most requested users filled first.
+    """
+
+    def __init__(self, max_users=SENTENCE_POOL_MAX_USERS):
+        self.max_users = max_users
+        self.hits = 0
+        self.misses = 0
+        self._pools = OrderedDict()     # (guildid, userid) -> UserPool, least recently requested first
+        self._lock = threading.Lock()
+
+    def take(self, guildid, userid):
+        """Counts a request for a user and returns one of their pre-generated sentences, or None if there are none."""
+        model_key = mc.get_model_key(guildid, userid)
+        with self._lock:
+            key = (str(guildid), str(userid))
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = self._pools[key] = UserPool()
+                if len(self._pools) > self.max_users:
+                    self._pools.popitem(last=False)
+            self._pools.move_to_end(key)
+            pool.add_request()
+            pool.set_model_key(model_key)
+            if model_key is None or not pool.sentences:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return pool.sentences.popleft()
+
+    def add(self, guildid, userid, model_key, sentences):
+        """Adds sentences generated from the model with model_key to a user's pool."""
+        with self._lock:
+            pool = self._pools.get((str(guildid), str(userid)))
+            if pool is None:
+                return
+            pool.set_model_key(model_key)
+            if model_key == pool.model_key:
+                pool.sentences.extend(sentences[:pool.get_target_size() - len(pool.sentences)])
+
+    def invalidate(self, guildid, userid):
+        """Drops a user's pre-generated sentences."""
+        with self._lock:
+            pool = self._pools.get((str(guildid), str(userid)))
+            if pool is not None:
+                pool.sentences.clear()
+
+    def get_deficits(self):
+        """Gets a list of (guildid, userid, number of missing sentences), most requested users first."""
+        with self._lock:
+            pools = sorted(self._pools.items(), key=lambda item: item[1].get_rate(), reverse=True)
+            return [(guildid, userid, pool.get_target_size() - len(pool.sentences))
+                    for (guildid, userid), pool in pools if len(pool.sentences) < pool.get_target_size()]
+
+    async def refill(self, generate, budget=SENTENCE_POOL_REFILL_BUDGET):
+        """
+        Refills the pools with generate(guildid, userid, count, budget) -> (model_key, sentences, cpu seconds used),
+        run in the generation pool. Stops once budget CPU seconds are used or Markov commands are waiting.
+        """
+        for guildid, userid, count in self.get_deficits():
+            if budget <= 0 or gp.get_pool().depth > 0:
+                return
+            try:
+                model_key, sentences, cpu_time = await gp.run(guildid, generate, guildid, userid, count, budget)
+            except gp.QueueFullError:
+                return
+            budget -= cpu_time
+            if model_key is not None:
+                self.add(guildid, userid, model_key, sentences)
+
+    def stats(self):
+        """Returns a dict of the pools' counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'users': len(self._pools),
+                'sentences': sum(len(pool.sentences) for pool in self._pools.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
+
+
+POOL = SentencePool()
+mc.MODEL_CACHE.stale_callbacks.append(POOL.invalidate)
+
+
+async def refill_loop(generate, interval=SENTENCE_POOL_REFILL_INTERVAL):
+    """Refills the process-wide sentence pools every interval seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await POOL.refill(generate)
+        except Exception as e:
+            print(f'Error refilling sentence pools: {e}')
@@ -0,0 +1,44 @@
+import ijson
+
+from consts import SERVER_JSON_DIRECTORY
+
+UTF8_BOM = b'\xef\xbb\xbf'
+
+
+def open_server_json(filename):
+    """Opens a server json file in binary mode for ijson, skipping the utf-8 byte order mark if there is one."""
+    f = open(f'{SERVER_JSON_DIRECTORY}{filename}', 'rb')
+    if f.read(len(UTF8_BOM)) != UTF8_BOM:
+        f.seek(0)
+    return f
+
+
+def read_meta(filename):
+    """
+    Reads the 'meta' object of a server json file without loading the messages.
+    :param filename: Name of json file containing the server data.
+    :return: the meta dict, or an empty dict if the file has none.
+    """
+    with open_server_json(filename) as f:
+        return next(ijson.items(f, 'meta', use_float=True), {})
+
+
+def iter_channels(filename):
+    """
+    Streams the channels of a server json file, so that only one channel's messages are in memory at a time.
+    :param filename: Name of json file containing the server data.
+    :return: a generator of (channelid, {messageid: message}) tuples.
+    """
+    with open_server_json(filename) as f:
+        yield from ijson.kvitems(f, 'data', use_float=True)
+
+
+def iter_messages(filename):
+    """
+    Streams the messages of a server json file.
+    :param filename: Name of json file containing the server data.
+    :return: a generator of (channelid, messageid, message) tuples.
+    """
+    for channelid, messages in iter_channels(filename):
+        for messageid, message in messages.items():
+            yield channelid, messageid, message
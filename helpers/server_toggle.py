@@ -4,8 +4,11 @@ import os
 import consts
 from consts import SERVERS_FILE, OPTIONS_DIRECTORY
 
-with open(SERVERS_FILE, 'r', encoding='utf-8') as f:
-    RAW_SERVERS = f.read().splitlines()
+try:
+    with open(SERVERS_FILE, 'r', encoding='utf-8') as f:
+        RAW_SERVERS = f.read().splitlines()
+except FileNotFoundError:
+    RAW_SERVERS = []
 
 SERVERS = {}
 for line in RAW_SERVERS:
@@ -0,0 +1,66 @@
+import asyncio
+import heapq
+import itertools
+
+from helpers import admission as adm
+
+
+class SimScheduler(object):
+    """
+    Runs many simulation sessions from one task, using a priority queue of (due time, session).
+
+    A session is any object with an async step() that posts (at most) one message and returns the number of seconds
+    until its next step. Every step takes a token from a bucket shared by all sessions, so the sessions together post
+    at most rate messages per second (after a burst of burst messages).
+    """
+
+    def __init__(self, rate, burst):
+        self.bucket = adm.TokenBucket(rate, burst)
+        self.steps = 0
+        self._heap = []                 # (due time, tie breaker, session)
+        self._counter = itertools.count()
+        self._changed = None
+
+    def schedule(self, session, delay=0):
+        """Schedules the next step of a session in delay seconds."""
+        loop = asyncio.get_event_loop()
+        heapq.heappush(self._heap, (loop.time() + delay, next(self._counter), session))
+        self._get_changed().set()
+
+    async def run(self):
+        """Runs the sessions' steps when they are due, until cancelled."""
+        loop = asyncio.get_event_loop()
+        changed = self._get_changed()
+        while True:
+            delay = self._heap[0][0] - loop.time() if self._heap else None
+            if delay is None or delay > 0:
+                # Sleep until the next step is due, or until a session is scheduled.
+                changed.clear()
+                try:
+                    await asyncio.wait_for(changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            wait_time = self.bucket.get_wait_time()
+            if wait_time:
+                await asyncio.sleep(wait_time)
+                continue
+            self.bucket.try_acquire()
+            _, _, session = heapq.heappop(self._heap)
+            asyncio.ensure_future(self._step(session))
+
+    async def _step(self, session):
+        try:
+            delay = await session.step()
+        except Exception as e:
+            print(f'Error in simulation session {session}: {e}')
+            delay = session.get_wait_time()
+        self.steps += 1
+        self.schedule(session, delay)
+
+    def _get_changed(self):
+        # The event is created lazily so that it belongs to the running event loop.
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        return self._changed
@@ -6,6 +6,9 @@ from threading import Thread
 import config
 from helpers import channel_permissions as cp
 from helpers import markov_helpers as mk
+from helpers import name_matcher as nm
+from helpers import poster_sequence as pseq
+from helpers import webhook_pool as wp
 from helpers.utility import remove_mentions
 
 
@@ -14,7 +17,7 @@ class SimThread(Thread):
         """ Constructor for SimThread. """
         Thread.__init__(self)
         self.bot = bot
-        self.sim_queue = []
+        self.sim_queue = None
         self.topic = topic
         self.total_simulation_messages = 0
         self.simulation_on = asyncio.Event()
@@ -25,6 +28,14 @@ class SimThread(Thread):
         bot_channel = bot_guild.get_channel(cp.get_channel(config.SIMULATOR_CHANNEL, cp.SIMULATION_KEY))
         bot_self = bot_guild.me
         print(f'Guild: {bot_guild.id}, Channel: {bot_channel.id}, Bot: {bot_self.id}')
+        if mk.USER_SEQUENCE is None:
+            print('Unable to run the simulation: the user model was not found.')
+            return
+        sequence = pseq.restrict_to_guild(mk.USER_SEQUENCE, bot_guild)
+        if not len(sequence):
+            print('Unable to run the simulation: no member of the guild is in the user model.')
+            return
+        self.sim_queue = pseq.PosterQueue(sequence)
         while not self.bot.is_closed():
             await self.simulation_on.wait()
             # Fills the queue if empty, otherwise pops the first element
@@ -35,11 +46,10 @@ class SimThread(Thread):
             try:
                 while not out:
                     while not user_model:
-                        if not self.sim_queue:
-                            self.sim_queue = mk.fill_simulator_queue()
-                        next_user = self.sim_queue.pop(0)
-                        if next_user in config.IGNORE_USERS:
-                            continue
+                        next_user = self.sim_queue.pop()
+                        if next_user is None:
+                            print('Unable to run the simulation: the poster queue is empty.')
+                            return
                         print(next_user)
                         next_user_member = bot_guild.get_member(int(next_user))
                         if not next_user_member:
@@ -59,13 +69,12 @@ class SimThread(Thread):
                     if not out:
                         continue
 
-                    for userid, name in mk.NAMES.items():
-                        if name in out:
-                            self.sim_queue.insert(random.randint(0, 2), userid)
+                    for userid in nm.NAMES.find(out):
+                        self.queue_reply(bot_guild, userid, 2)
 
                     mentions = set([c for c in out[0].split(' ') if c[0:2] == '<@'])
                     for mention in mentions:
-                        self.sim_queue.insert(random.randint(0, 1), mention[2:])
+                        self.queue_reply(bot_guild, mention[2:], 1)
 
                     # Topic is last word of out, stripped of non-alphanumeric characters.
                     self.topic = out.split()[-1]
@@ -78,15 +87,9 @@ class SimThread(Thread):
             try:
                 # Posts that message to the SIMULATOR_CHANNEL
 
-                nick = next_user_member.nick
-                if not nick:
-                    nick = next_user_member.name
                 out = remove_mentions(out, bot_guild)
 
-                webhook_avatar = await next_user_member.avatar_url.read()
-                webhook = await bot_channel.create_webhook(name=nick, avatar=webhook_avatar)
-                await webhook.send(out)
-                await webhook.delete()
+                await wp.get_pool(bot_channel).send(next_user_member, out)
             except Exception as e:
                 print(e)
                 with open('debug.txt', 'a+') as f:
@@ -100,3 +103,11 @@ class SimThread(Thread):
             wait_time = mk.get_wait_time()
             await asyncio.sleep(wait_time)
 
+    def queue_reply(self, bot_guild, userid, max_index):
+        """
+        Inserts a user who was named or mentioned near the front of the queue, unless they are ignored or not a member,
+        as the queue's chain was restricted to the guild's members who are not ignored.
+        """
+        if not userid.isdigit() or int(userid) in config.IGNORE_USERS or bot_guild.get_member(int(userid)) is None:
+            return
+        self.sim_queue.insert(random.randint(0, max_index), userid)
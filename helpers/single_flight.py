@@ -0,0 +1,49 @@
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the function, and every caller that arrives
+    while it is running waits for and shares its result (or exception) instead of running it again.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._in_flight = {}    # key -> Future of the running call
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        """Returns func(*args), or the result of the call with the same key that is already running."""
+        with self._lock:
+            self.calls += 1
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = func(*args)
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._in_flight[key]
+        future.set_result(result)
+        return result
+
+    def stats(self):
+        """Returns a dict of the number of calls and of calls that shared another call's result."""
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'shared': self.shared,
+                'in_flight': len(self._in_flight)
+            }
@@ -1,11 +1,9 @@
 import re
-import markovify
-import ujson
-
-import random
 
 from config import SIMULATOR_GUILD
-from consts import SERVERS_FILE, SERVER_JSON_DIRECTORY, LINKS_FILE
+from consts import SERVERS_FILE
+from helpers import link_store as ls
+from helpers import server_reader as sr
 
 
 def get_serverid(filename):
@@ -22,10 +20,9 @@ def get_serverid(filename):
         if server_name in line:
             return line.split(';')[0]
     else:
-        with open(f'{SERVER_JSON_DIRECTORY}{filename}', 'r', encoding='utf-8-sig') as f:
-            server_json = ujson.load(f)
+        server_meta = sr.read_meta(filename)
         try:
-            serverid = server_json['meta']['servers'][0]['id']
+            serverid = server_meta['servers'][0]['id']
             servers.append(f'{serverid};{server_name}')
             with open(SERVERS_FILE, 'w+', encoding='utf-8') as f:
                 f.write('\n'.join(servers))
@@ -66,10 +63,10 @@ def remove_mentions(msg, current_guild) -> str:
     return msg
 
 
-def get_sim_model(serverid=None):
+def get_sim_model_name(serverid=None):
     """
-    Gets the simulator model using the SIMULATOR_GUILD id given in config.py
-    :return: the simulator Markov model.
+    Gets the name of the simulator model files of a server, which defaults to the SIMULATOR_GUILD id given in config.py
+    :return: the path of the server's simulator model, without its extension.
     """
     with open(SERVERS_FILE, 'r', encoding='utf-8') as f:
         server_lines = f.read().splitlines()
@@ -82,25 +79,22 @@ def get_sim_model(serverid=None):
             sim_guild_name = line.split(';')[1]
             break
     else:
-        raise NameError(f"Server with id {SIMULATOR_GUILD} not found in servers.txt.")
+        raise NameError(f"Server with id {serverid} not found in servers.txt.")
 
-    try:
-        with open(f'{sim_guild_name}_sim_model.json', 'r', encoding='utf-8-sig') as f:
-            sim_model = markovify.NewlineText.from_json(f.read())
-            return sim_model
-    except FileNotFoundError:
-        return {}
-        # raise FileNotFoundError(f'{sim_guild_name}_sim_model.json')
+    return f'{sim_guild_name}_sim_model'
 
 
 def get_link():
     """
     Returns a random link from the links file.
-    :return: str representing the link's url.
+    :return: str representing the link's url, or None if there are no links.
+    """
+    return ls.LINKS.get_random()
+
+
+def get_attachment_link():
+    """
+    Returns a random link to a Discord attachment from the links file.
+    :return: str representing the link's url, or None if there are no attachment links.
     """
-    try:
-        with open(LINKS_FILE, 'r', encoding='utf-8') as f:
-            links = f.read().splitlines()
-        return random.choice(links)
-    except FileNotFoundError:
-        return None
+    return ls.LINKS.get_random_attachment()
@@ -0,0 +1,94 @@
+import asyncio
+import itertools
+
+import discord
+
+from consts import WEBHOOK_NAME, WEBHOOK_POOL_SIZE, WEBHOOK_MAX_RETRIES
+
+AVATAR_URLS = {}    # memberid -> (avatar hash, avatar url)
+
+
+class WebhookPool(object):
+    """
+    Small pool of webhooks of a channel, which are reused for every simulated post.
+    Each post sets the username and avatar of the simulated member, so posting is a single HTTP call.
+    """
+
+    def __init__(self, channel, size=WEBHOOK_POOL_SIZE, name=WEBHOOK_NAME):
+        self.channel = channel
+        self.size = size
+        self.name = name
+        self.webhooks = []
+        self._next_index = itertools.count()
+        self._lock = asyncio.Lock()
+
+    async def send(self, member, content, embed=None):
+        """
+        Posts a message as a member through one of the pool's webhooks.
+        Deleted webhooks are replaced, and rate limited posts are retried after the time Discord asks for.
+        """
+        for attempt in range(WEBHOOK_MAX_RETRIES + 1):
+            webhook = await self.get_webhook()
+            try:
+                return await webhook.send(content, username=member.display_name, avatar_url=get_avatar_url(member),
+                                          embed=embed)
+            except discord.NotFound:
+                # Someone deleted the webhook, so forget it and make a new one.
+                self.discard(webhook)
+                if attempt == WEBHOOK_MAX_RETRIES:
+                    raise
+            except discord.HTTPException as e:
+                if e.status != 429 or attempt == WEBHOOK_MAX_RETRIES:
+                    raise
+                await asyncio.sleep(get_retry_after(e))
+
+    async def get_webhook(self):
+        """Gets the next webhook of the pool, (re)filling the pool if it is not full."""
+        if len(self.webhooks) < self.size:
+            async with self._lock:
+                if len(self.webhooks) < self.size:
+                    await self.fill()
+        return self.webhooks[next(self._next_index) % len(self.webhooks)]
+
+    async def fill(self):
+        """Fills the pool with the channel's existing pool webhooks, then with new ones."""
+        known_ids = set(webhook.id for webhook in self.webhooks)
+        for webhook in await self.channel.webhooks():
+            if len(self.webhooks) >= self.size:
+                return
+            if webhook.name == self.name and webhook.token and webhook.id not in known_ids:
+                self.webhooks.append(webhook)
+        while len(self.webhooks) < self.size:
+            self.webhooks.append(await self.channel.create_webhook(name=self.name))
+
+    def discard(self, webhook):
+        """Removes a webhook from the pool."""
+        if webhook in self.webhooks:
+            self.webhooks.remove(webhook)
+
+
+POOLS = {}  # channelid -> WebhookPool
+
+
+def get_pool(channel):
+    """Gets the webhook pool of a channel."""
+    pool = POOLS.get(channel.id)
+    if pool is None:
+        pool = POOLS[channel.id] = WebhookPool(channel)
+    return pool
+
+
+def get_avatar_url(member):
+    """Gets the url of a member's avatar, cached until they change it."""
+    cached = AVATAR_URLS.get(member.id)
+    if cached is None or cached[0] != member.avatar:
+        cached = AVATAR_URLS[member.id] = (member.avatar, str(member.avatar_url))
+    return cached[1]
+
+
+def get_retry_after(error):
+    """Gets the number of seconds to wait after a 429 error."""
+    try:
+        return float(error.response.headers.get('Retry-After', 1))
+    except (AttributeError, TypeError, ValueError):
+        return 1
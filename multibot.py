@@ -2,60 +2,69 @@ import asyncio
 import ujson
 from threading import Thread
 
-import markovify
 import numpy as np
 from discord.ext import commands
 
 import config
+from consts import BOTS_FILE, USER_MODEL_FILE
+from helpers import model_cache as mc
+from helpers import name_matcher as nm
+from helpers import poster_sequence as pseq
 from helpers.markov_helpers import get_wait_time
 from helpers.utility import remove_mentions
 
-with open('bots.json', 'r', encoding='utf-8-sig') as f:
+with open(BOTS_FILE, 'r', encoding='utf-8-sig') as f:
     BOTS = ujson.load(f)
 
-with open('htz_user_model.json', 'r', encoding='utf-8-sig') as f:
-    USER_MODEL = markovify.NewlineText.from_json(f.read())
+USER_SEQUENCE = pseq.load(USER_MODEL_FILE)
 
-# TODO
-
-FINISH_POST_SIGNAL = asyncio.Event()
-NAMES_IN_MSG = []
+POST_AVG = 1800
+POST_STDDEV = 900
+POST_TIMEOUT = 60   # Number of seconds the queue waits for a bot to post before moving on.
 
 
 class QueueThread(Thread):
     def __init__(self, bots):
         Thread.__init__(self)
-        self.queue = []
-        self.bot_threads = bots
+        self.bot_threads = {bot_thread.userid: bot_thread for bot_thread in bots}
+        # Only users with a bot can post, so the others are removed from the chain once here.
+        if USER_SEQUENCE is None:
+            self.queue = None
+        else:
+            self.queue = pseq.PosterQueue(USER_SEQUENCE.restrict(self.bot_threads.keys()))
 
     async def run(self):
+        if self.queue is None:
+            print('Unable to run the simulation: the user model was not found.')
+            return
         while True:
             # Pop next poster from queue
-            if not self.queue:
-                self.fill_queue()
-            curr_userid = self.queue.pop(0)
+            curr_userid = self.queue.pop()
+            if curr_userid is None:
+                print('none of the bots are in the user model')
+                return
             curr_bot = self.get_bot(curr_userid)
             if not curr_bot:
                 continue
 
-            curr_bot.bot.post_signal.set()
-            await FINISH_POST_SIGNAL.wait()
-            FINISH_POST_SIGNAL.clear()
-            for userid in NAMES_IN_MSG:
+            post = asyncio.get_event_loop().create_future()
+            curr_bot.bot.posts.put_nowait(post)
+            try:
+                names_in_msg = await asyncio.wait_for(post, POST_TIMEOUT)
+            except asyncio.TimeoutError:
+                print('bot with id', curr_userid, 'did not post in time')
+                names_in_msg = []
+            except Exception as e:
+                print('bot with id', curr_userid, 'was unable to post. Reason:', e)
+                names_in_msg = []
+            for userid in names_in_msg:
                 self.queue.insert(np.random.randint(0, 2), userid)
 
-            wait_time = get_wait_time()
+            wait_time = get_wait_time(POST_AVG, POST_STDDEV)
             await asyncio.sleep(wait_time)
 
-    def fill_queue(self):
-        self.queue = USER_MODEL.make_sentence().split(' ')
-
     def get_bot(self, userid):
-        for bot_thread in self.bot_threads:
-            if bot_thread.userid == userid:
-                return bot_thread
-        else:
-            return None
+        return self.bot_threads.get(userid)
 
 
 class BotThread(Thread):
@@ -71,54 +80,71 @@ class MarkovBot(commands.Bot):
     def __init__(self, userid, token, names):
         super().__init__(command_prefix="mk!", description="hi dere")
         self.token = token
-        self.model: markovify.Text = self.open_model(userid)
+        self.userid = userid
         self.names = names
-        self.post_signal = asyncio.Event()
+        self.posts = asyncio.Queue()    # futures of the posts to make, set to the userids named in the post
 
-    def open_model(self, userid):
-        with open(f'{config.MODELS_DIRECTORY}{config.SIMULATOR_GUILD}/{userid}.json', 'r', encoding='utf-8-sig') as f:
-            model = markovify.Text.from_json(f.read())
-        return model
+    @property
+    def model(self):
+        """Gets the bot's model from the guild's shared, memory-mapped model store (through the model cache)."""
+        return mc.get_model(config.SIMULATOR_GUILD, self.userid)
 
     async def on_ready(self):
         bot_guild = self.get_guild(config.DEFAULT_GUILD_ID)
         bot_channel = bot_guild.get_channel(config.SIMULATOR_CHANNEL)
         while True:
-            await self.post_signal.wait()
-
+            post = await self.posts.get()
+            if post.cancelled():
+                # The queue stopped waiting for this post.
+                continue
+            try:
+                names_in_msg = await self.post(bot_guild, bot_channel)
+            except Exception as e:
+                if not post.done():
+                    post.set_exception(e)
+            else:
+                if not post.done():
+                    post.set_result(names_in_msg)
+
+    async def post(self, bot_guild, bot_channel):
+        """
+        Posts a message from the bot's model.
+        :return: list of the userids of the bots named in the message.
+        """
+        model = self.model
+
+        if model is None:
+            print('cannot get model for user with id', self.userid)
+            msg = None
+        else:
             for _ in range(3):
                 if self.topic:
                     try:
-                        msg = self.model.make_sentence_with_start(self.topic)
+                        msg = model.make_sentence_with_start(self.topic)
                         if msg:
                             # If topic, remove topic from sentence.
                             msg = msg.split(' ', 1)[1]
                             break
                     except KeyError:
-                        msg = self.model.make_sentence()
+                        msg = model.make_sentence()
                         if msg:
                             break
             else:
-                msg = self.model.make_sentence()
+                msg = model.make_sentence()
 
-            if msg:
-                self.topic = msg.split(' ')[-1]
-                find_names(msg)
-                msg = remove_mentions(msg, bot_guild)
+        if not msg:
+            return []
+        self.topic = msg.split(' ')[-1]
+        names_in_msg = find_names(msg)
+        msg = remove_mentions(msg, bot_guild)
 
-                await bot_channel.send(msg)
-
-            self.post_signal.clear()
-            FINISH_POST_SIGNAL.set()
+        await bot_channel.send(msg)
+        return names_in_msg
 
 
 def find_names(msg):
-    """Finds names in """
-    for userid in BOTS.keys():
-        for name in BOTS[userid]['names']:
-            if name in msg:
-                NAMES_IN_MSG.append(userid)
-                break
+    """Finds the userids of the bots whose names (or names in the names file) are in a message."""
+    return [userid for userid in nm.NAMES.find(msg) if userid in BOTS]
 
 
 def print_links():
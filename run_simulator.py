@@ -1,50 +1,140 @@
 import argparse
-import asyncio
 import random
-import ujson
 import traceback
 
-import markovify
 import discord
 from discord.ext import commands
 from discord import Embed
 from discord.errors import HTTPException
 
 import config
-import consts
+import helpers.model_prefetcher as mp
+import helpers.name_matcher as nm
+import helpers.poster_sequence as pseq
 import helpers.setup_helpers as setuph
+import helpers.sim_scheduler as sch
+import helpers.webhook_pool as wp
 from helpers.markov_helpers import get_wait_time
-from helpers.utility import remove_mentions, get_sim_model, get_link
+from helpers.utility import remove_mentions, get_attachment_link
 
 intents = discord.Intents.default()
 intents.members = True
 intents.presences = True
 
-try:
-    with open('bots.json', 'r', encoding='utf-8-sig') as f:
-        BOTS = ujson.load(f)
-except FileNotFoundError:
-    BOTS = None
-
-SIM_MODEL = get_sim_model()
-
 DEBUG_POST_AVG = 25
 DEBUG_POST_STDDEV = 10
 DEBUG_EMBED_RATE = 0.9
 
+PREFETCH_DEPTH = 3     # Number of upcoming posters whose models are loaded while waiting to post.
+GLOBAL_POST_RATE = 1   # Max number of posts per second over every simulated guild.
+GLOBAL_POST_BURST = 5  # Number of posts every simulated guild together can make at once.
+
 POST_AVG = 1800
 POST_STDDEV = 900
 EMBED_RATE = 0.04
-NAMES_IN_MSG = []
 
 
 def find_names(msg):
-    """Finds names in a message."""
-    for userid in BOTS.keys():
-        for name in BOTS[userid]['names']:
-            if name in msg:
-                NAMES_IN_MSG.append(userid)
-                break
+    """Finds the userids of the members and bots whose names are in a message."""
+    return nm.NAMES.find(msg)
+
+
+class SimSession(object):
+    """
+    A simulation of one guild's channel, with its own sim model, poster queue, topic and timing.
+    :raises FileNotFoundError: if the guild has no sim model.
+    """
+
+    def __init__(self, guild, channel, model_guildid, avg, stddev, embed_rate):
+        self.guild = guild
+        self.channel = channel
+        self.model_guildid = model_guildid
+        self.avg = avg
+        self.stddev = stddev
+        self.embed_rate = embed_rate
+        sequence = pseq.get_sim_sequence(model_guildid)
+        if sequence is None:
+            raise FileNotFoundError(f'Sim model of server {model_guildid} not found.')
+        # Ignored users and users who are not members are removed once here, instead of being skipped per post.
+        self.queue = pseq.PosterQueue(pseq.restrict_to_guild(sequence, guild))
+        self.topic = None
+        self.prefetcher = mp.ModelPrefetcher(model_guildid, PREFETCH_DEPTH)
+
+    def __str__(self):
+        return f'{self.guild}#{self.channel}'
+
+    def get_upcoming_userids(self):
+        """Gets the next PREFETCH_DEPTH userids in the queue that will post, refilling the queue if needed."""
+        return self.queue.peek(PREFETCH_DEPTH)
+
+    def get_wait_time(self):
+        return get_wait_time(self.avg, self.stddev)
+
+    async def step(self):
+        """Posts the next message of the simulation, and returns the number of seconds until the next one."""
+        while True:
+            next_user_member = None
+            # Pop next poster from queue
+            curr_userid = self.queue.pop()
+            if curr_userid is None:
+                print('no members of', self.guild, 'are in its sim model')
+                return self.get_wait_time()
+            next_user_member = self.guild.get_member(int(curr_userid))
+            if next_user_member is None:
+                print('cannot find user member for userid', curr_userid)
+                continue
+
+            model = await self.prefetcher.get(curr_userid)
+            if not model:
+                print('cannot get model for user with id', curr_userid)
+                continue
+            break
+
+        for _ in range(3):
+            if self.topic:
+                try:
+                    msg = model.make_sentence_with_start(self.topic)
+                    if msg:
+                        # If topic, remove topic from sentence.
+                        msg = msg.split(' ', 1)[1]
+                        break
+                except KeyError:
+                    msg = model.make_sentence()
+                    if msg:
+                        break
+        else:
+            msg = model.make_sentence()
+
+        if msg:
+            self.topic = msg.split(' ')[-1]
+
+            # Named members reply next.
+            for userid in find_names(msg):
+                if int(userid) not in config.IGNORE_USERS:
+                    self.queue.insert(random.randint(0, 1), userid)
+            msg = remove_mentions(msg, self.guild)
+            nick = next_user_member.display_name
+
+            # Add image
+            if random.random() < self.embed_rate:
+                embed = Embed()
+                link = get_attachment_link()
+                if link is not None:
+                    embed.set_image(url=link)
+                else:
+                    embed = None
+            else:
+                embed = None
+
+            try:
+                await wp.get_pool(self.channel).send(next_user_member, msg, embed=embed)
+                print(f'[{self.guild}] {nick} : {msg}')
+            except Exception as e:
+                print('unable to send webhook message for userid', curr_userid, 'Reason:', e)
+
+        # Load the models of the next posters while waiting.
+        self.prefetcher.prefetch(self.get_upcoming_userids())
+        return self.get_wait_time()
 
 
 class MarkovSimulator(commands.Bot):
@@ -53,10 +143,9 @@ class MarkovSimulator(commands.Bot):
         self.token = config.sim_token
         self.do_setup = args.do_setup
         self.debug_vals = args.debug_vals
+        self.session_args = args.sessions
+        self.scheduler = None
         if not args.do_setup:
-            self.topic = None
-            self.queue = []
-
             if args.post_avg:
                 self.avg = args.post_avg
             else:
@@ -77,25 +166,6 @@ class MarkovSimulator(commands.Bot):
         """Runs the bot with the token from the config file."""
         super().run(self.token, reconnect=True)
 
-    def open_model(self, userid):
-        with open(f'{consts.MODELS_DIRECTORY}{config.SIMULATOR_GUILD}/{userid}.json', 'r', encoding='utf-8-sig') as f:
-            model = markovify.Text.from_json(f.read())
-        return model
-
-    def fill_queue(self):
-        out = ''
-        while not out:
-            out = SIM_MODEL.make_sentence()
-        self.queue = out.split(' ')
-
-    def get_model(self, userid):
-        try:
-            with open(f'models/{config.SIMULATOR_GUILD}/{userid}.json', 'r', encoding='utf-8-sig') as f:
-                model = markovify.Text.from_json(f.read())
-            return model
-        except FileNotFoundError:
-            return None
-
     async def on_ready(self):
         if self.debug_vals:
             bot_guild = self.get_guild(config.DEBUG_SIMULATOR_GUILD)
@@ -103,91 +173,31 @@ class MarkovSimulator(commands.Bot):
         else:
             bot_guild = self.get_guild(config.SIMULATOR_GUILD)
             bot_channel = bot_guild.get_channel(config.SIMULATOR_CHANNEL)
-        print(f'Running bot on guild: {bot_guild}\nchannel: {bot_channel}')
         if self.do_setup:
+            print(f'Running bot on guild: {bot_guild}\nchannel: {bot_channel}')
             await setuph.setup_server(bot_channel)
-        else:
-            await self.do_sim(bot_guild, bot_channel)
-
-    async def do_sim(self, bot_guild, bot_channel):
-        while True:
-            next_user_member = None
-            # Pop next poster from queue
-            if len(self.queue) == 0:
-                self.fill_queue()
-            curr_userid = self.queue.pop(0)
-            if curr_userid == '':
-                continue
-            if int(curr_userid) in config.IGNORE_USERS:
-                print('ignored user', curr_userid)
-                continue
-            next_user_member = bot_guild.get_member(int(curr_userid))
-            if next_user_member is None:
-                print('cannot find user member for userid', curr_userid)
-                continue
-
-            model = self.get_model(curr_userid)
-            if not model:
-                print('cannot get model for user with id', curr_userid)
-                continue
-
-            for _ in range(3):
-                if self.topic:
-                    try:
-                        msg = model.make_sentence_with_start(self.topic)
-                        if msg:
-                            # If topic, remove topic from sentence.
-                            msg = msg.split(' ', 1)[1]
-                            break
-                    except KeyError:
-                        msg = model.make_sentence()
-                        if msg:
-                            break
+        elif self.scheduler is None:
+            # on_ready is called again after reconnects, but the sessions only need to be started once.
+            self.scheduler = sch.SimScheduler(GLOBAL_POST_RATE, GLOBAL_POST_BURST)
+            if self.session_args:
+                sessions = []
+                for guildid, channelid in self.session_args:
+                    guild = self.get_guild(guildid)
+                    sessions.append((guild, guild.get_channel(channelid) if guild else None, guildid))
             else:
-                msg = model.make_sentence()
-
-            if msg:
-                self.topic = msg.split(' ')[-1]
-                
-                msg = remove_mentions(msg, bot_guild)
-                nick = next_user_member.display_name
-
-                # Add image
-                if random.random() < self.embed_rate:
-                    embed = Embed()
-                    while True:
-                        link = get_link()
-                        if link is None or 'discordapp' in link:
-                            break
-                    if link is not None:
-                        embed.set_image(url=link)
-                    else:
-                        embed = None
-                else:
-                    embed = None
-
-                try:
-                    webhook_avatar = await next_user_member.avatar_url.read()
-                except Exception as e:
-                    print("unable to get user avatar for userid", curr_userid, "Reason:", e)
+                sessions = [(bot_guild, bot_channel, config.SIMULATOR_GUILD)]
+            for guild, channel, model_guildid in sessions:
+                if guild is None or channel is None:
+                    print('Unable to simulate guild', model_guildid, 'Reason: the bot cannot see the guild or channel.')
                     continue
-
+                print(f'Running bot on guild: {guild}\nchannel: {channel}')
                 try:
-                    webhook = await bot_channel.create_webhook(name=nick, avatar=webhook_avatar)
-                except Exception as e:
-                    print("unable to create webhook for userid", curr_userid, "Reason:", e)
+                    session = SimSession(guild, channel, model_guildid, self.avg, self.stddev, self.embed_rate)
+                except (FileNotFoundError, NameError) as e:
+                    print('Unable to simulate guild', guild, 'Reason:', e)
                     continue
-
-                try:
-                    await webhook.send(msg, embed=embed)
-                    print(nick, ':', msg)
-                except Exception as e:
-                    print('unable to send webhook message for userid', curr_userid, 'Reason:', e)
-                finally:
-                    await webhook.delete()
-
-            wait_time = get_wait_time(self.avg, self.stddev)
-            await asyncio.sleep(wait_time)
+                self.scheduler.schedule(session)
+            await self.scheduler.run()
 
 
 if __name__ == '__main__':
@@ -202,6 +212,10 @@ if __name__ == '__main__':
                         help=f"The average standard deviation between posts (default {POST_STDDEV})")
     parser.add_argument('--embed', dest='embed', type=float, nargs=1,
                         help=f"Percent of posts that will contain images (default {EMBED_RATE})")
+    parser.add_argument('--session', dest='sessions', type=int, nargs=2, action='append',
+                        metavar=('GUILD', 'CHANNEL'),
+                        help="Simulates a guild's channel with the guild's models (can be repeated; default: the "
+                             "simulator guild and channel in config.py)")
     args = parser.parse_args()
 
     print('running')
@@ -0,0 +1,36 @@
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import config
+except ImportError:
+    # config.py is written for each deployment (see the README), so the tests fall back to settings of their own.
+    config = types.ModuleType('config')
+    config.token = config.sim_token = ''
+    config.sentiment_token = ''
+    config.SIMULATOR_GUILD = 1
+    config.SIMULATOR_CHANNEL = 2
+    config.DEFAULT_GUILD_ID = 1
+    config.IGNORE_USERS = []
+    sys.modules['config'] = config
+
+from benchmarks import synthetic
+from helpers.converter import Post
+
+
+@pytest.fixture
+def make_text():
+    """Makes the markovify model of a user with num_posts synthetic posts, like converter.convert_user does."""
+    def make(num_posts, seed=0):
+        return Post(synthetic.generate_corpus(num_posts, seed))
+    return make
+
+
+@pytest.fixture
+def text(make_text):
+    return make_text(300)
@@ -0,0 +1,89 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from helpers import admission as am
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the clock of the admission module with one that only moves when clock.now is set."""
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(am, 'time', SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_token_bucket(clock):
+    bucket = am.TokenBucket(rate=2, capacity=3)
+    assert bucket.try_acquire(2)
+    assert bucket.get_wait_time(2) == pytest.approx(0.5)
+    assert not bucket.try_acquire(2)
+    clock.now += 0.5
+    assert bucket.try_acquire(2)
+    assert not bucket.is_full()
+    clock.now += 10
+    assert bucket.is_full()
+    assert bucket.tokens == 3
+    # Requests costing more than the capacity only wait for a full bucket.
+    assert bucket.try_acquire(5)
+    assert bucket.get_wait_time(5) == pytest.approx(1.5)
+
+
+def test_take_tokens(clock):
+    admission = am.Admission()
+    admission.LIMITS = {'user': (1, 2), 'channel': (1, 3), 'guild': (0.5, 4)}
+    admission.take_tokens(1, 10, 100, cost=2)
+    with pytest.raises(am.RateLimitedError) as error:
+        admission.take_tokens(1, 10, 100)
+    assert error.value.scope == 'user'
+    assert error.value.retry_after == pytest.approx(1)
+
+    # A rejected request takes no tokens.
+    admission.take_tokens(1, 10, 101)
+    with pytest.raises(am.RateLimitedError) as error:
+        admission.take_tokens(1, 11, 102, cost=2)
+    assert error.value.scope == 'guild'
+    assert error.value.retry_after == pytest.approx(2)
+    admission.take_tokens(1, 11, 102)
+    assert admission.stats()['rejected'] == {'user': 1, 'channel': 0, 'guild': 1, 'busy': 0}
+
+
+def test_admit_concurrency():
+    async def run():
+        admission = am.Admission(max_concurrent=2, max_wait=5)
+        running = []
+        max_running = 0
+
+        async def request(userid):
+            nonlocal max_running
+            async with admission.admit(1, userid, userid):
+                running.append(userid)
+                max_running = max(max_running, len(running))
+                await asyncio.sleep(0.01)
+                running.remove(userid)
+
+        await asyncio.gather(*(request(userid) for userid in range(6)))
+        return admission.stats(), max_running
+
+    stats, max_running = asyncio.run(run())
+    assert max_running == 2
+    assert stats['admitted'] == 6
+    assert stats['deferred'] == 4
+    assert stats['running'] == stats['waiting'] == 0
+
+
+def test_admit_busy():
+    async def run():
+        admission = am.Admission(max_concurrent=1, max_wait=0.05)
+        async with admission.admit(1, 1, 1):
+            with pytest.raises(am.BusyError):
+                async with admission.admit(1, 2, 2):
+                    pass
+        async with admission.admit(1, 3, 3):
+            pass
+        return admission.stats()
+
+    stats = asyncio.run(run())
+    assert stats['rejected']['busy'] == 1
+    assert stats['admitted'] == 2
@@ -0,0 +1,76 @@
+import random
+from itertools import islice
+
+import markovify
+import pytest
+
+from helpers import compiled_model as cm
+
+
+def test_chain_matches_markovify(text):
+    assert cm.CompiledText.from_text(text).to_chain_dict() == text.chain.model
+
+
+def test_save_and_load(text, tmp_path):
+    compiled = cm.compile_model(text)
+    path = str(tmp_path / f'1{cm.COMPILED_MODEL_EXTENSION}')
+    compiled.save(path)
+    loaded = cm.CompiledText.load(path)
+    assert loaded.to_chain_dict() == text.chain.model
+    assert len(loaded.novelty_filters) == 1
+
+
+def test_walk_matches_markovify(text):
+    compiled = cm.CompiledText.from_text(text)
+    for seed in range(100):
+        random.seed(seed)
+        expected = text.chain.walk()
+        random.seed(seed)
+        assert [compiled.get_word(word_id) for word_id in compiled.walk()] == expected
+
+
+def test_get_word_id(text):
+    compiled = cm.CompiledText.from_text(text)
+    for word_id in range(compiled.vocab_size):
+        assert compiled.get_word_id(compiled.get_word(word_id)) == word_id
+    assert compiled.get_word_id('not a word in the corpus') is None
+
+
+def test_make_sentence_with_start(text):
+    compiled = cm.compile_model(text)
+    random.seed(0)
+    sentence = compiled.make_sentence_with_start('the', tries=100)
+    assert sentence.split(' ')[0] == 'the'
+    sentence = compiled.make_sentence_with_start('lol', strict=False, tries=100)
+    assert 'lol' in sentence.split(' ')
+    with pytest.raises(KeyError):
+        compiled.make_sentence_with_start('not_a_word')
+
+
+def test_combine_matches_markovify(make_text):
+    texts = [make_text(200, seed) for seed in range(3)]
+    expected = markovify.combine(texts).chain.model
+    assert cm.combine([cm.compile_model(text) for text in texts]).to_chain_dict() == expected
+    # Mixed plain and compiled models.
+    assert cm.combine([texts[0], cm.compile_model(texts[1]), texts[2]]).to_chain_dict() == expected
+
+
+def test_combine_keeps_novelty_filters(make_text):
+    texts = [make_text(200, seed) for seed in range(2)]
+    combined = cm.combine([cm.compile_model(texts[0]), texts[1]])
+    assert len(combined.novelty_filters) == 2
+
+
+def test_make_sentences(text):
+    compiled = cm.compile_model(text)
+    init_states = compiled.find_states_starting_with(('the',))
+    random.seed(0)
+    sentences = [sentence for sentence in islice(compiled.make_sentences(init_states, tries=100), 20) if sentence]
+    assert sentences
+    for sentence in sentences:
+        assert sentence.split(' ')[0] == 'the'
+        assert compiled.test_sentence_output(sentence.split(' '), markovify.text.DEFAULT_MAX_OVERLAP_RATIO,
+                                             markovify.text.DEFAULT_MAX_OVERLAP_TOTAL)
+    assert list(compiled.make_sentences([])) == []
+    with pytest.raises(KeyError):
+        next(compiled.make_sentences([('the', 'not_a_word')]))
@@ -0,0 +1,82 @@
+import random
+from types import SimpleNamespace
+
+from helpers import member_index as mi
+
+
+def make_member(memberid, name, nick=None):
+    return SimpleNamespace(id=memberid, name=name, nick=nick)
+
+
+def random_name(rng):
+    return ''.join(rng.choice('abcAB ') for _ in range(rng.randint(1, 8)))
+
+
+def make_members(num_members, seed=0):
+    rng = random.Random(seed)
+    return [make_member(memberid, random_name(rng), random_name(rng) if rng.random() < 0.5 else None)
+            for memberid in range(num_members)]
+
+
+def find_exact(members, name):
+    """Reference for MemberIndex.find_exact: a scan of every member, like discord.utils.find."""
+    name = name.lower()
+    by_nick = [member.id for member in members if member.nick and member.nick.lower() == name]
+    return by_nick or [member.id for member in members if member.name.lower() == name]
+
+
+def find_substring(members, name):
+    name = name.lower()
+    return [member.id for member in members
+            if name in member.name.lower() or (member.nick and name in member.nick.lower())]
+
+
+def find_display_substring(members, name):
+    return [member.id for member in members if mi.compact(name) in mi.compact(member.nick or member.name)]
+
+
+def test_find_matches_scan():
+    members = make_members(300)
+    index = mi.MemberIndex(members)
+    rng = random.Random(1)
+    for _ in range(300):
+        name = random_name(rng)
+        assert index.find_exact(name) == find_exact(members, name)
+        assert index.find_substring(name) == find_substring(members, name)
+        assert index.find_display_substring(name) == find_display_substring(members, name)
+
+
+def test_add_and_remove():
+    members = make_members(100)
+    index = mi.MemberIndex(members)
+    for memberid in range(0, 100, 3):
+        index.remove(memberid)
+    index.remove(1000)
+    renamed = make_member(1, 'Someone Else', 'aAbB')
+    index.add(renamed)
+    members = [renamed if member.id == 1 else member for member in members if member.id % 3]
+
+    assert len(index) == len(members)
+    assert sorted(index.member_ids) == sorted(member.id for member in members)
+    assert sorted(index.random_ids(len(members) + 1)) == sorted(member.id for member in members)
+    assert index.find_exact('someone else') == [1]
+    assert index.find_exact('AABB') == find_exact(members, 'aabb')
+    assert index.find_display_substring('bb') == find_display_substring(members, 'bb')
+    rng = random.Random(2)
+    for _ in range(100):
+        name = random_name(rng)
+        assert index.find_exact(name) == find_exact(members, name)
+        assert index.find_substring(name) == find_substring(members, name)
+
+
+def test_get_index_rebuilds_once_chunked():
+    guild = SimpleNamespace(id=-1, members=make_members(10), chunked=False)
+    index = mi.get_index(guild)
+    assert mi.get_index(guild) is index
+    guild.members = make_members(20)
+    guild.chunked = True
+    index = mi.get_index(guild)
+    assert len(index) == 20
+    guild.members = []
+    assert mi.get_index(guild) is index
+    del mi.INDEXES[guild.id]
@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+from consts import MODELS_DIRECTORY
+from helpers import compiled_model as cm
+from helpers import model_cache as mc
+from helpers import model_store as ms
+
+GUILD_ID = '1'
+
+
+@pytest.fixture
+def models(make_text, tmp_path, monkeypatch):
+    """Saves the compiled models of three users of a guild, in a models directory under tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(f'{MODELS_DIRECTORY}{GUILD_ID}')
+    texts = {str(userid): make_text(100, userid) for userid in range(3)}
+    for userid, text in texts.items():
+        cm.compile_model(text).save(mc.get_compiled_model_path(GUILD_ID, userid))
+    return texts
+
+
+def test_pack_round_trip(models):
+    ms.pack_guild(GUILD_ID)
+    store = ms.get_store(GUILD_ID)
+    for userid, text in models.items():
+        assert store.has_model(userid)
+        model = store.get_model(userid)
+        assert model.to_chain_dict() == text.chain.model
+        assert store.get_nbytes(userid) == sum(array.nbytes for array in model.get_arrays().values())
+    assert not store.has_model('3')
+    assert store.get_model('3') is None
+
+
+def test_store_reopens_new_pack(models):
+    assert ms.get_store(GUILD_ID) is None
+    ms.pack_guild(GUILD_ID)
+    store = ms.get_store(GUILD_ID)
+    assert ms.get_store(GUILD_ID) is store
+
+    os.remove(mc.get_compiled_model_path(GUILD_ID, '2'))
+    ms.pack_guild(GUILD_ID)
+    os.utime(ms.get_pack_path(GUILD_ID), ns=(store.mtime_ns + 10**9, store.mtime_ns + 10**9))
+    new_store = ms.get_store(GUILD_ID)
+    assert new_store is not store
+    assert not new_store.has_model('2')
+
+
+def test_cache_drops_replaced_pack(models, make_text):
+    ms.pack_guild(GUILD_ID)
+    cache = mc.ModelCache()
+    combined_cache = mc.CombinedModelCache()
+    cache.stale_callbacks.append(combined_cache.invalidate)
+    ms.REPLACED_CALLBACKS.append(cache.remove_store)
+    try:
+        entries = [cache.get_entry(GUILD_ID, userid) for userid in models]
+        combined_cache.get(entries)
+        store = ms.get_store(GUILD_ID)
+        assert cache.stats()['bytes'] == sum(model.get_root_index_nbytes() for _, model in entries) > 0
+
+        text = make_text(100, 10)
+        cm.compile_model(text).save(mc.get_compiled_model_path(GUILD_ID, '0'))
+        ms.pack_guild(GUILD_ID)
+        os.utime(ms.get_pack_path(GUILD_ID), ns=(store.mtime_ns + 10**9, store.mtime_ns + 10**9))
+        del entries
+        assert cache.get(GUILD_ID, '0').to_chain_dict() == text.chain.model
+        # The models of the old pack are dropped, so that it could be unmapped.
+        assert cache.stats()['entries'] == 1
+        assert combined_cache.stats()['entries'] == 0
+        assert store._map.closed
+    finally:
+        ms.REPLACED_CALLBACKS.remove(cache.remove_store)
+
+
+def test_cache_reloads_changed_model(models, make_text):
+    cache = mc.ModelCache()
+    combined_cache = mc.CombinedModelCache()
+    cache.stale_callbacks.append(combined_cache.invalidate)
+    key, model = cache.get_entry(GUILD_ID, '0')
+    assert cache.get_entry(GUILD_ID, '0') == (key, model)
+    assert cache.stats()['hits'] == 1
+    combined_cache.get([(key, model), cache.get_entry(GUILD_ID, '1')])
+    assert combined_cache.stats()['entries'] == 1
+
+    text = make_text(100, 10)
+    path = mc.get_compiled_model_path(GUILD_ID, '0')
+    cm.compile_model(text).save(path)
+    os.utime(path, ns=(key[2] + 10**9, key[2] + 10**9))
+    new_key, new_model = cache.get_entry(GUILD_ID, '0')
+    assert new_key != key
+    assert new_model.to_chain_dict() == text.chain.model
+    # The old version and every combined model containing it are dropped.
+    assert cache.stats()['entries'] == 2
+    assert combined_cache.stats()['entries'] == 0
+
+
+def test_cache_evicts_least_recently_used():
+    cache = mc.LRUCache(10)
+    cache.put('a', 1, 4)
+    cache.put('b', 2, 4)
+    cache.lookup('a')
+    cache.put('c', 3, 4)
+    assert cache.lookup('b') is None
+    assert cache.lookup('a') == 1
+    assert cache.lookup('c') == 3
+    assert cache.stats()['bytes'] == 8
+    cache.put('d', 4, 11)
+    assert cache.lookup('d') is None
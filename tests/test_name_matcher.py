@@ -0,0 +1,91 @@
+import os
+import random
+
+import ujson
+
+from helpers import name_matcher as nm
+
+
+def random_text(rng, length):
+    return ''.join(rng.choice('abcd ') for _ in range(length))
+
+
+def make_names(num_users, seed=0):
+    """Makes a dict of userid -> list of names, no two users sharing a name."""
+    rng = random.Random(seed)
+    names = {}
+    seen = set()
+    for userid in range(num_users):
+        user_names = {random_text(rng, rng.randint(1, 6)) for _ in range(rng.randint(1, 3))}
+        names[str(userid)] = sorted(user_names - seen)
+        seen |= user_names
+    return names
+
+
+def find(names, text):
+    """Reference for NameMatcher.find: `name in text` for every name, ordered by where the name first ends."""
+    ends = {}
+    for userid, user_names in names.items():
+        for name in user_names:
+            start = text.find(name)
+            if start >= 0:
+                # Of the names ending at the same character, the longest is found first.
+                key = (start + len(name), -len(name))
+                ends[userid] = min(ends.get(userid, key), key)
+    return sorted(ends, key=ends.get)
+
+
+def test_find_matches_reference():
+    names = make_names(200)
+    matcher = nm.NameMatcher.from_names(names)
+    rng = random.Random(1)
+    for _ in range(300):
+        text = random_text(rng, rng.randint(0, 40))
+        assert matcher.find(text) == find(names, text)
+
+
+def test_add_after_build():
+    matcher = nm.NameMatcher.from_names({'1': ['he'], '2': ['she']})
+    assert matcher.find('ushers') == ['2', '1']
+    matcher.add('3', 'hers')
+    matcher.add('1', 'his')
+    matcher.add('4', '')
+    matcher.build()
+    assert matcher.find('ushers') == ['2', '1', '3']
+    assert matcher.find('this') == ['1']
+    assert matcher.find('HERS') == []
+
+
+def write(path, data, mode='w'):
+    with open(path, mode, encoding='utf-8') as f:
+        f.write(data)
+    # Make every write visible as a change, however coarse the filesystem's timestamps are.
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_directory(tmp_path):
+    names_path = str(tmp_path / 'names.txt')
+    bots_path = str(tmp_path / 'bots.json')
+    directory = nm.NameDirectory(names_path, bots_path, check_interval=0)
+    assert directory.find('alice') == []
+
+    write(names_path, '1;alice\n2;bob\n')
+    write(bots_path, ujson.dumps({'3': {'names': ['robot']}}))
+    assert directory.find('bob and alice') == ['2', '1']
+    assert directory.find('a robot') == ['3']
+
+    # Appended names are added to the same automaton, once their line is complete.
+    matcher = directory.matcher
+    write(names_path, '4;carol\n5;dav', 'a')
+    assert directory.find('carol and dave') == ['4']
+    write(names_path, 'e\n', 'a')
+    assert directory.find('carol and dave') == ['4', '5']
+    assert directory.matcher is matcher
+
+    # Rewriting the names file or the bots file rebuilds it.
+    write(names_path, '1;alice\n')
+    assert directory.find('bob and alice') == ['1']
+    assert directory.matcher is not matcher
+    write(bots_path, ujson.dumps({}))
+    assert directory.find('a robot') == []
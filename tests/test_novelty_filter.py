@@ -0,0 +1,61 @@
+import random
+
+import markovify
+
+from helpers import novelty_filter as nf
+
+MAX_OVERLAP_RATIO = markovify.text.DEFAULT_MAX_OVERLAP_RATIO
+MAX_OVERLAP_TOTAL = markovify.text.DEFAULT_MAX_OVERLAP_TOTAL
+
+
+def passes_on_words(text, words, max_overlap_ratio, max_overlap_total):
+    """markovify.Text.test_sentence_output, only matching whole words like the filter."""
+    overlap_max = min(max_overlap_total, int(round(max_overlap_ratio * len(words))))
+    rejoined_text = f' {text.rejoined_text} '
+    for i in range(max(len(words) - overlap_max, 1)):
+        if f' {text.word_join(words[i:i + overlap_max + 1])} ' in rejoined_text:
+            return False
+    return True
+
+
+def get_sentences(text, num_sentences):
+    """Gets sentences walked from the chain, and sentences of random words of the text, which are mostly novel."""
+    random.seed(0)
+    vocab = sorted({word for sentence in text.parsed_sentences for word in sentence})
+    sentences = [text.chain.walk() for _ in range(num_sentences)]
+    sentences += [random.sample(vocab, random.randint(1, 10)) for _ in range(num_sentences)]
+    return sentences
+
+
+def test_matches_markovify(text):
+    novelty_filter = nf.NoveltyFilter.build(text.parsed_sentences)
+    num_rejected = num_false_positives = 0
+    sentences = get_sentences(text, 500)
+    for words in sentences:
+        expected = passes_on_words(text, words, MAX_OVERLAP_RATIO, MAX_OVERLAP_TOTAL)
+        passed = novelty_filter.test_sentence_output(words, MAX_OVERLAP_RATIO, MAX_OVERLAP_TOTAL)
+        # Markovify also rejects runs that only match parts of words, and the filter has false positives.
+        assert text.test_sentence_output(words, MAX_OVERLAP_RATIO, MAX_OVERLAP_TOTAL) <= expected
+        assert passed <= expected
+        if not expected:
+            num_rejected += 1
+        elif not passed:
+            num_false_positives += 1
+    assert 0 < num_rejected < len(sentences)
+    assert num_false_positives <= 0.02 * (len(sentences) - num_rejected)
+
+
+def test_short_runs(text):
+    novelty_filter = nf.NoveltyFilter.build(text.parsed_sentences)
+    for words in text.parsed_sentences[:100]:
+        assert not novelty_filter.test_sentence_output(words, 0, 1)
+    assert novelty_filter.test_sentence_output([], MAX_OVERLAP_RATIO, MAX_OVERLAP_TOTAL)
+
+
+def test_arrays_round_trip(text):
+    novelty_filter = nf.NoveltyFilter.build(text.parsed_sentences)
+    loaded = nf.NoveltyFilter.from_arrays(novelty_filter.get_arrays())
+    for words in get_sentences(text, 100):
+        assert (loaded.test_sentence_output(words, MAX_OVERLAP_RATIO, MAX_OVERLAP_TOTAL)
+                == novelty_filter.test_sentence_output(words, MAX_OVERLAP_RATIO, MAX_OVERLAP_TOTAL))
+    assert nf.NoveltyFilter.from_arrays({}) is None
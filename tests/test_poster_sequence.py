@@ -0,0 +1,118 @@
+import random
+from collections import Counter
+
+import markovify
+import numpy as np
+import pytest
+
+from helpers import poster_sequence as pseq
+
+
+def make_sequences(num_sequences, num_users=20, seed=0):
+    """Makes channels of posts where users mostly reply to the users next to them."""
+    rng = random.Random(seed)
+    sequences = []
+    for _ in range(num_sequences):
+        userid = rng.randrange(num_users)
+        sequence = []
+        for _ in range(rng.randint(1, 30)):
+            sequence.append(str(userid))
+            userid = (userid + rng.choice((-1, 1, 1, 2)) * rng.randint(1, 2)) % num_users
+        sequences.append(sequence)
+    return sequences
+
+
+def get_transitions(sequences):
+    return Counter(pair for sequence in sequences for pair in zip(sequence, sequence[1:]))
+
+
+def get_counts(sequence):
+    """Gets the ({(userid, next userid): count}, {userid: number of posts}) of a PosterSequence."""
+    transitions = {}
+    for i, userid in enumerate(sequence.userids):
+        for j in range(sequence.indptr[i], sequence.indptr[i + 1]):
+            transitions[(userid, sequence.userids[sequence.indices[j]])] = sequence.counts[j]
+    return transitions, dict(zip(sequence.userids, sequence.post_counts))
+
+
+def test_from_sequences():
+    sequences = make_sequences(50)
+    transitions, post_counts = get_counts(pseq.PosterSequence.from_sequences(sequences))
+    assert transitions == get_transitions(sequences)
+    assert post_counts == Counter(userid for sequence in sequences for userid in sequence)
+
+
+def test_from_markov():
+    """The chain of an older markovify user model has the same counts as the chain of the same posts."""
+    sequences = make_sequences(50)
+    model = markovify.NewlineText('\n'.join(' '.join(sequence) for sequence in sequences), retain_original=False)
+    assert get_counts(pseq.PosterSequence.from_markov(model)) == get_counts(
+        pseq.PosterSequence.from_sequences(sequences))
+
+
+def test_sample_matches_transitions():
+    sequences = make_sequences(200)
+    sequence = pseq.PosterSequence.from_sequences(sequences)
+    chains = np.array(sequence.sample(num_chains=200, length=200, rng=np.random.RandomState(0))).reshape(200, 200)
+    sampled = get_transitions(chains.tolist())
+    expected = get_transitions(sequences)
+    # Every user has someone after them, so the chains never restart and only follow transitions of the data.
+    assert all(sequence.indptr[1:] > sequence.indptr[:-1])
+    assert set(sampled) <= set(expected)
+    assert sum(sampled.values()) == 200 * 199
+    for userid in sequence.userids:
+        total = sum(count for (source, _), count in expected.items() if source == userid)
+        sampled_total = sum(count for (source, _), count in sampled.items() if source == userid)
+        for (source, target), count in expected.items():
+            if source == userid:
+                assert sampled[(source, target)] / sampled_total == pytest.approx(count / total, abs=0.05)
+
+
+def test_sample_restarts_at_dead_ends():
+    sequence = pseq.PosterSequence.from_sequences([['1', '2'], ['1', '2'], ['3']])
+    chains = sequence.sample(num_chains=1000, length=2, rng=np.random.RandomState(0))
+    starts = Counter(chains[::2])
+    # Chains start from users drawn by their number of posts, and restart the same way after user 2.
+    assert starts['1'] / 1000 == pytest.approx(0.4, abs=0.05)
+    assert starts['3'] / 1000 == pytest.approx(0.2, abs=0.05)
+    assert all(chains[i + 1] == '2' for i in range(0, len(chains), 2) if chains[i] == '1')
+    assert pseq.PosterSequence.from_sequences([]).sample() == []
+
+
+def test_restrict():
+    sequences = make_sequences(50)
+    allowed = {str(userid) for userid in range(0, 20, 2)}
+    restricted = pseq.PosterSequence.from_sequences(sequences).restrict(allowed)
+    transitions, post_counts = get_counts(restricted)
+    assert set(restricted.userids) <= allowed
+    assert transitions == {pair: count for pair, count in get_transitions(sequences).items() if set(pair) <= allowed}
+    assert post_counts == {userid: count for userid, count in Counter(sum(sequences, [])).items() if userid in allowed}
+    assert set(restricted.sample(rng=np.random.RandomState(0))) <= allowed
+
+
+def test_save_and_load(tmp_path):
+    sequence = pseq.PosterSequence.from_sequences(make_sequences(50))
+    path = str(tmp_path / 'server_sim_model.npz')
+    sequence.save(path)
+    assert get_counts(pseq.load(path)) == get_counts(sequence)
+    assert pseq.load(str(tmp_path / 'other_sim_model.npz')) is None
+
+
+def test_load_markov_model(tmp_path):
+    sequences = make_sequences(10)
+    model = markovify.NewlineText('\n'.join(' '.join(sequence) for sequence in sequences), retain_original=False)
+    with open(tmp_path / 'server_sim_model.json', 'w', encoding='utf-8') as f:
+        f.write(model.to_json())
+    assert get_counts(pseq.load(str(tmp_path / 'server_sim_model.json'))) == get_counts(
+        pseq.PosterSequence.from_markov(model))
+
+
+def test_poster_queue():
+    queue = pseq.PosterQueue(pseq.PosterSequence.from_sequences([['1', '2', '1', '2']]), num_chains=2, length=3)
+    assert len(queue.peek(2)) == 2
+    assert len(queue) == 6
+    queue.insert(0, '3')
+    assert queue.pop() == '3'
+    for _ in range(12):
+        assert queue.pop() in ('1', '2')
+    assert pseq.PosterQueue(pseq.PosterSequence.from_sequences([])).pop() is None